@@ -0,0 +1,137 @@
+"""
+    Beatmap sources against local stand-in mirrors: one serving an error page with 200, one failing with
+    500, one trickling bytes, one serving something that isn't a zip and a healthy one that accepts byte
+    ranges.  Prints which source each download ended up on, how long it took and how the pool orders
+    the sources afterwards.
+
+        python bench_beatmap_sources.py [set size in KiB]
+"""
+
+import io
+import os
+import re
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from musicbot.beatmap_sources import BeatmapSourcePool, MirrorBeatmapSource
+
+
+def make_osz(size):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('audio.mp3', os.urandom(size))
+        z.writestr('Artist - Title (Mapper) [Normal].osu', 'osu file format v14\n')
+    return buf.getvalue()
+
+
+class StandInMirror(BaseHTTPRequestHandler):
+    """
+        /<behaviour>/<id>, the behaviour being one of ok, html, error, trickle or garbage.
+    """
+
+    osz = b''
+    _RANGE_RE = re.compile(r'bytes=(\d+)-(\d+)')
+
+    def do_GET(self):
+        behaviour, _, osz_id = self.path.strip('/').partition('/')
+        getattr(self, 'serve_' + behaviour)(osz_id)
+
+    def serve_ok(self, osz_id):
+        body = self.osz
+        match = self._RANGE_RE.match(self.headers.get('Range', ''))
+        if match:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Type', 'application/x-osu-beatmap-archive')
+        self.send_header('Content-Disposition', 'attachment; filename="%s Artist - Title.osz"' % osz_id)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except OSError:
+            # The pool drops the first response of a big set and asks for ranges instead
+            pass
+
+    def serve_html(self, osz_id):
+        body = b'<html><body>Beatmap not found, try again later</body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_error(self, osz_id):
+        self.send_error(500)
+
+    def serve_trickle(self, osz_id):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(self.osz)))
+        self.end_headers()
+        try:
+            for i in range(len(self.osz)):
+                self.wfile.write(self.osz[i:i + 1])
+                self.wfile.flush()
+                time.sleep(0.1)
+        except OSError:
+            pass
+
+    def serve_garbage(self, osz_id):
+        body = os.urandom(1024)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(size_kib=6 * 1024):
+    StandInMirror.osz = make_osz(size_kib * 1024)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInMirror)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%s' % server.server_address[1]
+
+    sources = [MirrorBeatmapSource(base + '/%s/{id}' % b, timeout=2)
+               for b in ('html', 'error', 'trickle', 'garbage', 'ok')]
+    for source in sources:
+        source.name = source.url_template.split('/')[3]
+
+    pool = BeatmapSourcePool(sources, range_connections=4, range_min_size=1024 * 1024)
+
+    dest = tempfile.mkdtemp()
+    try:
+        for osz_id in (1001, 1002):
+            started = time.perf_counter()
+            fname, path = pool.fetch(osz_id, dest)
+            elapsed = time.perf_counter() - started
+
+            with zipfile.ZipFile(path) as z:
+                members = len(z.namelist())
+            print('set %s: %s, %.1f KiB with %s members in %.2fs' % (
+                osz_id, fname, os.path.getsize(path) / 1024, members, elapsed))
+            print('  order now: %s' % ', '.join(s.name for s in pool.ordered()))
+
+        print('left behind: %s' % (sorted(set(os.listdir(dest)) - {'1001 Artist - Title.osz', '1002 Artist - Title.osz'}) or 'nothing'))
+    finally:
+        server.shutdown()
+        shutil.rmtree(dest)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,116 @@
+"""
+    Memory of a large queue: builds a 10,000 entry queue the way an import does, then again the way
+    QueueJournal restores one, and prints what it costs per entry.  Also checks that queued entries
+    don't keep the members who queued them alive.
+
+        python bench_queue_memory.py [entries]
+"""
+
+import gc
+import sys
+import time
+import weakref
+import tracemalloc
+
+from musicbot.entry import URLPlaylistEntry, entry_from_dict
+from musicbot.entry_queue import EntryQueue
+
+
+class FakeGuild:
+    def __init__(self):
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class FakeMember:
+    def __init__(self, member_id, guild):
+        self.id = member_id
+        self.name = 'member%s' % member_id
+        self.guild = guild
+        # What a cached discord.Member drags along, roughly
+        self.roles = [object() for _ in range(5)]
+        self.activity = {'name': 'x' * 100}
+
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.id = 1
+        self.guild = guild
+
+
+class FakeBot:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+    def get_user(self, user_id):
+        return None
+
+
+class FakeDownloader:
+    download_folder = 'audio_cache'
+
+
+class FakePlaylist:
+    def __init__(self, bot):
+        self.bot = bot
+        self.downloader = FakeDownloader()
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, peak, elapsed
+
+
+def main(count=10000):
+    guild = FakeGuild()
+    channel = FakeChannel(guild)
+    playlist = FakePlaylist(FakeBot(channel))
+
+    members = [FakeMember(100 + i, guild) for i in range(50)]
+    guild.members = {m.id: m for m in members}
+
+    def build():
+        return EntryQueue(URLPlaylistEntry(
+            playlist,
+            'https://www.youtube.com/watch?v=%011d' % i,
+            'Some song title number %s (Official Music Video)' % i,
+            200 + i % 100,
+            'audio_cache/youtube-%011d-Some_song_title_number_%s.m4a' % (i, i),
+            channel=channel,
+            author=members[i % len(members)],
+        ) for i in range(count))
+
+    queue, size, peak, elapsed = measure(build)
+    print('queued     %6s entries: %8.1f KiB, %5.0f B/entry, peak %8.1f KiB, %6.1f ms' % (
+        len(queue), size / 1024, size / len(queue), peak / 1024, elapsed * 1000))
+
+    saved = [e.to_dict() for e in queue]
+    restored, size, peak, elapsed = measure(lambda: EntryQueue(entry_from_dict(playlist, d) for d in saved))
+    print('restored   %6s entries: %8.1f KiB, %5.0f B/entry, peak %8.1f KiB, %6.1f ms' % (
+        len(restored), size / 1024, size / len(restored), peak / 1024, elapsed * 1000))
+
+    entry = queue[0]
+    print('entry has __dict__: %s, meta author: %s' % (hasattr(entry, '__dict__'), entry.meta['author'].name))
+
+    # Members leaving: nothing but the guild's cache should have held them
+    refs = [weakref.ref(m) for m in members]
+    guild.members.clear()
+    del members
+    gc.collect()
+    print('members still alive after leaving: %s/%s' % (sum(r() is not None for r in refs), len(refs)))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
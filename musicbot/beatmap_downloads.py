@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import functools
+import traceback
+
+
+class DownloadProgress:
+    """
+        Byte counter shared with the downloading thread.  Only the thread writes to it.
+    """
+
+    def __init__(self, total=0):
+        self.total = total
+        self.done = 0
+        self.started = time.time()
+
+    def __str__(self):
+        done_mb = self.done / 1024 / 1024
+        if self.total:
+            return '{:.1f}/{:.1f}MB ({:.0%})'.format(done_mb, self.total / 1024 / 1024, self.done / self.total)
+        return '{:.1f}MB'.format(done_mb)
+
+
+class BeatmapDownloadManager:
+    """
+        Process-wide beatmap set downloader.
+
+        Only one download runs per beatmap set id, in a task of its own that every requester awaits, so
+        a requester that is cancelled doesn't take the download away from the others.
+        Downloads are limited to `max_concurrent` at a time, every `busymsg` of a set is edited with
+        the byte progress at most every `progress_interval` seconds, and finished sets are remembered so
+        Playlist.chk_beatmapset_found does not have to rescan the Songs directory.
+    """
+
+    def __init__(self, bot, max_concurrent=2, progress_interval=5):
+        self.bot = bot
+        self.loop = bot.loop
+        self.progress_interval = progress_interval
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._inflight = {}
+        self._watchers = {}
+        self._known = {}
+
+    def lookup(self, osz_id):
+        """
+            Returns the song directory or archive of an already downloaded set, if it still exists.
+        """
+        path = self._known.get(str(osz_id))
+        if path and os.path.exists(path):
+            return path
+
+    def register(self, osz_id, path):
+        self._known[str(osz_id)] = path
+
+    def is_downloading(self, osz_id):
+        return str(osz_id) in self._inflight
+
+    async def fetch(self, playlist, osz_id, busymsg=None):
+        osz_id = str(osz_id)
+
+        path = self.lookup(osz_id)
+        if path:
+            return path
+
+        if busymsg:
+            self._watchers.setdefault(osz_id, []).append((busymsg, busymsg.content))
+
+        task = self._inflight.get(osz_id)
+        if task:
+            print("[osu!譜面ダウンローダー] %s はダウンロード中です。完了を待ちます。" % osz_id)
+        else:
+            task = self._inflight[osz_id] = self.loop.create_task(self._run(playlist, osz_id))
+            # Retrieve it so a failure nobody waits for anymore doesn't get logged as never retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        return await asyncio.shield(task)
+
+    async def _run(self, playlist, osz_id):
+        try:
+            path = await self._download(playlist, osz_id)
+            self.register(osz_id, path)
+            return path
+
+        finally:
+            del self._inflight[osz_id]
+            self._watchers.pop(osz_id, None)
+
+    async def _download(self, playlist, osz_id):
+        async with self._semaphore:
+            progress = DownloadProgress()
+            reporter = self.loop.create_task(self._report_progress(osz_id, progress))
+            try:
+                fname, path = await self.loop.run_in_executor(
+                    self.bot.downloader.thread_pool,
+                    functools.partial(
+                        self.bot.beatmap_sources.fetch, osz_id, '.', progress,
+                        skip=lambda f: os.path.splitext(f)[0] in playlist.osu_apl()))
+            finally:
+                reporter.cancel()
+
+            print("ファイル名：{}".format(fname))
+            if not path:
+                print("[osu!譜面ダウンローダー]もうあるみたいだよ？")
+                return os.path.join(playlist.osumdir, os.path.splitext(fname)[0])
+
+            print("ダウンロード完了!")
+            path = await self.bot.downloader.osuDown(path)
+
+            if os.path.isdir(path):
+                await self.loop.run_in_executor(
+                    self.bot.downloader.thread_pool, self.bot.beatmap_index.add_songdir, path)
+                await self.bot.save_beatmap_index(force=True)
+            return path
+
+    async def _report_progress(self, osz_id, progress):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+
+            for msg, content in self._watchers.get(osz_id, []):
+                try:
+                    await msg.edit(content='{}\n:inbox_tray: {}'.format(content, progress))
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    if self.bot.config.debug_mode:
+                        traceback.print_exc()
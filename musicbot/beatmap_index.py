@@ -0,0 +1,447 @@
+import os
+import time
+import pickle
+import random
+import hashlib
+import threading
+import traceback
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+MODES = ['osu', 'taiko', 'fruits', 'mania']
+_MODE_ALIASES = {'std': 'osu', 'standard': 'osu', 'ctb': 'fruits', 'catch': 'fruits'}
+
+
+def _parse_range(value, conv=float):
+    if '-' in value:
+        low, _, high = value.partition('-')
+        return (conv(low) if low else None), (conv(high) if high else None)
+    return conv(value), conv(value)
+
+
+def _parse_seconds(value):
+    if ':' in value:
+        m, s = value.split(':', 1)
+        return int(m) * 60 + float(s)
+    return float(value)
+
+
+def parse_filter(text):
+    """
+        Parses an autoplay filter like "mode=mania length=2:00-6:00 bpm=150- stars=-5 plays=-0"
+        into a dict BeatmapIndex.pick understands.  Raises ValueError on anything it doesn't know.
+    """
+    query = {}
+
+    for token in (text or '').replace(',', ' ').split():
+        key, sep, value = token.partition('=')
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(token)
+
+        if key == 'mode':
+            mode = _MODE_ALIASES.get(value.lower(), value.lower())
+            if mode not in MODES:
+                raise ValueError(token)
+            query['mode'] = MODES.index(mode)
+
+        elif key in ('length', 'len'):
+            query['length'] = _parse_range(value, _parse_seconds)
+        elif key == 'bpm':
+            query['bpm'] = _parse_range(value)
+        elif key in ('stars', 'star'):
+            query['stars'] = _parse_range(value)
+        elif key in ('plays', 'playcount'):
+            query['plays'] = _parse_range(value, int)
+        else:
+            raise ValueError(token)
+
+    return query
+
+
+def format_filter(query):
+    def _fmt(r):
+        return '{}-{}'.format(*('' if v is None else v for v in r))
+
+    parts = []
+    if 'mode' in query:
+        parts.append('mode=%s' % MODES[query['mode']])
+    for key in ('length', 'bpm', 'stars', 'plays'):
+        if key in query:
+            parts.append('%s=%s' % (key, _fmt(query[key])))
+    return ' '.join(parts)
+
+
+def parse_osu_file(path):
+    """
+        Reads what the index needs out of a .osu file.  Returns None if it has no audio.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    mode = 0
+    audio = title = utitle = None
+    set_id = -1
+    bpm = 0.0
+    last_hit = 0
+    section = None
+
+    for line in raw.decode('utf_8', 'replace').splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+
+        if line.startswith('['):
+            section = line
+            continue
+
+        if section == '[General]':
+            if line.startswith('AudioFilename:'):
+                audio = line[14:].strip()
+            elif line.startswith('Mode:'):
+                mode = int(line[5:])
+
+        elif section == '[Metadata]':
+            if line.startswith('TitleUnicode:'):
+                utitle = line[13:]
+            elif line.startswith('Title:'):
+                title = line[6:]
+            elif line.startswith('BeatmapSetID:'):
+                set_id = int(line[13:])
+
+        elif section == '[TimingPoints]':
+            if not bpm:
+                fields = line.split(',')
+                if len(fields) > 1 and float(fields[1]) > 0:
+                    bpm = 60000 / float(fields[1])
+
+        elif section == '[HitObjects]':
+            fields = line.split(',', 3)
+            if len(fields) > 2:
+                last_hit = max(last_hit, int(float(fields[2])))
+
+    if not audio:
+        return None
+
+    return {
+        'title': utitle or title,
+        'mode': mode,
+        'set_id': set_id,
+        'bpm': bpm,
+        'length': last_hit / 1000,
+        'md5': hashlib.md5(raw).hexdigest()
+    }
+
+
+class _Columns:
+    """
+        The index data, one array per field.  Row i of every column is the same difficulty.
+    """
+
+    def __init__(self):
+        self.dirs = []                   # song directory names, shared by the rows of a set
+        self.dir_mtimes = []
+        self.row_dir = array('l')
+        self.set_id = array('l')
+        self.mode = array('b')
+        self.length = array('f')
+        self.bpm = array('f')
+        self.stars = array('f')          # -1 while unknown
+        self.plays = array('l')
+        self.md5 = []
+
+        self.sorted_rows = {}            # mode (None for all) -> rows ordered by length
+        self.sorted_lengths = {}         # mode -> the matching lengths, for bisecting
+        self.rows_by_set = {}
+        self.rows_by_md5 = {}
+
+    def append_dir(self, name, mtime, beatmaps):
+        d = len(self.dirs)
+        self.dirs.append(name)
+        self.dir_mtimes.append(mtime)
+
+        for bm in beatmaps:
+            self.row_dir.append(d)
+            self.set_id.append(bm['set_id'] if bm['set_id'] > 0 else _dir_set_id(name))
+            self.mode.append(bm['mode'])
+            self.length.append(bm['length'])
+            self.bpm.append(bm['bpm'])
+            self.stars.append(bm.get('stars', -1))
+            self.plays.append(bm.get('plays', 0))
+            self.md5.append(bm['md5'])
+
+    def reindex(self):
+        rows = sorted(range(len(self.length)), key=self.length.__getitem__)
+        self.sorted_rows = {None: array('l', rows)}
+        for m in range(len(MODES)):
+            self.sorted_rows[m] = array('l', (r for r in rows if self.mode[r] == m))
+
+        self.sorted_lengths = {m: array('f', (self.length[r] for r in r_)) for m, r_ in self.sorted_rows.items()}
+
+        self.rows_by_set = {}
+        for r, s in enumerate(self.set_id):
+            self.rows_by_set.setdefault(s, []).append(r)
+        self.rows_by_md5 = {h: r for r, h in enumerate(self.md5)}
+
+    def rows_by_dir(self):
+        by_dir = {}
+        for r, d in enumerate(self.row_dir):
+            by_dir.setdefault(d, []).append(r)
+        return by_dir
+
+    def beatmaps_of_rows(self, rows):
+        return [{
+            'mode': self.mode[r], 'set_id': self.set_id[r], 'length': self.length[r], 'bpm': self.bpm[r],
+            'stars': self.stars[r], 'plays': self.plays[r], 'md5': self.md5[r]
+        } for r in rows]
+
+
+def _dir_set_id(name):
+    head = name.split(' ', 1)[0]
+    return int(head) if head.isdigit() else -1
+
+
+def _in(value, bounds):
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+class BeatmapIndex:
+    """
+        Precomputed, column oriented index of the osu! Songs directory for filtered autoplay.
+
+        Rows are difficulties.  Rows are kept sorted by length per mode, so a pick bisects the
+        length range and samples inside it; the other filters are checked on the sampled row.
+        Building parses every .osu file once, after that only new or changed directories are parsed.
+
+        Changes (new sets, play counts, star ratings) go through _change under a lock.  While refresh()
+        builds new columns they are queued and applied to the new columns when they replace the old
+        ones.  `dirty` tells whether there is anything save() hasn't written yet.
+    """
+
+    # Seconds between saves of play counts and star ratings learned while playing
+    save_interval = 300
+
+    def __init__(self, osumdir, cache_file=None):
+        self.osumdir = osumdir
+        self.cache_file = cache_file
+        self._cols = _Columns()
+        self.built_at = 0
+        self.saved_at = time.time()
+        self.dirty = False
+
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._pending = []
+
+    def __len__(self):
+        return len(self._cols.row_dir)
+
+    @property
+    def set_count(self):
+        return len(self._cols.dirs)
+
+    def load(self):
+        if not self.cache_file or not os.path.isfile(self.cache_file):
+            return False
+
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cols = pickle.load(f)
+            cols.reindex()
+            self._cols = cols
+            return True
+
+        except Exception:
+            traceback.print_exc()
+            print("[osu!譜面インデックス] キャッシュを読み込めませんでした")
+            return False
+
+    def save(self):
+        if not self.cache_file:
+            return
+
+        with self._lock:
+            cols = self._cols
+            sorted_rows, sorted_lengths, by_set, by_md5 = cols.sorted_rows, cols.sorted_lengths, cols.rows_by_set, cols.rows_by_md5
+            try:
+                # Only the columns are stored, the lookup tables are rebuilt on load
+                cols.sorted_rows = cols.sorted_lengths = cols.rows_by_set = cols.rows_by_md5 = {}
+                tmp = self.cache_file + '.tmp'
+                with open(tmp, 'wb') as f:
+                    pickle.dump(cols, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self.cache_file)
+            finally:
+                cols.sorted_rows, cols.sorted_lengths, cols.rows_by_set, cols.rows_by_md5 = sorted_rows, sorted_lengths, by_set, by_md5
+
+            self.dirty = False
+            self.saved_at = time.time()
+
+    def _change(self, change):
+        """
+            Applies `change(columns)` now, or once the running refresh() is done.
+        """
+        with self._lock:
+            if self._refreshing:
+                self._pending.append(change)
+            else:
+                change(self._cols)
+            self.dirty = True
+
+    @staticmethod
+    def _parse_dir(path):
+        beatmaps = []
+        for name in os.listdir(path):
+            if name.endswith('.osu'):
+                try:
+                    bm = parse_osu_file(os.path.join(path, name))
+                    if bm:
+                        beatmaps.append(bm)
+                except Exception as e:
+                    print("[osu!譜面インデックス] %s を読み込めませんでした: %s" % (name, e))
+        return beatmaps
+
+    def refresh(self):
+        """
+            Brings the index up to date with the Songs directory.  Blocking, run it in the thread pool.
+            The new columns replace the old ones in one assignment, so picks keep working meanwhile.
+        """
+        t0 = time.time()
+        with self._lock:
+            self._refreshing = True
+            old = self._cols
+
+        cols, parsed = old, 0
+        try:
+            cols, parsed = self._build(old)
+        finally:
+            # On failure what was queued meanwhile still goes into the old columns
+            with self._lock:
+                for change in self._pending:
+                    change(cols)
+                self._pending = []
+                self._cols = cols
+                self._refreshing = False
+                self.dirty = True
+
+        self.built_at = time.time()
+        print("[osu!譜面インデックス] %s セット / %s 譜面 (%s セットを解析, %.1f秒)" % (
+            len(cols.dirs), len(cols.row_dir), parsed, time.time() - t0))
+        return parsed
+
+    def _build(self, old):
+        old_dirs = {name: d for d, name in enumerate(old.dirs)}
+        old_rows = old.rows_by_dir()
+        cols = _Columns()
+        parsed = 0
+
+        numsl = ("1", "2", "3", "4", "5", "6", "7", "8", "9")
+        for name in os.listdir(self.osumdir):
+            path = os.path.join(self.osumdir, name)
+            if not name.startswith(numsl) or not os.path.isdir(path):
+                continue
+
+            mtime = os.path.getmtime(path)
+            d = old_dirs.get(name)
+
+            if d is not None and old.dir_mtimes[d] == mtime:
+                beatmaps = old.beatmaps_of_rows(old_rows.get(d, ()))
+            else:
+                beatmaps = self._parse_dir(path)
+                parsed += 1
+
+            if beatmaps:
+                cols.append_dir(name, mtime, beatmaps)
+
+        cols.reindex()
+        return cols, parsed
+
+    def add_songdir(self, path):
+        """
+            Adds a freshly downloaded set without rescanning the whole Songs directory.
+        """
+        name = os.path.basename(os.path.normpath(path))
+        beatmaps = self._parse_dir(path)
+        if not beatmaps:
+            return
+        mtime = os.path.getmtime(path)
+
+        def add(cols):
+            # A refresh running meanwhile may have found it already
+            if name not in cols.dirs:
+                cols.append_dir(name, mtime, beatmaps)
+                cols.reindex()
+
+        self._change(add)
+
+    def record_play(self, set_id):
+        try:
+            set_id = int(set_id)
+        except (TypeError, ValueError):
+            # Not a beatmap set url
+            return
+
+        def play(cols):
+            for r in cols.rows_by_set.get(set_id, ()):
+                cols.plays[r] += 1
+
+        self._change(play)
+
+    def note_stars(self, md5, stars):
+        def rate(cols):
+            r = cols.rows_by_md5.get(md5)
+            if r is not None:
+                cols.stars[r] = stars
+
+        self._change(rate)
+
+    # Both take the columns of the caller, refresh() may swap self._cols in between
+
+    def _candidates(self, cols, query):
+        mode = query.get('mode')
+        rows = cols.sorted_rows.get(mode, ())
+        lengths = cols.sorted_lengths.get(mode, ())
+
+        low, high = query.get('length', (None, None))
+        lo = bisect_left(lengths, low) if low is not None else 0
+        hi = bisect_right(lengths, high) if high is not None else len(rows)
+        return rows, lo, hi
+
+    def _matches(self, cols, r, query):
+        if 'bpm' in query and not _in(cols.bpm[r], query['bpm']):
+            return False
+        if 'stars' in query and (cols.stars[r] < 0 or not _in(cols.stars[r], query['stars'])):
+            return False
+        if 'plays' in query and not _in(cols.plays[r], query['plays']):
+            return False
+        return True
+
+    def count(self, query):
+        cols = self._cols
+        rows, lo, hi = self._candidates(cols, query)
+        return sum(1 for i in range(lo, hi) if self._matches(cols, rows[i], query))
+
+    def pick(self, query=None, tries=32):
+        """
+            Returns (song directory, md5, mode name) of a random difficulty matching `query`, or None.
+        """
+        query = query or {}
+        cols = self._cols
+        rows, lo, hi = self._candidates(cols, query)
+        if lo >= hi:
+            return None
+
+        for _ in range(tries):
+            r = rows[random.randrange(lo, hi)]
+            if self._matches(cols, r, query):
+                break
+        else:
+            # Sparse match, fall back to scanning the length range
+            matching = [rows[i] for i in range(lo, hi) if self._matches(cols, rows[i], query)]
+            if not matching:
+                return None
+            r = random.choice(matching)
+
+        return cols.dirs[cols.row_dir[r]], cols.md5[r], MODES[cols.mode[r]] if cols.mode[r] < len(MODES) else 'osu'
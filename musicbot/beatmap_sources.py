@@ -0,0 +1,335 @@
+import os
+import re
+import time
+import socket
+import threading
+import traceback
+
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .exceptions import ExtractionError
+
+
+_FILENAME_RE = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+
+# An .osz is a zip archive
+_ZIP_MAGIC = b'PK\x03\x04'
+
+
+def _abort(res):
+    # Ends a read blocked in another thread, which closes the response itself (close() here would wait
+    # for that read to return)
+    try:
+        # urllib3 HTTPResponse > http.client.HTTPResponse > buffered SocketIO
+        sock = res.raw._fp.fp.raw._sock
+    except AttributeError:
+        sock = None
+    if sock:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _Pace:
+    """
+        Aborts the body of `res` once it falls behind `min_speed` bytes per second, counted from `grace`
+        seconds after the start.  The read timeout only covers the wait for each chunk, a mirror trickling
+        bytes would never run into it.
+    """
+
+    def __init__(self, res, min_speed, grace):
+        self.min_speed = min_speed
+        self.grace = grace
+        self.received = 0
+        self.expired = False
+        self._res = res
+        self._done = threading.Event()
+
+    def add(self, size):
+        self.received += size
+
+    def _watch(self):
+        started = time.monotonic()
+        while not self._done.wait(1):
+            if self.received < self.min_speed * (time.monotonic() - started - self.grace):
+                self.expired = True
+                _abort(self._res)
+                return
+
+    def __enter__(self):
+        threading.Thread(target=self._watch, name='download pace', daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._done.set()
+        if self.expired:
+            raise ExtractionError("Too slow, less than %s KiB/s" % (self.min_speed // 1024))
+
+
+class BeatmapSource:
+    """
+        Somewhere a beatmap set (.osz) can be downloaded from.
+
+        Keeps a health score (moving average of successes) and backs off for a while after failing,
+        so BeatmapSourcePool can try the healthy sources first.
+    """
+
+    url_template = None
+
+    def __init__(self, name, *, timeout=20, penalty=60):
+        self.name = name
+        self.timeout = timeout
+        self.penalty = penalty
+
+        self.score = 1.0
+        self.failures = 0
+        self.successes = 0
+        self.penalised_until = 0
+        self.last_speed = 0
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def url_for(self, osz_id):
+        return self.url_template.format(id=osz_id)
+
+    def open(self, osz_id):
+        res = self.session.get(self.url_for(osz_id), stream=True, timeout=(5, self.timeout))
+        res.raise_for_status()
+        return res
+
+    def check(self, res):
+        """
+            Raises if `res` is obviously not a beatmap set, like a mirror's error page served with 200.
+        """
+        content_type = res.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type.startswith('text/') or content_type.endswith(('/json', '/xml')):
+            raise ExtractionError("Not a beatmap set (%s)" % content_type)
+
+    def filename(self, osz_id, res):
+        match = _FILENAME_RE.search(res.headers.get('Content-Disposition', ''))
+        if match:
+            return os.path.basename(unquote(match.group(1)).replace('\\', ''))
+
+        # Keep the "<id> " prefix chk_beatmapset_found relies on
+        return '%s beatmapset.osz' % osz_id
+
+    @property
+    def is_penalised(self):
+        return time.time() < self.penalised_until
+
+    def record_success(self, size, elapsed):
+        self.successes += 1
+        self.score = self.score * 0.7 + 0.3
+        self.penalised_until = 0
+        self.last_speed = size / max(elapsed, 0.001)
+
+    def record_failure(self):
+        self.failures += 1
+        self.score = self.score * 0.7
+        self.penalised_until = time.time() + self.penalty
+
+    def __repr__(self):
+        return '<{} {} score={:.2f} ok={} ng={}>'.format(
+            self.__class__.__name__, self.name, self.score, self.successes, self.failures)
+
+
+class OfficialBeatmapSource(BeatmapSource):
+    """
+        osu.ppy.sh itself, through the bot's logged in OsuWebSession.
+    """
+
+    url_template = 'https://osu.ppy.sh/beatmapsets/{id}/download'
+
+    def __init__(self, osu_session, **kwargs):
+        super().__init__('osu.ppy.sh', **kwargs)
+        self.osu_session = osu_session
+
+    @property
+    def session(self):
+        return self.osu_session.sess
+
+    def open(self, osz_id):
+        return self.osu_session.get(
+            self.url_for(osz_id), stream=True, timeout=(5, self.timeout), expect='application/download')
+
+
+class MirrorBeatmapSource(BeatmapSource):
+    """
+        A beatmap mirror, given as an url template with an {id} placeholder.
+    """
+
+    def __init__(self, url_template, **kwargs):
+        super().__init__(url_template.split('/')[2] if '://' in url_template else url_template, **kwargs)
+        self.url_template = url_template
+
+
+class BeatmapSourcePool:
+    """
+        Ordered set of BeatmapSources with failover.
+
+        Sources are tried healthiest first, then fastest, then in config order.  Big files from servers
+        that accept byte ranges are fetched over `range_connections` parallel connections.
+
+        A body has to keep up with `min_speed` bytes per second (the source's timeout is the head start
+        it gets) or the source counts as failed.  What arrives has to start like a zip archive.
+    """
+
+    min_speed = 32 * 1024
+
+    def __init__(self, sources, *, range_connections=4, range_min_size=4 * 1024 * 1024, chunk_size=64 * 1024):
+        self.sources = list(sources)
+        self.range_connections = range_connections
+        self.range_min_size = range_min_size
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_config(cls, config, osu_session):
+        sources = []
+        for item in config.osu_sources:
+            if item.lower() == 'official':
+                sources.append(OfficialBeatmapSource(osu_session, timeout=config.osu_download_timeout))
+            else:
+                sources.append(MirrorBeatmapSource(item, timeout=config.osu_download_timeout))
+
+        return cls(sources, range_connections=config.osu_range_connections)
+
+    def ordered(self):
+        ranked = sorted(enumerate(self.sources),
+                        key=lambda i: (i[1].is_penalised, -round(i[1].score, 1), -i[1].last_speed, i[0]))
+        return [s for _, s in ranked]
+
+    def fetch(self, osz_id, dest_dir, progress=None, skip=None):
+        """
+            Downloads beatmap set `osz_id` into `dest_dir`, failing over between sources.
+            Blocking, run it in the thread pool.
+
+            Returns (file name, path).  If `skip(file name)` is true the body isn't downloaded and path is None.
+        """
+        errors = []
+
+        for source in self.ordered():
+            t0 = time.time()
+            try:
+                res = source.open(osz_id)
+                try:
+                    source.check(res)
+                except:
+                    res.close()
+                    raise
+                fname = source.filename(osz_id, res)
+
+                if skip and skip(fname):
+                    res.close()
+                    return fname, None
+
+                path = os.path.join(dest_dir, fname)
+                size = self._write(source, res, path, progress)
+                source.record_success(size, time.time() - t0)
+
+                print("[osu!譜面ダウンローダー] %s から取得しました (%s)" % (source.name, fname))
+                return fname, path
+
+            except Exception as e:
+                source.record_failure()
+                errors.append('%s: %s' % (source.name, e))
+                print("[osu!譜面ダウンローダー] %s からのダウンロードに失敗しました: %s" % (source.name, e))
+
+                if progress:
+                    progress.done = 0
+
+        raise ExtractionError("Could not download beatmap set %s\n%s" % (osz_id, '\n'.join(errors)))
+
+    def _write(self, source, res, path, progress):
+        total = int(res.headers.get('Content-Length', 0) or 0)
+        if progress:
+            progress.total = total
+
+        if self.range_connections > 1 and total >= self.range_min_size \
+                and res.headers.get('Accept-Ranges', '').lower() == 'bytes':
+            # Don't read the body of this one, reissue it as ranges against the final url
+            res.close()
+            self._write_ranged(source, res.url, total, path, progress)
+            return total
+
+        try:
+            with _Pace(res, self.min_speed, source.timeout) as pace, open(path, 'wb') as f:
+                for chunk in res.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        pace.add(len(chunk))
+                        if progress:
+                            progress.done += len(chunk)
+            size = os.path.getsize(path)
+            if total and size != total:
+                raise ExtractionError("Incomplete download (%s/%s bytes)" % (size, total))
+            self._check_magic(path)
+        except:
+            self._unlink(path)
+            raise
+
+        return size
+
+    def _write_ranged(self, source, url, total, path, progress):
+        part = -(-total // self.range_connections)
+        ranges = [(start, min(start + part, total) - 1) for start in range(0, total, part)]
+        lock = threading.Lock()
+
+        with open(path, 'wb') as f:
+            f.truncate(total)
+
+        def _fetch(byte_range):
+            start, end = byte_range
+            res = source.session.get(url, stream=True, timeout=(5, source.timeout),
+                                     headers={'Range': 'bytes=%s-%s' % (start, end)})
+            # Each connection gets its share of the pace
+            with res, _Pace(res, self.min_speed / len(ranges), source.timeout) as pace:
+                if res.status_code != 206:
+                    raise ExtractionError("Range request answered with %s" % res.status_code)
+
+                pos = start
+                with open(path, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in res.iter_content(chunk_size=self.chunk_size):
+                        if chunk:
+                            f.write(chunk)
+                            pos += len(chunk)
+                            pace.add(len(chunk))
+                            if progress:
+                                with lock:
+                                    progress.done += len(chunk)
+
+            if pos != end + 1:
+                raise ExtractionError("Incomplete range %s-%s (got %s bytes)" % (start, end, pos - start))
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                for result in [pool.submit(_fetch, r) for r in ranges]:
+                    result.result()
+
+            self._check_magic(path)
+        except:
+            self._unlink(path)
+            raise
+
+    @staticmethod
+    def _check_magic(path):
+        with open(path, 'rb') as f:
+            head = f.read(16)
+        if not head.startswith(_ZIP_MAGIC):
+            raise ExtractionError("Not a beatmap set (starts with %r)" % head)
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            traceback.print_exc()
@@ -28,16 +28,28 @@ from collections import defaultdict
 from osuapi import OsuApi, ReqConnector
 
 from musicbot.playlist import Playlist
+from musicbot.beatmap_downloads import BeatmapDownloadManager
+from musicbot.osu_session import OsuWebSession
+from musicbot.beatmap_sources import BeatmapSourcePool
+from musicbot.beatmap_index import BeatmapIndex, parse_filter, format_filter
 from musicbot.player import MusicPlayer
+from musicbot.broadcast import BroadcastHub
+from musicbot.voice_supervisor import VoiceSupervisor
+from musicbot.opus_tuner import OpusTuner
+from musicbot.watchdog import PlaybackWatchdog
+from musicbot.queue_view import QueuePages
+from musicbot.queue_journal import QueueJournal
+from musicbot.handoff import save_handoff, load_handoff
+from musicbot.entry import PLType, entry_from_dict
 from musicbot.config import Config, ConfigDefaults
 from musicbot.permissions import Permissions, PermissionsDefaults
-from musicbot.utils import load_file, write_file, sane_round_int
+from musicbot.utils import load_file, write_file, sane_round_int, parse_timestamp
 
 from . import exceptions
 from . import downloader
 from .opus_loader import load_opus_lib
 from .constants import VERSION as BOTVERSION
-from .constants import DISCORD_MSG_CHAR_LIMIT, AUDIO_CACHE_PATH
+from .constants import AUDIO_CACHE_PATH, QUEUE_PAGE_EMOJIS
 
 
 load_opus_lib()
@@ -98,7 +110,6 @@ class MusicBot(discord.Client):
         self.osumode = OsumodeState.DISABLED
         self.osuplaylist = None
         self.osumdir = None
-        self.osulogon = False
         self.osuapi = OsuApi(self.config.osukey, connector=ReqConnector())
         self.busymsg = None
 
@@ -112,6 +123,23 @@ class MusicBot(discord.Client):
 
         super().__init__()
         self.aiosession = aiohttp.ClientSession(loop=self.loop)
+        self.beatmap_downloads = BeatmapDownloadManager(self, max_concurrent=self.config.osu_max_downloads)
+        self.osu_session = OsuWebSession(self.config.osuid, self.config.osupassword, cookie_file=self.config.osu_cookie_file)
+        self.beatmap_sources = BeatmapSourcePool.from_config(self.config, self.osu_session)
+        self.beatmap_index = BeatmapIndex(self.config.osumdir, cache_file=self.config.osu_index_file)
+        self.beatmap_index.load()
+        self.voice_supervisor = VoiceSupervisor(self)
+        self.opus_tuner = OpusTuner.from_config(self.config)
+        self.playback_watchdog = PlaybackWatchdog(self, stall_timeout=self.config.ffmpeg_stall_timeout)
+        self.queue_pages = QueuePages()
+        self.queue_journal = QueueJournal(self.config.queue_dir) if self.config.persist_queue else None
+        self.broadcast_hub = BroadcastHub(join_window=self.config.broadcast_join_window) if self.config.broadcast_mode else None
+
+        try:
+            self.osu_autoplay_filter = parse_filter(self.config.osu_autoplay_filter)
+        except ValueError as e:
+            print("[警告] osu!AutoplayFilter の値が不正です (%s)。フィルタは無効化されました。" % e)
+            self.osu_autoplay_filter = {}
         self.http.user_agent += ' MusicBot/%s' % BOTVERSION
 
     # TODO: Add some sort of `denied` argument for a message to send when someone else tries to use it
@@ -209,6 +237,46 @@ class MusicBot(discord.Client):
             else:
                 print("Invalid channel thing: " + channel)
 
+    async def _resume_handoff(self, data):
+        """
+            Picks up what the process before a 再起 left in the handoff file: rejoins its voice channels
+            and continues every track at the frame it stopped at.
+        """
+        if not data:
+            return
+
+        tuner = self.opus_tuner
+        tuner.complexity = max(tuner.min_complexity, min(data['opus_complexity'], tuner.max_complexity))
+
+        for saved in data['guilds']:
+            channel = self.get_channel(saved['channel'])
+            if not channel:
+                continue
+
+            try:
+                player = await self.get_player(channel, create=True)
+                playlist = player.playlist
+
+                player.volume = saved['volume']
+                player.readahead_depth = saved['readahead_depth']
+                player.recent.extend(entry_from_dict(playlist, e) for e in saved['recent'])
+
+                if saved['queue'] is not None and not playlist.entries:
+                    for e in saved['queue']:
+                        playlist.entries.append(entry_from_dict(playlist, e))
+
+                if saved['entry']:
+                    entry = entry_from_dict(playlist, saved['entry'])
+                    player.resume_entry(entry, saved['position'])
+                    self.safe_print("[再起] %s: %s を %d:%02d から再開します" % (
+                        channel.guild.name, entry.title, *divmod(int(saved['position']), 60)))
+                elif player.is_stopped:
+                    player.play()
+
+            except Exception:
+                traceback.print_exc()
+                print("[再起] %s に戻れませんでした" % channel.name)
+
     async def _wait_delete_msg(self, message, after):
         await asyncio.sleep(after)
         await self.safe_delete_message(message)
@@ -241,6 +309,51 @@ class MusicBot(discord.Client):
         files_dir = [f for f in files if os.path.isdir(os.path.join(self.config.osumdir, f))  and f.startswith(numsl)]
         return files_dir
 
+    def _osu_autoplay_pick(self):
+        """
+            Picks the next osu! autoplay song directory, through the beatmap index when it is built.
+            Returns (song directory, bidhash) or None.
+        """
+        if len(self.beatmap_index):
+            picked = self.beatmap_index.pick(self.osu_autoplay_filter)
+            if not picked and self.osu_autoplay_filter:
+                print("[osu!譜面インデックス] フィルタに一致する譜面がありません。フィルタなしで選出します。")
+                picked = self.beatmap_index.pick()
+
+            if picked:
+                songdir, md5, mode = picked
+                return songdir, [None, md5, mode]
+
+        osu_apl = self.osu_apl()
+        if osu_apl:
+            return choice(osu_apl), None
+
+    async def _refresh_beatmap_index(self):
+        if not self.config.osumdir or not os.path.isdir(self.config.osumdir):
+            return
+
+        try:
+            await self.loop.run_in_executor(self.downloader.thread_pool, self.beatmap_index.refresh)
+        except Exception:
+            traceback.print_exc()
+            print("[osu!譜面インデックス] インデックスの作成に失敗しました")
+        await self.save_beatmap_index(force=True)
+
+    async def save_beatmap_index(self, force=False):
+        """
+            Writes play counts, star ratings and new sets to the cache, at most every save_interval
+            seconds unless forced.
+        """
+        index = self.beatmap_index
+        if not index.dirty or (not force and time.time() - index.saved_at < index.save_interval):
+            return
+
+        try:
+            await self.loop.run_in_executor(self.downloader.thread_pool, index.save)
+        except Exception:
+            traceback.print_exc()
+            print("[osu!譜面インデックス] インデックスを保存できませんでした")
+
     async def get_voice_client(self, channel:discord.VoiceChannel):
         if isinstance(channel, Object):
             channel = self.get_channel(channel.id)
@@ -302,41 +415,58 @@ class MusicBot(discord.Client):
         await self._update_voice_state(channel)
 
     async def reconnect_voice_client(self, guild):
-        if not guild.voice_client:
+        player = self.voice_client_list.get(guild.id)
+        if not guild.voice_client and not player:
             return
 
-        _paused = False
+        # Remember the channel, guild.voice_client is gone after the disconnect
+        channel = guild.voice_client.channel if guild.voice_client else player.voice_client.channel
 
-        player = None
-        if guild.id in self.voice_client_list:
-            player = self.voice_client_list[guild.id]
-            if player.is_playing:
-                player.pause()
-                _paused = True
+        if player:
+            player.detach_voice()
 
-        try:
-            await guild.voice_client.disconnect()
-        except:
-            print("再接続中にエラーが発生しました。")
-            traceback.print_exc()
+        if guild.voice_client:
+            try:
+                await guild.voice_client.disconnect()
+            except:
+                print("再接続中にエラーが発生しました。")
+                traceback.print_exc()
 
         await asyncio.sleep(0.1)
 
         if player:
-            new_vc = await self.get_voice_client(guild.voice_client.channel)
+            new_vc = await self.get_voice_client(channel)
             player.reload_voice(new_vc)
 
-            if player.is_paused and _paused:
-                player.resume()
-
     async def disconnect_voice_client(self, guild):
-        if not guild.voice_client:
-            return
+        self.voice_supervisor.forget(guild)
 
         if guild.id in self.voice_client_list:
-            self.voice_client_list.pop(guild.id).kill()
+            player = self.voice_client_list.pop(guild.id)
+            if self.queue_journal:
+                # Saved as it is, the player clears its queue on kill
+                self.queue_journal.detach(guild, player.playlist)
+            player.kill()
+
+        if guild.voice_client:
+            await guild.voice_client.disconnect(force=True)
+
+    async def _voice_left(self, guild):
+        """
+            The bot's voice state lost its channel.  As long as discord.py keeps the VoiceClient it is
+            reconnecting by itself (what it gives up on the supervisor's sweep picks up), so only a
+            VoiceClient it removed counts: a moderator disconnected the bot or the channel is gone, which
+            ends the player instead of rejoining.
+        """
+        # discord.py handles the same voice state update in a task of its own
+        await asyncio.sleep(1)
+
+        player = self.voice_client_list.get(guild.id)
+        if not player or player.is_dead or guild.voice_client or self.voice_supervisor.is_reconnecting(guild):
+            return
 
-        await guild.voice_client.disconnect(force=True)
+        self.safe_print("[ボイス監視] %s: ボイスチャンネルから切断されました、再接続せずに終了します" % guild.name)
+        await self.disconnect_voice_client(guild)
 
     async def disconnect_all_voice_clients(self):
         for vc in list(self.voice_clients).copy():
@@ -377,6 +507,9 @@ class MusicBot(discord.Client):
             voice_client = await self.get_voice_client(channel)
 
             playlist = Playlist(self)
+            if self.queue_journal:
+                self.queue_journal.attach(guild, playlist)
+
             player = MusicPlayer(self, voice_client, playlist) \
                 .on('play', self.on_player_play) \
                 .on('resume', self.on_player_resume) \
@@ -394,6 +527,10 @@ class MusicBot(discord.Client):
         await self.update_now_playing(entry)
         player.skip_state.reset()
 
+        if entry.type == PLType.Osu:
+            self.beatmap_index.record_play(entry.url.rsplit('/', 1)[-1])
+            await self.save_beatmap_index()
+
         channel = entry.meta.get('channel', None)
         author = entry.meta.get('author', None)
 
@@ -459,27 +596,25 @@ class MusicBot(discord.Client):
         elif not player.playlist.entries and not player.current_entry and self.config.auto_playlist and self.osumode==OsumodeState.DEDICATED:
 #            osu_apli = []
 #            osu_apli.append(self.osu_apl())
-            while self.osu_apl():
-                songdir = choice(self.osu_apl())
+            picked = self._osu_autoplay_pick()
+            if picked:
+                songdir, bidhash = picked
                 print("選出されたフォルダ: %s" % songdir)
-                await player.playlist.add_entry_raw(osz_id=None, songdir=songdir)
-                
-                break
+                await player.playlist.add_entry_raw(osz_id=None, songdir=songdir, bidhash=bidhash)
 
-            if not self.osu_apl():
+            else:
                 print("[警告] 再生不可能なAPLです。設定は無効化されました。osu!のSongsディレクトリを適切に設定したか確認して下さい。")
                 self.config.auto_playlist = False
         elif not player.playlist.entries and not player.current_entry and self.config.auto_playlist and self.osumode==OsumodeState.MIXED:
             select = bool(getrandbits(1))
             if select:
-                while self.osu_apl():
-                    songdir = choice(self.osu_apl())
+                picked = self._osu_autoplay_pick()
+                if picked:
+                    songdir, bidhash = picked
                     print("選出されたフォルダ: %s" % songdir)
-                    await player.playlist.add_entry_raw(osz_id=None, songdir=songdir)
-                
-                    break
+                    await player.playlist.add_entry_raw(osz_id=None, songdir=songdir, bidhash=bidhash)
 
-                if not self.osu_apl():
+                else:
                     print("[警告] 再生不可能なAPLです。設定は無効化されました。osu!のSongsディレクトリを適切に設定したか確認して下さい。")
                     self.config.auto_playlist = False
             else:
@@ -768,12 +903,23 @@ class MusicBot(discord.Client):
         # maybe option to leave the ownerid blank and generate a random command for the owner to use
         # wait_for_message is pretty neato
 
+        handoff = load_handoff(self.config.handoff_file)
+
         if not self.config.save_videos and os.path.isdir(AUDIO_CACHE_PATH):
-            if self._delete_old_audiocache():
+            if handoff:
+                # The tracks carried over by 再起 (current, recent and queued) still play from it
+                print("再起動前のキャッシュを引き継ぎます。")
+            elif self._delete_old_audiocache():
                 print("古いキャッシュを削除しています・・・")
             else:
                 print("古いキャッシュを削除できませんでした。")
 
+        self.loop.create_task(self._refresh_beatmap_index())
+        self.voice_supervisor.start()
+        self.playback_watchdog.start()
+
+        await self._resume_handoff(handoff)
+
         if self.config.autojoin_channels:
             await self._autojoin_channels(autojoin_channels)
 
@@ -1017,7 +1163,7 @@ class MusicBot(discord.Client):
             　　認証情報はボットのコンフィグに記載のものが使用されます。
         """
 
-        player.playlist.login()
+        await self.loop.run_in_executor(self.downloader.thread_pool, self.osu_session.login)
         return Response("ログイン処理を実行しました。:innocent:", delete_after=30)
 
     async def cmd_osuモード(self, message, channel, author, leftover_args):
@@ -1057,6 +1203,51 @@ class MusicBot(discord.Client):
             else:
                 return Response("不正な引数です。", delete_after=30)
 
+    async def cmd_osuフィルタ(self, message, channel, author, leftover_args):
+        """
+        使い方:
+            {command_prefix}osuフィルタ [条件 ...]
+            {command_prefix}osuフィルタ クリア
+
+            osu!オートプレイリストで選出される譜面を絞り込みます。
+            条件: mode=osu|taiko|fruits|mania  length=2:00-6:00  bpm=150-  stars=-5  plays=-0
+            引数がなければ現在のフィルタを返します
+        """
+
+        if not leftover_args:
+            return Response("現在のosu!APLフィルタ: `{}` ({}譜面が一致)".format(
+                format_filter(self.osu_autoplay_filter) or 'なし',
+                self.beatmap_index.count(self.osu_autoplay_filter)), delete_after=30)
+
+        if leftover_args[0] in ('クリア', 'clear', 'off'):
+            self.osu_autoplay_filter = {}
+            return Response("osu!APLフィルタを解除しました。", delete_after=30)
+
+        try:
+            query = parse_filter(' '.join(leftover_args))
+        except ValueError as e:
+            raise exceptions.CommandError("不正な条件です: `%s`" % e, expire_in=30)
+
+        if not len(self.beatmap_index):
+            raise exceptions.CommandError("譜面インデックスが作成されていません。osu!のSongsディレクトリを確認して下さい。", expire_in=30)
+
+        t0 = time.perf_counter()
+        sample = self.beatmap_index.pick(query)
+        took = (time.perf_counter() - t0) * 1000000
+
+        if not sample:
+            raise exceptions.CommandError("条件に一致する譜面がありません。", expire_in=30)
+
+        self.osu_autoplay_filter = query
+        return Response("osu!APLフィルタを`{}`に変更しました。 ({}譜面が一致, 選出: {:.0f}µs)".format(
+            format_filter(query), self.beatmap_index.count(query), took), delete_after=30)
+
+    async def cmd_osufilter(self, message, channel, author, leftover_args):
+        """
+        コマンドのオリジナル互換用ラッパエントリ。栗目ボットの日本語コマンドが使いづらい人用。
+        """
+        return await self.cmd_osuフィルタ(message=message, channel=channel, author=author, leftover_args=leftover_args)
+
     async def cmd_ステータス(self, player, message, channel, guild, author, leftover_args):
         if self.guild_specific_data[guild]['stats_emb_msg']:
             await self.safe_delete_message(self.guild_specific_data[guild]['stats_emb_msg'])
@@ -1067,6 +1258,12 @@ class MusicBot(discord.Client):
         embed.add_field(name="osu!譜面オートプレイリスト", value=["❌無効", "✅有効(排他)", "🔀有効(ミックスド)"][self.osumode.value], inline=True)
         embed.add_field(name="オートプレイリスト", value=["❌無効", "✅有効"][self.config.auto_playlist], inline=True)
         embed.add_field(name="音量", value=str(player.volume*100)+"%", inline=True)
+        embed.add_field(name="Opus", value="{}kbps 複雑度{} (CPU {:.0%})".format(
+            self.opus_tuner.bitrate_for(player.voice_client.channel), self.opus_tuner.complexity, self.opus_tuner.load), inline=True)
+        embed.add_field(name="VC再接続", value="{0[0]}回 (失敗{0[1]}回)".format(self.voice_supervisor.stats(guild)), inline=True)
+        embed.add_field(name="ffmpeg再起動", value="停止{stall}回 異常終了{crash}回 スキップ{skip}回".format(
+            **dict({'stall': 0, 'crash': 0, 'skip': 0}, **self.playback_watchdog.stats(guild))), inline=True)
+        embed.add_field(name="先読みバッファ", value="{0[0]}/{0[1]}フレーム 途切れ{0[2]}回 ({0[3]:.1f}秒)".format(player.readahead_stats), inline=True)
         embed.add_field(name="現在再生中の項目", value=["[{}]({})\n詳細はnpで".format(player.current_entry.title, player.current_entry.url), "何も再生していません。バグジョンの可能性もあります。"][len(player.current_entry.title)==0], inline=False)
         embed.set_footer(text="再生が止ったときは再起させてみよう")
         self.guild_specific_data[guild]['stats_emb_msg'] = await channel.send(embed=embed)
@@ -1110,6 +1307,8 @@ class MusicBot(discord.Client):
         else:
             try:
                 time_until = player.playlist.estimate_time_until_notasync(position, player)
+                if time_until is None:
+                    time_until = '不明(ライブ配信の後)'
                 reply_text += 'あと{}:alarm_clock:栗目後に再生が始まるゾ<:passive:347538399600836608>'
             except:
                 traceback.print_exc()
@@ -1184,6 +1383,8 @@ class MusicBot(discord.Client):
                     bmode="fruits"
                 bidhash = [bid, bmhash, bmode]
                 bmtitle = binfo[0].title
+            self.beatmap_index.note_stars(bmhash, binfo[0].difficultyrating)
+            await self.save_beatmap_index()
             busymsg = await self.safe_send_message(channel, "[**試験機能**]osu!譜面セットのリンク：**{}** ({})の処理を開始しました:arrows_counterclockwise:\nこの処理は開発、修正中のためBotの接続が一時的に切断されるかもしれません。".format(song_url, bmtitle), expire_in=30)
             
 #            try:
@@ -1202,6 +1403,8 @@ class MusicBot(discord.Client):
             else:
                 try:
                     time_until = await player.playlist.estimate_time_until(position, player)
+                    if time_until is None:
+                        time_until = '不明(ライブ配信の後)'
                     reply_text += 'あと{}:alarm_clock:栗目後に再生が始まるゾ<a:headhamg:419611990839787531>'
                 except:
                     traceback.print_exc()
@@ -1258,6 +1461,16 @@ class MusicBot(discord.Client):
                 if not permissions.allow_playlists and ':search' in info['extractor'] and len(info['entries']) > 1:
                     raise exceptions.PermissionsError("You are not allowed to request playlists", expire_in=30)
 
+                if info['extractor'].lower() in ['youtube:playlist', 'soundcloud:set', 'bandcamp:album']:
+                    # Streamed, counting the entries first would already read the whole playlist
+                    try:
+                        return await self._cmd_play_playlist_async(player, channel, author, permissions, song_url, info['extractor'], info=info)
+                    except exceptions.CommandError:
+                        raise
+                    except Exception as e:
+                        traceback.print_exc()
+                        raise exceptions.CommandError("Error queuing playlist:\n%s" % e, expire_in=30)
+
                 # The only reason we would use this over `len(info['entries'])` is if we add `if _` to this one
                 num_songs = sum(1 for _ in info['entries'])
 
@@ -1275,15 +1488,6 @@ class MusicBot(discord.Client):
                         expire_in=30
                     )
 
-                if info['extractor'].lower() in ['youtube:playlist', 'soundcloud:set', 'bandcamp:album']:
-                    try:
-                        return await self._cmd_play_playlist_async(player, channel, author, permissions, song_url, info['extractor'])
-                    except exceptions.CommandError:
-                        raise
-                    except Exception as e:
-                        traceback.print_exc()
-                        raise exceptions.CommandError("Error queuing playlist:\n%s" % e, expire_in=30)
-
                 t0 = time.time()
 
                 # My test was 1.2 seconds per song, but we maybe should fudge it a bit, unless we can
@@ -1307,23 +1511,15 @@ class MusicBot(discord.Client):
                 # TODO: I can create an event emitter object instead, add event functions, and every play list might be asyncified
                 #       Also have a "verify_entry" hook with the entry as an arg and returns the entry if its ok
 
-                entry_list, position = await player.playlist.import_from(song_url, channel=channel, author=author)
+                entry_list, position, drop_count = await player.playlist.import_from(
+                    song_url, max_duration=permissions.max_song_length, channel=channel, author=author)
 
                 tnow = time.time()
                 ttime = tnow - t0
-                listlen = len(entry_list)
-                drop_count = 0
-
-                if permissions.max_song_length:
-                    for e in entry_list.copy():
-                        if e.duration > permissions.max_song_length:
-                            player.playlist.entries.remove(e)
-                            entry_list.remove(e)
-                            drop_count += 1
-                            # Im pretty sure there's no situation where this would ever break
-                            # Unless the first entry starts being played, which would make this a race condition
-                    if drop_count:
-                        print("Dropped %s songs" % drop_count)
+                listlen = len(entry_list) + drop_count
+
+                if drop_count:
+                    print("Dropped %s songs" % drop_count)
 
                 print("Processed {} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
                     listlen,
@@ -1352,7 +1548,14 @@ class MusicBot(discord.Client):
                     )
 
                 try:
-                    entry, position = await player.playlist.add_entry(song_url, channel=channel, author=author)
+                    entry, position = await player.playlist.add_entry(
+                        song_url, max_duration=permissions.max_song_length, channel=channel, author=author)
+
+                except exceptions.SongTooLongError as e:
+                    raise exceptions.PermissionsError(
+                        "Song duration exceeds limit (%s > %s)" % (e.duration, permissions.max_song_length),
+                        expire_in=30
+                    )
 
                 except exceptions.WrongEntryTypeError as e:
                     if e.use_url == song_url:
@@ -1374,6 +1577,8 @@ class MusicBot(discord.Client):
             else:
                 try:
                     time_until = await player.playlist.estimate_time_until(position, player)
+                    if time_until is None:
+                        time_until = '不明(ライブ配信の後)'
                     reply_text += ' :alarm_clock:%s後に再生される予定だァァァ！！'
                 except:
                     traceback.print_exc()
@@ -1390,99 +1595,77 @@ class MusicBot(discord.Client):
         return await self.cmd_登録(player=player, channel=channel, author=author, permissions=permissions, leftover_args=leftover_args, song_url=song_url)
 
 
-    async def _cmd_play_playlist_async(self, player, channel, author, permissions, playlist_url, extractor_type):
+    async def _cmd_play_playlist_async(self, player, channel, author, permissions, playlist_url, extractor_type, info=None):
         """
         Secret handler to use the async wizardry to make playlist queuing non-"blocking"
-        """
 
-        await self.send_typing(channel)
-        info = await self.downloader.extract_info(player.playlist.loop, playlist_url, download=False, process=False)
+        The playlist is queued in the background while it is being read, the first song plays right away
+        and one message keeps showing the progress.  Clearing the queue stops it.
+        """
 
-        if not info:
-            raise exceptions.CommandError("That playlist cannot be played.")
-
-        num_songs = sum(1 for _ in info['entries'])
-        t0 = time.time()
+        limit = permissions.max_playlist_length or None
+        if permissions.max_songs:
+            room = permissions.max_songs - player.playlist.count_for_user(author)
+            limit = room if limit is None else min(limit, room)
 
         busymsg = await self.safe_send_message(
-            channel, "%s個の栗目を処理中:arrows_counterclockwise: :innocent:" % num_songs)  # TODO: From playlist_title
-        await self.send_typing(channel)
+            channel, "プレイリストを読み込んでいます:arrows_counterclockwise: 最初の栗目はすぐに再生されるよ :innocent:")  # TODO: From playlist_title
 
-        entries_added = 0
-        if extractor_type == 'youtube:playlist':
-            try:
-                entries_added = await player.playlist.async_process_youtube_playlist(
-                    playlist_url, channel=channel, author=author)
-                # TODO: Add hook to be called after each song
-                # TODO: Add permissions
+        self.loop.create_task(self._stream_playlist(player, channel, author, permissions, playlist_url, info, limit, busymsg))
 
-            except Exception:
-                traceback.print_exc()
-                raise exceptions.CommandError('Error handling playlist %s queuing.' % playlist_url, expire_in=30)
+    async def _stream_playlist(self, player, channel, author, permissions, playlist_url, info, limit, busymsg):
+        t0 = time.time()
 
-        elif extractor_type.lower() in ['soundcloud:set', 'bandcamp:album']:
-            try:
-                entries_added = await player.playlist.async_process_sc_bc_playlist(
-                    playlist_url, channel=channel, author=author)
-                # TODO: Add hook to be called after each song
-                # TODO: Add permissions
+        async def progress(added, processed):
+            if busymsg:
+                await self.safe_edit_message(
+                    busymsg, "%s個の栗目を登録しました (%s個処理済み):arrows_counterclockwise: :innocent:" % (added, processed), quiet=True)
 
-            except Exception:
-                traceback.print_exc()
-                raise exceptions.CommandError('Error handling playlist %s queuing.' % playlist_url, expire_in=30)
+        try:
+            entries_added, songs_processed, drop_count, cancelled = await player.playlist.stream_playlist(
+                playlist_url, limit=limit, max_duration=permissions.max_song_length, progress=progress, info=info,
+                channel=channel, author=author)
 
+        except Exception:
+            traceback.print_exc()
+            await self._finish_playlist_message(channel, busymsg, '```\nError handling playlist %s queuing.\n```' % playlist_url)
+            return
 
-        songs_processed = len(entries_added)
-        drop_count = 0
-        skipped = False
+        if drop_count:
+            print("%s個の栗目が失敗" % drop_count)
 
-        if permissions.max_song_length:
-            for e in entries_added.copy():
-                if e.duration > permissions.max_song_length:
-                    try:
-                        player.playlist.entries.remove(e)
-                        entries_added.remove(e)
-                        drop_count += 1
-                    except:
-                        pass
+        songs_added = len(entries_added)
+        ttime = time.time() - t0
 
-            if drop_count:
-                print("%s個の栗目が失敗" % drop_count)
+        if songs_processed:
+            print("Processed {} songs in {} seconds at {:.2f}s/song".format(
+                songs_processed, self._fixg(ttime), ttime / songs_processed))
 
-            if player.current_entry and player.current_entry.duration > permissions.max_song_length:
-                await self.safe_delete_message(self.guild_specific_data[channel.guild]['last_np_msg'])
-                self.guild_specific_data[channel.guild]['last_np_msg'] = None
-                skipped = True
-                player.skip()
-                entries_added.pop()
+        if cancelled:
+            text = ":put_litter_in_its_place: リストが掃除されたので、プレイリストの登録を{}個で止めました".format(songs_added)
 
-        await self.safe_delete_message(busymsg)
+        elif not songs_added:
+            text = '```\nNo songs were added, all songs were over max duration (%ss)\n```' % permissions.max_song_length
 
-        songs_added = len(entries_added)
-        tnow = time.time()
-        ttime = tnow - t0
-        wait_per_song = 1.2
-        # TODO: actually calculate wait per song in the process function and return that too
-
-        # This is technically inaccurate since bad songs are ignored but still take up time
-        print("Processed {}/{} songs in {} seconds at {:.2f}s/song, {:+.2g}/song from expected ({}s)".format(
-            songs_processed,
-            num_songs,
-            self._fixg(ttime),
-            ttime / num_songs,
-            ttime / num_songs - wait_per_song,
-            self._fixg(wait_per_song * num_songs))
-        )
+        else:
+            text = "<:zakuro:310053103338651648>誰だ<:KNHG:500338115659956247>{}個も<:crime:332181988633083925>を入れたクライミストは<:nubesco:257184784344809473>！！お陰で{}秒もかかっちまったじゃねえか<:MG8853:314051642737688578>マジ<:ginnan:284978139350827009>".format(
+                songs_added, self._fixg(ttime, 1))
+            if limit is not None and songs_added >= limit:
+                text += "\n(上限の{}個までです)".format(limit)
+            if drop_count:
+                text += "\n{}個は長すぎるので登録しませんでした (上限{}秒)".format(drop_count, permissions.max_song_length)
 
-        if not songs_added:
-            basetext = "No songs were added, all songs were over max duration (%ss)" % permissions.max_song_length
-            if skipped:
-                basetext += "\nAdditionally, the current song was skipped for being too long."
+        await self._finish_playlist_message(channel, busymsg, text)
 
-            raise exceptions.CommandError(basetext, expire_in=30)
+    async def _finish_playlist_message(self, channel, busymsg, text):
+        if busymsg:
+            await self.safe_edit_message(busymsg, text, send_if_fail=True, quiet=True)
+            msg = busymsg
+        else:
+            msg = await self.safe_send_message(channel, text)
 
-        return Response("<:zakuro:310053103338651648>誰だ<:KNHG:500338115659956247>{}個も<:crime:332181988633083925>を入れたクライミストは<:nubesco:257184784344809473>！！お陰で{}秒もかかっちまったじゃねえか<:MG8853:314051642737688578>マジ<:ginnan:284978139350827009>".format(
-            songs_added, self._fixg(ttime, 1)), delete_after=30)
+        if msg and self.config.delete_messages:
+            asyncio.ensure_future(self._wait_delete_msg(msg, 30))
 
     async def cmd_search(self, player, channel, author, permissions, leftover_args):
         """
@@ -1631,8 +1814,11 @@ class MusicBot(discord.Client):
                 self.guild_specific_data[guild]['last_np_msg'] = None
 
             song_progress = str(timedelta(seconds=player.progress)).lstrip('0').lstrip(':')
-            song_total = str(timedelta(seconds=player.current_entry.duration)).lstrip('0').lstrip(':')
-            prog_str = '`[%s/%s]`' % (song_progress, song_total)
+            if player.current_entry.is_live:
+                prog_str = '`[%s/LIVE 遅延%.1f秒]`' % (song_progress, player.live_latency or 0)
+            else:
+                song_total = str(timedelta(seconds=player.current_entry.duration)).lstrip('0').lstrip(':')
+                prog_str = '`[%s/%s]`' % (song_progress, song_total)
 
             if player.current_entry.meta.get('channel', False) and player.current_entry.meta.get('author', False):
                 np_text = "再生中:projector:： **%s**  :u7533:**%s** :alarm_clock:%s\n" % (
@@ -1933,22 +2119,98 @@ class MusicBot(discord.Client):
         """
         return await self.cmd_ﾜ度(message=message, player=player, new_volume=new_volume)
 
-    async def cmd_リスト(self, channel, player):
+    async def cmd_シーク(self, player, position=None):
         """
         Usage:
-            {command_prefix}リスト
+            {command_prefix}シーク [分:秒]
+            {command_prefix}シーク +[秒]/-[秒]
 
-        リストに登録されたものを表示します
+        再生中の栗目を指定した位置から再生し直します。ダウンロードし直すことはありません
+        ＋や－を入れると現在の位置から進める/戻すことができます
         """
 
-        lines = []
-        unlisted = 0
-        andmoretext = '* ... と %s 個の登録*' % ('x' * len(player.playlist.entries))
+        if not player.current_entry:
+            raise exceptions.CommandError('何も再生していません。', expire_in=20)
+
+        if not position:
+            raise exceptions.CommandError('位置を指定して下さい。例: {}シーク 1:30'.format(self.config.command_prefix), expire_in=20)
+
+        try:
+            seconds = parse_timestamp(position.lstrip('+-'))
+        except ValueError:
+            raise exceptions.CommandError(':boom:  {} は不正な位置です'.format(position), expire_in=20)
+
+        if position[0] == '+':
+            seconds = player.progress + seconds
+        elif position[0] == '-':
+            seconds = player.progress - seconds
+
+        try:
+            seconds = player.seek(seconds)
+        except ValueError as e:
+            raise exceptions.CommandError('シークできませんでした: {}'.format(e), expire_in=20)
+
+        return Response(':fast_forward: **{}** を{}から再生します'.format(
+            player.current_entry.title, str(timedelta(seconds=int(seconds))).lstrip('0').lstrip(':')), delete_after=20)
+
+    async def cmd_seek(self, player, position=None):
+        """
+        コマンドのオリジナル互換用ラッパエントリ。栗目ボットの日本語コマンドが使いづらい人用。
+        """
+        return await self.cmd_シーク(player=player, position=position)
+
+    async def cmd_リプレイ(self, player, index=None):
+        """
+        Usage:
+            {command_prefix}リプレイ
+            {command_prefix}リプレイ [番号]
+
+        最近再生した栗目を表示します。番号を指定するとその栗目をすぐにもう一度再生します
+        保存済みのファイルから再生するので、ダウンロードし直すことはありません
+        """
+
+        recent = list(player.recent)
+        if not recent:
+            return Response('最近再生した栗目はありません。', delete_after=20)
+
+        if not index:
+            lines = ['`{}.` **{}**'.format(i, e.title) for i, e in enumerate(recent, 1)]
+            return Response(':repeat: 最近再生した栗目:\n{}'.format('\n'.join(lines)), delete_after=40)
+
+        try:
+            index = int(index)
+            if not 1 <= index <= len(recent):
+                raise ValueError
+        except ValueError:
+            raise exceptions.CommandError('1～{}の番号を指定して下さい。'.format(len(recent)), expire_in=20)
 
+        entry = recent[index - 1]
+        try:
+            player.replay(entry)
+        except FileNotFoundError:
+            raise exceptions.CommandError('**{}** のファイルはもう残っていません。もう一度登録して下さい。'.format(entry.title), expire_in=20)
+
+        return Response(':repeat: **{}** をもう一度再生します'.format(entry.title), delete_after=20)
+
+    async def cmd_replay(self, player, index=None):
+        """
+        コマンドのオリジナル互換用ラッパエントリ。栗目ボットの日本語コマンドが使いづらい人用。
+        """
+        return await self.cmd_リプレイ(player=player, index=index)
+
+    def _queue_embed(self, player, page):
+        playlist = player.playlist
+        pages = self.queue_pages.page_count(playlist)
+        page = max(1, min(page, pages))
+
+        lines = []
         if player.current_entry:
             song_progress = str(timedelta(seconds=player.progress)).lstrip('0').lstrip(':')
-            song_total = str(timedelta(seconds=player.current_entry.duration)).lstrip('0').lstrip(':')
-            prog_str = '`[%s/%s]`' % (song_progress, song_total)
+            if player.current_entry.is_live:
+                prog_str = '`[%s/LIVE 遅延%.1f秒]`' % (song_progress, player.live_latency or 0)
+            else:
+                song_total = str(timedelta(seconds=player.current_entry.duration)).lstrip('0').lstrip(':')
+                prog_str = '`[%s/%s]`' % (song_progress, song_total)
 
             if player.current_entry.meta.get('channel', False) and player.current_entry.meta.get('author', False):
                 lines.append("再生中:projector:: **%s** が追加した **%s** :alarm_clock:%s\n" % (
@@ -1956,36 +2218,90 @@ class MusicBot(discord.Client):
             else:
                 lines.append("再生中:projector:: **%s** :alarm_clock:%s\n" % (player.current_entry.title, prog_str))
 
-        for i, item in enumerate(player.playlist, 1):
-            if item.meta.get('channel', False) and item.meta.get('author', False):
-                nextline = ':hash:`{}` {}**{}**  :u7533:**{}**'.format(i, [":film_frames:", "<:osu:245831611050885121>"][item.type.value=='osu'], item.title, item.meta['author'].name).strip()
-            else:
-                nextline = ':hash:`{}` {}**{}**'.format(i, [":film_frames:", "<:osu:245831611050885121>"][item.type.value=='osu'], item.title).strip()
+        lines.extend(self.queue_pages.page(playlist, page))
+
+        if not playlist.entries:
+            lines.append(
+                'リストに何もありませんよ？ なんか入れるには {}登録、または{}登録しよう。'.format(self.config.command_prefix, self.config.subcommand_prefix))
 
-            currentlinesum = sum(len(x) + 1 for x in lines)  # +1 is for newline char
+        count = len(playlist.entries)
+        total = str(timedelta(seconds=int(playlist.entries.duration_until(count)))).lstrip('0').lstrip(':') or '0'
+        lives = playlist.entries.live_until(count)
 
-            if currentlinesum + len(nextline) + len(andmoretext) > DISCORD_MSG_CHAR_LIMIT:
-                if currentlinesum + len(andmoretext):
-                    unlisted += 1
-                    continue
+        embed = discord.Embed(title="リスト", description='\n'.join(lines), color=0xdec049)
+        embed.set_footer(text="ページ {}/{} ・ {}個の栗目 ・ 合計 {}{}".format(
+            page, pages, count, total, ' + LIVE %s本' % lives if lives else ''))
+        return embed, page, pages
 
-            lines.append(nextline)
+    async def _queue_pager(self, queue_msg, player, page):
+        """
+            Turns the pages of a リスト message on ◀/▶ reactions until nobody touched it for a minute.
+        """
+        def check(reaction, user):
+            return reaction.message.id == queue_msg.id and user != self.user and str(reaction.emoji) in QUEUE_PAGE_EMOJIS
 
-        if unlisted:
-            lines.append('\n*... そして %s つの栗目たち*' % unlisted)
+        while True:
+            try:
+                reaction, user = await self.wait_for('reaction_add', timeout=60, check=check)
+            except asyncio.TimeoutError:
+                break
 
-        if not lines:
-            lines.append(
-                'リストに何もありませんよ？ なんか入れるには {}登録、または{}登録しよう。'.format(self.config.command_prefix, self.config.subcommand_prefix))
+            pages = self.queue_pages.page_count(player.playlist)
+            page = (page - 1 + QUEUE_PAGE_EMOJIS[str(reaction.emoji)]) % pages + 1
+
+            try:
+                embed, page, _ = self._queue_embed(player, page)
+                await queue_msg.edit(embed=embed)
+            except discord.NotFound:
+                return
+
+            try:
+                await queue_msg.remove_reaction(reaction.emoji, user)
+            except discord.HTTPException:
+                pass
 
-        message = '\n'.join(lines)
-        return Response(message, delete_after=30)
+        try:
+            await queue_msg.clear_reactions()
+        except discord.HTTPException:
+            pass
+
+    async def cmd_リスト(self, message, channel, player, page=None):
+        """
+        Usage:
+            {command_prefix}リスト
+            {command_prefix}リスト [ページ]
+
+        リストに登録されたものを表示します
+        ページが複数あるときは ◀ ▶ のリアクションでめくれます
+        """
+
+        try:
+            page = int(page) if page else 1
+        except ValueError:
+            raise exceptions.CommandError('ページは数字で指定して下さい。', expire_in=20)
+
+        embed, page, pages = self._queue_embed(player, page)
+        if pages == 1:
+            return Response(None, embed=embed, delete_after=30)
 
-    async def cmd_queue(self, channel, player):
+        queue_msg = await self.safe_send_message(channel, None, embed=embed, expire_in=90 if self.config.delete_messages else 0)
+        await self._manual_delete_check(message)
+        if not queue_msg:
+            return
+
+        try:
+            for emoji in QUEUE_PAGE_EMOJIS:
+                await queue_msg.add_reaction(emoji)
+        except discord.HTTPException:
+            return
+
+        asyncio.ensure_future(self._queue_pager(queue_msg, player, page))
+
+    async def cmd_queue(self, message, channel, player, page=None):
         """
         コマンドのオリジナル互換用ラッパエントリ。栗目ボットの日本語コマンドが使いづらい人用。
         """
-        return await self.cmd_リスト(channel=channel, player=player)
+        return await self.cmd_リスト(message=message, channel=channel, player=player, page=page)
 
     async def cmd_ﾜﾎﾜｳﾙｾｰ(self, message, channel, guild, author, search_range=50):
         """
@@ -2281,6 +2597,8 @@ class MusicBot(discord.Client):
 
     async def cmd_切断(self, guild):
         await self.disconnect_voice_client(guild)
+        if self.queue_journal:
+            self.queue_journal.forget(guild)
         return Response(":hear_no_evil:", delete_after=20)
 
     async def cmd_disconnect(self, guild):
@@ -2290,6 +2608,14 @@ class MusicBot(discord.Client):
         return await self.cmd_切断(guild=guild)
 
     async def cmd_再起(self, channel):
+        # Before anything else, the positions saved are where listeners stop hearing the tracks
+        try:
+            save_handoff(self, self.config.handoff_file)
+        except Exception:
+            traceback.print_exc()
+            print("[再起] 再生状態を保存できませんでした、最初からやり直します")
+        await self.save_beatmap_index(force=True)
+
         await self.safe_send_message(channel, ":wave:")
         await self.disconnect_all_voice_clients()
         raise exceptions.RestartSignal
@@ -2301,6 +2627,7 @@ class MusicBot(discord.Client):
         await self.cmd_再起(channel=channel)
 
     async def cmd_あぼーん(self, channel):
+        await self.save_beatmap_index(force=True)
         await self.safe_send_message(channel, ":wave:")
         await self.disconnect_all_voice_clients()
         raise exceptions.TerminateSignal
@@ -2472,6 +2799,10 @@ class MusicBot(discord.Client):
                 await self.safe_send_message(message.channel, '```\n%s\n```' % traceback.format_exc())
 
     async def on_voice_state_update(self, member, before, after):
+        if member == member.guild.me and before.channel and not after.channel:
+            self.loop.create_task(self._voice_left(member.guild))
+            return
+
         if not all([before, after]):
             return
 
@@ -2520,7 +2851,7 @@ class MusicBot(discord.Client):
         if before.region != after.region:
             self.safe_print("[サーバー] \"%s\" がリージョンを変更しました: %s -> %s" % (after.name, before.region, after.region))
 
-            await self.reconnect_voice_client(after)
+            self.voice_supervisor.notify(after, 'region change')
 
 
 if __name__ == '__main__':
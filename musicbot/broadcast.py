@@ -0,0 +1,219 @@
+import threading
+
+from collections import deque
+from discord import AudioSource
+
+
+class Broadcast:
+    """
+        One decode and opus encode of a track, shared by every player that plays it at (nearly) the same time.
+
+        A pump thread pulls PCM from the decoder (a PlaybackSource), encodes it once and keeps the packets
+        in a ring.  It only runs `lead` frames ahead of the furthest subscriber, and the ring holds the
+        first `history` frames for as long as possible, so players that start the same track within that
+        window can still start it from the beginning.
+    """
+
+    lead = 50
+
+    def __init__(self, hub, key, decoder, encoder, history):
+        self.hub = hub
+        self.key = key
+        self.decoder = decoder
+        self.encoder = encoder
+
+        self.packets = deque()
+        self.maxlen = history + self.lead
+        self.base = 0               # frame number of packets[0]
+        self.produced = 0
+        self.subscribers = []
+        self.eof = False
+        self.closed = False
+        self.cond = threading.Condition()
+
+        threading.Thread(target=self._pump, name='broadcast', daemon=True).start()
+
+    @property
+    def joinable(self):
+        # Only as long as the start is still in the ring
+        return self.base == 0 and not self.eof and not self.closed
+
+    def _demand(self):
+        return max((s.position for s in self.subscribers), default=0)
+
+    def _pump(self):
+        cond = self.cond
+        try:
+            while True:
+                with cond:
+                    while not self.closed and self.produced - self._demand() >= self.lead:
+                        cond.wait()
+                    if self.closed:
+                        return
+
+                pcm = self.decoder.read()
+                if not pcm:
+                    break
+
+                packet = self.encoder.encode(pcm, self.encoder.SAMPLES_PER_FRAME)
+
+                with cond:
+                    self.packets.append(packet)
+                    self.produced += 1
+                    if len(self.packets) > self.maxlen:
+                        self.packets.popleft()
+                        self.base += 1
+                    cond.notify_all()
+
+        except Exception:
+            # The decoder was cleaned up under us, or opus failed; the subscribers just see the end
+            pass
+
+        with cond:
+            self.eof = True
+            cond.notify_all()
+
+    def subscribe(self):
+        with self.cond:
+            if self.closed:
+                return None
+
+            source = BroadcastSource(self)
+            self.subscribers.append(source)
+            return source
+
+    def unsubscribe(self, source):
+        with self.cond:
+            source.detached = True
+            if source not in self.subscribers:
+                return
+            self.subscribers.remove(source)
+            last = not self.subscribers
+            if last:
+                self.closed = True
+            self.cond.notify_all()
+
+        if last:
+            self.hub._remove(self)
+            self.decoder.cleanup()
+
+    def next_packet(self, source):
+        cond = self.cond
+        with cond:
+            if source.position < self.base:
+                # Fell out of the ring, skip ahead to what's left
+                source.position = self.base
+
+            while source.position >= self.produced and not self.eof and not self.closed and not source.detached:
+                cond.wait()
+
+            if source.position >= self.produced or source.detached:
+                return None
+
+            packet = self.packets[source.position - self.base]
+            source.position += 1
+            cond.notify_all()
+            return packet
+
+
+class BroadcastSource(AudioSource):
+    """
+        A player's view of a Broadcast.  Yields already encoded opus packets.
+
+        The volume is whatever the broadcast was started with; MusicPlayer switches to a private
+        PlaybackSource when it has to change it.
+    """
+
+    underruns = 0
+    stalled = 0.0
+    depth = None
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.position = 0
+        self.frames = 0
+        self.detached = False
+        self._successor = None
+
+    @property
+    def buffered(self):
+        return max(self.broadcast.produced - self.position, 0)
+
+    def is_opus(self):
+        return True
+
+    def read(self):
+        packet = self.broadcast.next_packet(self)
+        if packet is None:
+            # Replaced while the voice thread was waiting on us
+            successor = self._successor
+            return successor.read() if successor else b''
+
+        self.frames += 1
+        return packet
+
+    def get_progress(self):
+        return self.frames * 0.02
+
+    def handoff(self, successor):
+        self._successor = successor
+        self.cleanup()
+
+    def cleanup(self):
+        self.broadcast.unsubscribe(self)
+
+
+class BroadcastHub:
+    """
+        Running Broadcasts by (file, start offset, volume bucket, bitrate).
+
+        MusicPlayer asks for an existing broadcast first (attach) and starts a new one otherwise,
+        so guilds running the same autoplaylist share a single ffmpeg and opus encode per track.
+    """
+
+    def __init__(self, join_window=5, volume_step=0.05):
+        self.history = int(join_window * 50)
+        self.volume_step = volume_step
+        self._broadcasts = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.attached = 0
+
+    def key(self, path, start, volume, bitrate):
+        return path, round(start, 1), round(volume / self.volume_step), bitrate
+
+    def attach(self, key):
+        """
+            Subscribes to a running broadcast of `key` that is still in its join window, or returns None.
+        """
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if not broadcast or not broadcast.joinable:
+                return None
+
+            source = broadcast.subscribe()
+            if source:
+                self.attached += 1
+            return source
+
+    def start(self, key, decoder, encoder):
+        """
+            Starts broadcasting `decoder` under `key` and subscribes to it.  A broadcast that is past
+            its join window is replaced for new players; its subscribers keep it until the end.
+        """
+        broadcast = Broadcast(self, key, decoder, encoder, self.history)
+        source = broadcast.subscribe()
+
+        with self._lock:
+            self._broadcasts[key] = broadcast
+            self.started += 1
+
+        return source
+
+    def _remove(self, broadcast):
+        with self._lock:
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+
+    def __len__(self):
+        return len(self._broadcasts)
@@ -83,9 +83,32 @@ class Config:
         self.delete_messages  = config.getboolean('MusicBot', 'DeleteMessages', fallback=ConfigDefaults.delete_messages)
         self.delete_invoking = config.getboolean('MusicBot', 'DeleteInvoking', fallback=ConfigDefaults.delete_invoking)
         self.debug_mode = config.getboolean('MusicBot', 'DebugMode', fallback=ConfigDefaults.debug_mode)
+        self.osu_extract = config.getboolean('MusicBot', 'osu!ExtractBeatmaps', fallback=ConfigDefaults.osu_extract)
+        self.osu_max_downloads = config.getint('MusicBot', 'osu!MaxDownloads', fallback=ConfigDefaults.osu_max_downloads)
+        self.osu_sources = config.get('MusicBot', 'osu!BeatmapSources', fallback=ConfigDefaults.osu_sources)
+        self.osu_download_timeout = config.getint('MusicBot', 'osu!DownloadTimeout', fallback=ConfigDefaults.osu_download_timeout)
+        self.osu_range_connections = config.getint('MusicBot', 'osu!RangeConnections', fallback=ConfigDefaults.osu_range_connections)
+        self.osu_autoplay_filter = config.get('MusicBot', 'osu!AutoplayFilter', fallback=ConfigDefaults.osu_autoplay_filter)
+        self.broadcast_mode = config.getboolean('MusicBot', 'BroadcastMode', fallback=ConfigDefaults.broadcast_mode)
+        self.broadcast_join_window = config.getfloat('MusicBot', 'BroadcastJoinWindow', fallback=ConfigDefaults.broadcast_join_window)
+        self.opus_max_complexity = config.getint('MusicBot', 'OpusMaxComplexity', fallback=ConfigDefaults.opus_max_complexity)
+        self.opus_min_complexity = config.getint('MusicBot', 'OpusMinComplexity', fallback=ConfigDefaults.opus_min_complexity)
+        self.opus_cpu_budget = config.getfloat('MusicBot', 'OpusCpuBudget', fallback=ConfigDefaults.opus_cpu_budget)
+        self.opus_fec = config.getboolean('MusicBot', 'OpusFEC', fallback=ConfigDefaults.opus_fec)
+        self.opus_packet_loss = config.getint('MusicBot', 'OpusPacketLoss', fallback=ConfigDefaults.opus_packet_loss)
+        self.ffmpeg_stall_timeout = config.getint('MusicBot', 'FFmpegStallTimeout', fallback=ConfigDefaults.ffmpeg_stall_timeout)
+        self.ffmpeg_max_restarts = config.getint('MusicBot', 'FFmpegMaxRestarts', fallback=ConfigDefaults.ffmpeg_max_restarts)
+        self.persist_queue = config.getboolean('MusicBot', 'PersistQueue', fallback=ConfigDefaults.persist_queue)
+        self.no_duplicates_within = config.getint('MusicBot', 'NoDuplicatesWithin', fallback=ConfigDefaults.no_duplicates_within)
+        self.fair_queue = config.getboolean('MusicBot', 'FairQueue', fallback=ConfigDefaults.fair_queue)
+        self.disk_queue = config.getboolean('MusicBot', 'DiskQueue', fallback=ConfigDefaults.disk_queue)
 
         self.blacklist_file = config.get('Files', 'BlacklistFile', fallback=ConfigDefaults.blacklist_file)
         self.auto_playlist_file = config.get('Files', 'AutoPlaylistFile', fallback=ConfigDefaults.auto_playlist_file)
+        self.osu_cookie_file = config.get('Files', 'osu!CookieFile', fallback=ConfigDefaults.osu_cookie_file)
+        self.osu_index_file = config.get('Files', 'osu!IndexFile', fallback=ConfigDefaults.osu_index_file)
+        self.queue_dir = config.get('Files', 'QueueDirectory', fallback=ConfigDefaults.queue_dir)
+        self.handoff_file = config.get('Files', 'HandoffFile', fallback=ConfigDefaults.handoff_file)
 
         self.run_checks()
 
@@ -160,6 +183,11 @@ class Config:
 
         self.delete_invoking = self.delete_invoking and self.delete_messages
 
+        self.osu_sources = [x for x in self.osu_sources.replace(',', ' ').split() if x] or ['official']
+
+        self.opus_max_complexity = min(max(self.opus_max_complexity, 0), 10)
+        self.opus_min_complexity = min(max(self.opus_min_complexity, 0), self.opus_max_complexity)
+
         self.bound_channels = set(item.replace(',', ' ').strip() for item in self.bound_channels)
 
         self.autojoin_channels = set(item.replace(',', ' ').strip() for item in self.autojoin_channels)
@@ -198,10 +226,33 @@ class ConfigDefaults:
     delete_messages = True
     delete_invoking = False
     debug_mode = False
+    osu_extract = True
+    osu_max_downloads = 2
+    osu_sources = 'official'
+    osu_download_timeout = 20
+    osu_range_connections = 4
+    osu_autoplay_filter = ''
+    broadcast_mode = False
+    broadcast_join_window = 5
+    opus_max_complexity = 10
+    opus_min_complexity = 3
+    opus_cpu_budget = 0.75
+    opus_fec = True
+    opus_packet_loss = 15
+    ffmpeg_stall_timeout = 10
+    ffmpeg_max_restarts = 3
+    persist_queue = True
+    no_duplicates_within = 0
+    fair_queue = False
+    disk_queue = False
 
     options_file = 'config/options.ini'
     blacklist_file = 'config/blacklist.txt'
     auto_playlist_file = 'config/autoplaylist.txt' # this will change when I add playlists
+    osu_cookie_file = 'config/osu_cookies.pickle'
+    osu_index_file = 'config/beatmap_index.pickle'
+    queue_dir = 'config/queues'
+    handoff_file = 'config/handoff.json'
 
 # These two are going to be wrappers for the id lists, with add/remove/load/save functions
 # and id/object conversion so types aren't an issue
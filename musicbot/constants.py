@@ -5,4 +5,8 @@ SUB_VERSION = ' ;yahhoEdition_nighty'
 VERSION = MAIN_VERSION + SUB_VERSION
 
 AUDIO_CACHE_PATH = os.path.join(os.getcwd(), 'audio_cache')
+OSZ_CACHE_PATH = os.path.join(os.getcwd(), 'osz_cache')
 DISCORD_MSG_CHAR_LIMIT = 2000
+
+# Reactions that turn the pages of the queue, and which way
+QUEUE_PAGE_EMOJIS = {'◀️': -1, '▶️': 1}
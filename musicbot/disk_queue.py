@@ -0,0 +1,391 @@
+import json
+import sqlite3
+
+from collections import Counter, OrderedDict, deque
+
+from .entry import entry_from_dict
+
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS entries (
+        id INTEGER PRIMARY KEY,
+        pos INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        duration INTEGER NOT NULL,
+        live INTEGER NOT NULL,
+        author INTEGER,
+        key TEXT
+    );
+    CREATE INDEX IF NOT EXISTS entries_pos ON entries (pos);
+    CREATE INDEX IF NOT EXISTS entries_key ON entries (key);
+'''
+
+
+class DiskEntryQueue:
+    """
+        The play queue kept in SQLite, for guilds that queue playlists of thousands of songs.
+
+        Only the first `window` entries (what plays and gets prefetched next) and the last `cached`
+        entries handed out (a page of the queue, a freshly added entry) exist as objects, every other
+        entry is a row holding its to_dict() json and is turned back into an entry when asked for.
+        Positions are kept contiguous, so entry i is one indexed lookup: pages of the queue are read by
+        seeking and shuffle permutes the positions inside the database.  Queue time sums and cache_key
+        refcounts are answered by SQLite from indexes, per-author counts are kept in memory.
+
+        Same interface as EntryQueue.  An entry object stands for its row only while it is in the
+        window or cached: index, remove and `in` treat one that has been dropped since as not queued.
+        The database is private and temporary until open() moves the queue into a file (QueueJournal).
+    """
+
+    window = 50
+    cached = 100
+    read_size = 200
+
+    def __init__(self, playlist, path=''):
+        self.playlist = playlist
+        self.version = 0
+        self.listener = None
+        self._connect(path)
+
+    def _notify(self, op, *args):
+        if self.listener:
+            self.listener(op, *args)
+
+    def _connect(self, path):
+        self.version += 1
+        self.path = path or None
+        self._db = sqlite3.connect(path)
+        if path:
+            # Survives the process dying, without an fsync for every song of an import
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+
+        self._len, head = self._db.execute('SELECT COUNT(*), MIN(pos) FROM entries').fetchone()
+        self._head = head if head is not None else 0
+        self._authors = Counter(dict(self._db.execute('SELECT author, COUNT(*) FROM entries GROUP BY author')))
+
+        self._objects = {}
+        self._rowids = {}
+        self._window = deque()
+        self._lru = OrderedDict()
+        self._fill_window()
+
+    def open(self, path):
+        """
+            Moves the queue into the database at `path` and appends what it holds to the saved queue
+            there, if any.  Returns how many entries were saved there.
+        """
+        pending = self._db.execute('SELECT data, duration, live, author, key FROM entries ORDER BY pos').fetchall()
+        self._db.close()
+        self._connect(path)
+        restored = self._len
+
+        if pending:
+            with self._db:
+                self._db.executemany(
+                    'INSERT INTO entries (pos, data, duration, live, author, key) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((self._head + self._len + i,) + row for i, row in enumerate(pending)))
+            self._connect(path)
+        return restored
+
+    def close(self):
+        """
+            Closes the database, what it holds stays for the next open().  The queue is empty after.
+        """
+        self._db.close()
+        self._connect('')
+
+    # objects for rows
+
+    def _entry(self, rowid, data, cache=True):
+        entry = self._objects.get(rowid)
+        if entry is None:
+            entry = entry_from_dict(self.playlist, json.loads(data))
+            if not cache:
+                return entry
+            self._objects[rowid] = entry
+            self._rowids[entry] = rowid
+
+        if rowid not in self._window:
+            self._lru[rowid] = None
+            self._lru.move_to_end(rowid)
+            self._evict()
+        return entry
+
+    def _keep(self, rowid, entry):
+        self._objects[rowid] = entry
+        self._rowids[entry] = rowid
+
+    def _drop(self, rowid):
+        entry = self._objects.pop(rowid, None)
+        if entry is not None:
+            del self._rowids[entry]
+
+    def _evict(self):
+        while len(self._lru) > self.cached:
+            rowid, _ = self._lru.popitem(last=False)
+            if rowid not in self._window:
+                self._drop(rowid)
+
+    def _unpin(self, rowid):
+        # Out of the window, it stays around like any entry handed out
+        self._lru[rowid] = None
+        self._evict()
+
+    def _fill_window(self):
+        old = set(self._window)
+        rows = self._db.execute('SELECT id, data FROM entries WHERE pos >= ? AND pos < ? ORDER BY pos',
+                                (self._head, self._head + self.window)).fetchall()
+        self._window = deque(rowid for rowid, _ in rows)
+        for rowid, data in rows:
+            self._lru.pop(rowid, None)
+            if rowid not in self._objects:
+                self._keep(rowid, entry_from_dict(self.playlist, json.loads(data)))
+
+        for rowid in old.difference(self._window):
+            if rowid in self._objects:
+                self._unpin(rowid)
+
+    def _insert(self, pos, entry):
+        self.version += 1
+        key = entry.cache_key
+        with self._db:
+            rowid = self._db.execute(
+                'INSERT INTO entries (pos, data, duration, live, author, key) VALUES (?, ?, ?, ?, ?, ?)',
+                (pos, json.dumps(entry.to_dict(), separators=(',', ':'), ensure_ascii=False), entry.duration or 0,
+                 int(entry.is_live), entry.meta.author_id, key if isinstance(key, str) else None)).lastrowid
+
+        self._len += 1
+        self._authors[entry.meta.author_id] += 1
+        self._keep(rowid, entry)
+        return rowid
+
+    def _pos_of(self, entry):
+        rowid = self._rowids.get(entry)
+        if rowid is None:
+            raise ValueError('entry not in queue')
+        return self._db.execute('SELECT pos FROM entries WHERE id = ?', (rowid,)).fetchone()[0]
+
+    def _delete(self, start, stop):
+        """
+            Deletes positions [start, stop) and closes the gap from whichever side is shorter.
+        """
+        self.version += 1
+        db = self._db
+        count = stop - start
+        for author, n in db.execute('SELECT author, COUNT(*) FROM entries WHERE pos >= ? AND pos < ? GROUP BY author',
+                                    (start, stop)).fetchall():
+            self._authors[author] -= n
+            if self._authors[author] <= 0:
+                del self._authors[author]
+        rowids = [rowid for rowid, in db.execute('SELECT id FROM entries WHERE pos >= ? AND pos < ?', (start, stop))]
+
+        with db:
+            db.execute('DELETE FROM entries WHERE pos >= ? AND pos < ?', (start, stop))
+            if start - self._head < self._head + self._len - stop:
+                db.execute('UPDATE entries SET pos = pos + ? WHERE pos < ?', (count, start))
+                self._head += count
+            else:
+                db.execute('UPDATE entries SET pos = pos - ? WHERE pos >= ?', (count, stop))
+
+        self._len -= count
+        for rowid in rowids:
+            self._lru.pop(rowid, None)
+            self._drop(rowid)
+
+    # deque compatible
+
+    def append(self, entry):
+        if entry in self:
+            self.remove(entry)
+
+        rowid = self._insert(self._head + self._len, entry)
+        if len(self._window) < self.window and len(self._window) == self._len - 1:
+            self._window.append(rowid)
+        else:
+            self._unpin(rowid)
+        self._notify('append', entry)
+
+    def appendleft(self, entry):
+        if entry in self:
+            self.remove(entry)
+
+        self._head -= 1
+        rowid = self._insert(self._head, entry)
+        self._window.appendleft(rowid)
+        if len(self._window) > self.window:
+            self._unpin(self._window.pop())
+        self._notify('appendleft', entry)
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty queue')
+
+        entry = self[0]
+        rowid = self._rowids[entry]
+        self._delete(self._head, self._head + 1)
+        if self._window and self._window[0] == rowid:
+            self._window.popleft()
+            self._extend_window()
+        else:
+            self._fill_window()
+        self._notify('popleft')
+        return entry
+
+    def _extend_window(self):
+        if len(self._window) < min(self.window, self._len):
+            row = self._db.execute('SELECT id, data FROM entries WHERE pos = ?',
+                                   (self._head + len(self._window),)).fetchone()
+            self._lru.pop(row[0], None)
+            if row[0] not in self._objects:
+                self._keep(row[0], entry_from_dict(self.playlist, json.loads(row[1])))
+            self._window.append(row[0])
+
+    def remove(self, entry):
+        pos = self._pos_of(entry)
+        index = pos - self._head
+        self._delete(pos, pos + 1)
+        self._fill_window()
+        self._notify('remove', index, 1)
+
+    def clear(self):
+        self.version += 1
+        with self._db:
+            self._db.execute('DELETE FROM entries')
+        self._len = self._head = 0
+        self._authors.clear()
+        self._objects.clear()
+        self._rowids.clear()
+        self._window.clear()
+        self._lru.clear()
+        self._notify('clear')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._len))]
+
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+
+        if index < len(self._window):
+            return self._objects[self._window[index]]
+
+        rowid, data = self._db.execute('SELECT id, data FROM entries WHERE pos = ?', (self._head + index,)).fetchone()
+        return self._entry(rowid, data)
+
+    def __iter__(self):
+        # Read in slices, only what is already an object comes out as the same object
+        for start in range(self._head, self._head + self._len, self.read_size):
+            rows = self._db.execute('SELECT id, data FROM entries WHERE pos >= ? AND pos < ? ORDER BY pos',
+                                    (start, start + self.read_size)).fetchall()
+            for rowid, data in rows:
+                yield self._entry(rowid, data, cache=False)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __contains__(self, entry):
+        return entry in self._rowids
+
+    # indexed operations
+
+    def index(self, entry):
+        """
+            0 based position of `entry`.
+        """
+        return self._pos_of(entry) - self._head
+
+    def duration_until(self, count):
+        """
+            Total duration of the first `count` entries.
+        """
+        return self._db.execute('SELECT COALESCE(SUM(duration), 0) FROM entries WHERE pos < ?', (self._head + count,)).fetchone()[0]
+
+    def live_until(self, count):
+        """
+            Number of live streams among the first `count` entries.
+        """
+        return self._db.execute('SELECT COUNT(*) FROM entries WHERE pos < ? AND live', (self._head + count,)).fetchone()[0]
+
+    def count_for(self, author):
+        return self._authors.get(getattr(author, 'id', author), 0)
+
+    def refs(self, key):
+        """
+            Number of queued entries playing `key` (a cache_key).
+        """
+        return self._db.execute('SELECT COUNT(*) FROM entries WHERE key = ?', (key,)).fetchone()[0]
+
+    def last_index(self, key):
+        """
+            Position of the last entry playing `key`, None if there is none.
+        """
+        pos = self._db.execute('SELECT MAX(pos) FROM entries WHERE key = ?', (key,)).fetchone()[0]
+        return None if pos is None else pos - self._head
+
+    def queued_within(self, key, count):
+        """
+            Whether an entry playing `key` is among the last `count` entries.
+        """
+        index = self.last_index(key)
+        return index is not None and self._len - index <= count
+
+    def move(self, entry, index):
+        """
+            Moves `entry` so that it ends up at position `index`.
+        """
+        self.version += 1
+        pos = self._pos_of(entry)
+        old = pos - self._head
+        index = max(0, min(index, self._len - 1))
+        target = self._head + index
+
+        with self._db:
+            if target < pos:
+                self._db.execute('UPDATE entries SET pos = pos + 1 WHERE pos >= ? AND pos < ?', (target, pos))
+            else:
+                self._db.execute('UPDATE entries SET pos = pos - 1 WHERE pos > ? AND pos <= ?', (pos, target))
+            self._db.execute('UPDATE entries SET pos = ? WHERE id = ?', (target, self._rowids[entry]))
+
+        self._fill_window()
+        self._notify('move', old, index)
+
+    def remove_range(self, start, stop=None):
+        """
+            Removes and returns the entries at positions [start, stop).
+        """
+        stop = self._len if stop is None else min(stop, self._len)
+        start = max(start, 0)
+        if start >= stop:
+            return []
+
+        removed = self[start:stop]
+        self._delete(self._head + start, self._head + stop)
+        self._fill_window()
+        self._notify('remove', start, stop - start)
+        return removed
+
+    def shuffle(self):
+        """
+            Permutes the positions inside the database.
+        """
+        self.version += 1
+        with self._db:
+            # Rows are numbered in the random order they are inserted in
+            self._db.execute('CREATE TEMP TABLE shuffled (n INTEGER PRIMARY KEY, id INTEGER UNIQUE)')
+            self._db.execute('INSERT INTO shuffled (id) SELECT id FROM entries ORDER BY random()')
+            self._db.execute('UPDATE entries SET pos = ? + (SELECT n - 1 FROM shuffled WHERE shuffled.id = entries.id)',
+                             (self._head,))
+            self._db.execute('DROP TABLE shuffled')
+
+        self._fill_window()
+        self._notify('reset')
+
+    def __repr__(self):
+        return '<DiskEntryQueue of %s entries, %s in memory>' % (self._len, len(self._objects))
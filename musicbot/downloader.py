@@ -6,7 +6,7 @@ import zipfile
 
 from concurrent.futures import ThreadPoolExecutor
 from .config import Config, ConfigDefaults
-from .entry import OsuLocalPlaylistEntry
+from .constants import OSZ_CACHE_PATH
 #from .bot import Response
 
 ytdl_format_options = {
@@ -91,81 +91,25 @@ class Downloader:
     async def safe_extract_info(self, loop, *args, **kwargs):
         return await loop.run_in_executor(self.thread_pool, functools.partial(self.safe_ytdl.extract_info, *args, **kwargs))
 
-    def osuDL(self, playlist, osz_id, fname, dres, busymsg, player, bidhash, **meta):
-        with open(fname, 'wb') as file:
-            for chunk in dres.iter_content(chunk_size=64 * 1024):
-                if chunk:
-                    file.write(chunk)
-                    #file.flush()
-            file.close()
-        print("ダウンロード完了!")
-        dcdir = os.path.join(self.config.osumdir, os.path.splitext(fname)[0])
-        os.mkdir(dcdir)
-        with zipfile.ZipFile(fname, 'r') as zip_file:
-            zip_file.extractall(path=dcdir)
-        os.remove(fname)
-        print (meta.items())
-        #ch = meta['channel']
-        #at = meta['author']
-        title, music_filename, duration, _ = playlist.detecter(dcdir, bidhash=bidhash)
-        audio_filename = playlist.sanitize_path(music_filename)
-        entrypack = []
-        if bidhash:
-            entry = OsuLocalPlaylistEntry(
-                playlist,
-                "https://osu.ppy.sh/s/" + osz_id,
-                "https://osu.ppy.sh/beatmapsets/{}#{}/{}".format(osz_id, bidhash[2], bidhash[0]),
-                "[osu!譜面]" + title,
-                round(duration),
-                filename=audio_filename,
-                **meta
-            )
-            playlist.entries.append(entry)
-            playlist.emit('entry-added', playlist=playlist, entry=entry)
-
-            if playlist.peek() is entry:
-                entry.get_ready_future()
-            entrypack.append((entry, len(playlist.entries)))
+    def osuDL(self, fname):
+        """
+            Unpacks a downloaded beatmap set (or moves it to the osz cache).
+            Runs in the thread pool, returns the song directory or the archive path.
+        """
+        if self.config.osu_extract:
+            dcdir = os.path.join(self.config.osumdir, os.path.splitext(os.path.basename(fname))[0])
+            os.makedirs(dcdir, exist_ok=True)
+            with zipfile.ZipFile(fname, 'r') as zip_file:
+                zip_file.extractall(path=dcdir)
+            os.remove(fname)
+            return dcdir
         else:
-            entry = OsuLocalPlaylistEntry(
-                playlist,
-                "https://osu.ppy.sh/s/" + osz_id,
-                "https://osu.ppy.sh/beatmapsets/{}".format(osz_id),
-                "[osu!譜面]" + title,
-                round(duration),
-                filename=audio_filename,
-                **meta
-            )
-            playlist.entries.append(entry)
-            playlist.emit('entry-added', playlist=playlist, entry=entry)
-
-            if playlist.peek() is entry:
-                entry.get_ready_future()
-            entrypack.append((entry, len(playlist.entries)))
-        #reply_text = " osu!譜面：**{}**をプレイリストに追加しました。~~多分~~"
-        #btext = entrypack[0][0].title
-
-        #reply = reply_text.format(btext)
-        #self.bot.safe_send_message(ch, reply, expire_in=15, also_delete=busymsg)
-        #self.bot.fin_add_entry(player, osz_id, busymsg, ch, at)
-        return entrypack[0]
-
-    async def osuDown(self, playlist, osz_id, fname, dres, busymsg=None, player=None, bidhash=None, **meta):
-        #try:
-        
-        #await self.bot.fin_add_entry(id, msg, ch, at)
-        #self.osuDLloop.run_forever()
-        return await self.bot.loop.run_in_executor(self.thread_pool, functools.partial(self.osuDL, playlist, osz_id, fname, dres, busymsg=busymsg, player=player, bidhash=bidhash, **meta))
-
-        #except Exception as e:
-
-            # (youtube_dl.utils.ExtractorError, youtube_dl.utils.DownloadError)
-            # I hope I don't have to deal with ContentTooShortError's
-            #if asyncio.iscoroutinefunction(on_error):
-                #asyncio.ensure_future(on_error(e), loop=loop)
-
-            #elif asyncio.iscoroutine(on_error):
-                #asyncio.ensure_future(on_error, loop=loop)
-
-            #else:
-                #loop.call_soon_threadsafe(on_error, e)
+            # Keep the set packed, the audio is read straight out of the archive
+            if not os.path.exists(OSZ_CACHE_PATH):
+                os.makedirs(OSZ_CACHE_PATH)
+            osz = os.path.join(OSZ_CACHE_PATH, os.path.basename(fname))
+            os.replace(fname, osz)
+            return osz
+
+    async def osuDown(self, fname):
+        return await self.bot.loop.run_in_executor(self.thread_pool, functools.partial(self.osuDL, fname))
@@ -1,9 +1,13 @@
 import asyncio
 import json
 import os
+import sys
 import traceback
 
+from collections.abc import Mapping
+
 from .exceptions import ExtractionError
+from .osz import OszAudioMember
 from .utils import get_header, md5sum
 from enum import Enum
 
@@ -11,12 +15,85 @@ from enum import Enum
 class PLType(Enum):
     URL='url'
     Osu='osu'
+    Stream='stream'
+
+
+class EntryMeta(Mapping):
+    """
+        Where and by whom an entry was queued.  Reads like the {'channel': ..., 'author': ...} dict of
+        Discord objects it replaces, but only keeps the ids: the channel and author are looked up in the
+        client's cache on every access, so queued entries don't keep members alive after they leave.
+        Whatever can't be found (the cache isn't filled yet after a restore, the member left) is missing.
+    """
+
+    __slots__ = ('bot', 'channel_id', 'author_id')
+
+    def __init__(self, bot, channel_id=None, author_id=None):
+        self.bot = bot
+        self.channel_id = channel_id
+        self.author_id = author_id
+
+    @classmethod
+    def of(cls, bot, meta):
+        """
+            From a dict of Discord objects or of their ids.
+        """
+        ids = meta_ids(meta)
+        return cls(bot, ids.get('channel'), ids.get('author'))
+
+    @property
+    def ids(self):
+        return {key: value for key, value in (('channel', self.channel_id), ('author', self.author_id)) if value is not None}
+
+    def _resolve(self):
+        found = {}
+        channel = self.bot.get_channel(self.channel_id) if self.channel_id else None
+        if channel is None:
+            return found
+        found['channel'] = channel
+
+        if self.author_id:
+            guild = getattr(channel, 'guild', None)
+            author = guild.get_member(self.author_id) if guild else self.bot.get_user(self.author_id)
+            if author is not None:
+                found['author'] = author
+        return found
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._resolve())
+
+
+def meta_ids(meta):
+    """
+        {key: id} of the Discord objects in an entry's meta.
+    """
+    if isinstance(meta, EntryMeta):
+        return meta.ids
+    return {key: getattr(value, 'id', value) for key, value in meta.items() if value is not None}
+
 
 class BasePlaylistEntry:
+    """
+        Entries are slotted and hold as little as they can: big imports queue thousands of them.
+        Discord objects are kept as ids (EntryMeta) and the list of futures only exists while someone
+        waits for a download.
+    """
+
+    __slots__ = ('playlist', 'url', 'title', 'duration', 'filename', 'meta', '_is_downloading', '_waiting_futures')
+
+    # Live streams have no end, and so no duration
+    is_live = False
+
     def __init__(self):
         self.filename = None
         self._is_downloading = False
-        self._waiting_futures = []
+        self._waiting_futures = None
 
     @property
     def is_downloaded(self):
@@ -25,11 +102,28 @@ class BasePlaylistEntry:
 
         return bool(self.filename)
 
+    @property
+    def cache_key(self):
+        """
+            Identifies the file the entry plays, the same for every entry of the same song.
+        """
+        return self.filename
+
     @classmethod
     def from_json(cls, playlist, jsonstring):
-        raise NotImplementedError
+        return entry_from_dict(playlist, json.loads(jsonstring))
 
     def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    @classmethod
+    def from_dict(cls, playlist, data):
+        raise NotImplementedError
+
+    def to_dict(self):
+        """
+            A json friendly dict of the entry, Discord objects in meta are stored by id.
+        """
         raise NotImplementedError
 
     async def _download(self):
@@ -48,6 +142,8 @@ class BasePlaylistEntry:
         else:
             # If we request a ready future, let's ensure that it'll actually resolve at one point.
             asyncio.ensure_future(self._download())
+            if self._waiting_futures is None:
+                self._waiting_futures = []
             self._waiting_futures.append(future)
 
         return future
@@ -56,8 +152,8 @@ class BasePlaylistEntry:
         """
             Calls `cb` for each future that is not cancelled. Absorbs and logs any errors that may have occurred.
         """
-        futures = self._waiting_futures
-        self._waiting_futures = []
+        futures = self._waiting_futures or ()
+        self._waiting_futures = None
 
         for future in futures:
             if future.cancelled():
@@ -77,6 +173,10 @@ class BasePlaylistEntry:
 
 
 class URLPlaylistEntry(BasePlaylistEntry):
+    __slots__ = ('expected_filename',)
+
+    type = PLType.URL
+
     def __init__(self, playlist, url, title, duration=0, expected_filename=None, **meta):
         super().__init__()
 
@@ -85,52 +185,36 @@ class URLPlaylistEntry(BasePlaylistEntry):
         self.title = title
         self.duration = duration
         self.expected_filename = expected_filename
-        self.meta = meta
-        self.type = PLType.URL
+        self.meta = EntryMeta.of(playlist.bot, meta)
+
+    @property
+    def download_folder(self):
+        return self.playlist.downloader.download_folder
 
-        self.download_folder = self.playlist.downloader.download_folder
+    @property
+    def cache_key(self):
+        # The final filename may get a hash inserted, what ytdl expects stays the same
+        return self.expected_filename or self.url
 
     @classmethod
-    def from_json(cls, playlist, jsonstring):
-        data = json.loads(jsonstring)
-        print(data)
-        # TODO: version check
-        url = data['url']
-        title = data['title']
-        duration = data['duration']
-        downloaded = data['downloaded']
-        filename = data['filename'] if downloaded else None
-        meta = {}
-
-        # TODO: Better [name] fallbacks
-        if 'channel' in data['meta']:
-            ch = playlist.bot.get_channel(data['meta']['channel']['id'])
-            meta['channel'] = ch or data['meta']['channel']['name']
-
-        if 'author' in data['meta']:
-            meta['author'] = meta['channel'].server.get_member(data['meta']['author']['id'])
-
-        return cls(playlist, url, title, duration, filename, **meta)
+    def from_dict(cls, playlist, data):
+        entry = cls(playlist, data['url'], data['title'], data['duration'], data['expected_filename'], **data['meta'])
 
-    def to_json(self):
-        data = {
-            'version': 1,
+        if data.get('filename') and os.path.isfile(data['filename']):
+            entry.filename = entry.expected_filename if data['filename'] == entry.expected_filename else data['filename']
+        return entry
+
+    def to_dict(self):
+        return {
+            'version': 2,
             'type': self.__class__.__name__,
             'url': self.url,
             'title': self.title,
             'duration': self.duration,
-            'downloaded': self.is_downloaded,
-            'filename': self.filename,
-            'meta': {
-                i: {
-                    'type': self.meta[i].__class__.__name__,
-                    'id': self.meta[i].id,
-                    'name': self.meta[i].name
-                    } for i in self.meta
-                }
-            # Actually I think I can just getattr instead, getattr(discord, type)
+            'expected_filename': self.expected_filename,
+            'filename': self.filename if self.is_downloaded else None,
+            'meta': meta_ids(self.meta)
         }
-        return json.dumps(data, indent=2)
 
     # noinspection PyTypeChecker
     async def _download(self):
@@ -196,6 +280,9 @@ class URLPlaylistEntry(BasePlaylistEntry):
 
                     if expected_fname_base in ldir:
                         self.filename = os.path.join(self.download_folder, expected_fname_base)
+                        if self.filename == self.expected_filename:
+                            # One string instead of two equal ones
+                            self.filename = self.expected_filename
                         print("[ダウンロード] 保存済:", self.url)
 
                     elif expected_fname_noex in flistdir:
@@ -247,62 +334,110 @@ class URLPlaylistEntry(BasePlaylistEntry):
                 # Move the temporary file to it's final location.
                 os.rename(unhashed_fname, self.filename)
 
+class StreamPlaylistEntry(BasePlaylistEntry):
+    """
+        A live stream or internet radio.  Never downloaded: ffmpeg reads the media url directly, which is
+        resolved again every time the entry gets ready to play since those urls tend to expire.
+    """
+
+    __slots__ = ('drops',)
+
+    type = PLType.Stream
+    is_live = True
+
+    def __init__(self, playlist, url, title, stream_url=None, **meta):
+        super().__init__()
+
+        self.playlist = playlist
+        self.url = url
+        self.title = title
+        self.duration = 0
+        self.filename = stream_url
+        self.drops = 0
+        self.meta = EntryMeta.of(playlist.bot, meta)
+
+    @property
+    def cache_key(self):
+        return self.url
+
+    @classmethod
+    def from_dict(cls, playlist, data):
+        # The media url has long expired, it's resolved again before playing
+        return cls(playlist, data['url'], data['title'], **data['meta'])
+
+    def to_dict(self):
+        return {
+            'version': 2,
+            'type': self.__class__.__name__,
+            'url': self.url,
+            'title': self.title,
+            'meta': meta_ids(self.meta)
+        }
+
+    def expire(self):
+        """
+            Forgets the media url, the next get_ready_future resolves a fresh one.
+        """
+        self.filename = None
+
+    async def _download(self):
+        if self._is_downloading:
+            return
+
+        self._is_downloading = True
+        try:
+            info = await self.playlist.downloader.extract_info(self.playlist.loop, self.url, download=False)
+            if not info or not info.get('url'):
+                raise ExtractionError('Could not resolve the stream url of %s' % self.url)
+
+            self.filename = info['url']
+            self._for_each_future(lambda future: future.set_result(self))
+
+        except Exception as e:
+            traceback.print_exc()
+            self._for_each_future(lambda future: future.set_exception(e))
+
+        finally:
+            self._is_downloading = False
+
+
 class OsuLocalPlaylistEntry(BasePlaylistEntry):
-    def __init__(self, playlist, url, newurl, title, duration=0, filename=str, **meta):
+    __slots__ = ('newurl', 'archive')
+
+    type = PLType.Osu
+
+    def __init__(self, playlist, url, newurl, title, duration=0, filename=str, archive=None, **meta):
         super().__init__()
 
         self.playlist = playlist
         self.url = url
         self.newurl = newurl
         self.title = title
-        self.filename = filename
+        # Every difficulty of a set plays the same file (or archive)
+        self.filename = sys.intern(filename) if isinstance(filename, str) else filename
         self.duration = duration
-        self.meta = meta
-        self.type = PLType.Osu
-    
-    @classmethod
-    def from_json(cls, playlist, jsonstring):
-        data = json.loads(jsonstring)
-        print(data)
-        # TODO: version check
-        url = data['url']
-        newurl = data['newurl']
-        title = data['title']
-        duration = data['duration']
-        downloaded = data['downloaded']
-        filename = data['filename'] if downloaded else None
-        meta = {}
-
-        # TODO: Better [name] fallbacks
-        if 'channel' in data['meta']:
-            ch = playlist.bot.get_channel(data['meta']['channel']['id'])
-            meta['channel'] = ch or data['meta']['channel']['name']
-
-        if 'author' in data['meta']:
-            meta['author'] = meta['channel'].server.get_member(data['meta']['author']['id'])
-
-        return cls(playlist, url, title, duration, filename, **meta)
+        # OszAudioMember when the audio is played straight from an .osz (filename is the archive then)
+        self.archive = archive
+        self.meta = EntryMeta.of(playlist.bot, meta)
 
-    def to_json(self):
-        data = {
-            'version': 1,
+    @classmethod
+    def from_dict(cls, playlist, data):
+        archive = OszAudioMember(*data['archive']) if data.get('archive') else None
+        return cls(playlist, data['url'], data['newurl'], data['title'], data['duration'], data['filename'], archive, **data['meta'])
+
+    def to_dict(self):
+        archive = self.archive
+        return {
+            'version': 2,
             'type': self.__class__.__name__,
             'url': self.url,
             'newurl': self.newurl,
             'title': self.title,
             'duration': self.duration,
-            'downloaded': self.is_downloaded,
             'filename': self.filename,
-            'meta': {
-                i: {
-                    'type': self.meta[i].__class__.__name__,
-                    'id': self.meta[i].id,
-                    'name': self.meta[i].name
-                    } for i in self.meta
-                }
-            # Actually I think I can just getattr instead, getattr(discord, type)
+            'archive': [archive.archive, archive.name, archive.offset, archive.size, archive.stored] if archive else None,
+            'meta': meta_ids(self.meta)
         }
-        return json.dumps(data, indent=2)
 
     # noinspection PyTypeChecker
     async def _download(self):
@@ -314,3 +449,10 @@ class OsuLocalPlaylistEntry(BasePlaylistEntry):
         #print("[osu!譜面再生機能]ファイル名：{}".format(self.expected_filename))
         self._for_each_future(lambda future: future.set_result(self))
         self._is_downloading = False
+
+
+_ENTRY_TYPES = {cls.__name__: cls for cls in (URLPlaylistEntry, StreamPlaylistEntry, OsuLocalPlaylistEntry)}
+
+
+def entry_from_dict(playlist, data):
+    return _ENTRY_TYPES[data['type']].from_dict(playlist, data)
@@ -0,0 +1,673 @@
+import random
+
+from collections import Counter, deque
+
+
+class _Fenwick:
+    """
+        Prefix sums over a fixed number of slots, O(log n) update and query.
+    """
+
+    def __init__(self, values):
+        self.size = len(values)
+        tree = [0] + list(values)
+        for i in range(1, self.size + 1):
+            j = i + (i & -i)
+            if j <= self.size:
+                tree[j] += tree[i]
+        self.tree = tree
+
+        self._top = 1
+        while self._top * 2 <= self.size:
+            self._top *= 2
+
+    def add(self, i, delta):
+        i += 1
+        tree = self.tree
+        while i <= self.size:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """
+            Sum of slots [0, i).
+        """
+        total = 0
+        tree = self.tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, k):
+        """
+            The slot holding the k-th (0 based) unit, for 0/1 valued trees.
+        """
+        pos = 0
+        step = self._top
+        tree = self.tree
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] <= k:
+                pos = nxt
+                k -= tree[nxt]
+            step //= 2
+        return pos
+
+
+def _author_key(entry):
+    # EntryMeta keeps the id, whether or not the member can still be found
+    return entry.meta.author_id
+
+
+class EntryQueue:
+    """
+        The play queue.  Behaves like the deque it replaces (append, appendleft, popleft, [i], remove,
+        iteration) but keeps indexes so the questions asked on every add don't walk the whole queue:
+
+        - position and queue time up to a position, through Fenwick trees over the slots, O(log n)
+        - per-author entry counts, O(1)
+        - how many queued entries play the same file (cache_key) and where the last one is, O(1)/O(log n)
+        - removal by entry (the entry is its own handle), O(log n), leaving a tombstone that is
+          compacted away once tombstones outnumber entries
+
+        Entries are unique: adding an entry that is already queued moves it.
+        `version` changes on every mutation, for caches of anything derived from the queue, and every
+        mutation is reported to `listener(op, *args)` if one is set (see QueueJournal).
+    """
+
+    def __init__(self, entries=()):
+        self.version = 0
+        self.listener = None
+        self._rebuild(list(entries))
+
+    def _notify(self, op, *args):
+        if self.listener:
+            self.listener(op, *args)
+
+    def _rebuild(self, entries, left=16):
+        self.version += 1
+        right = max(16, len(entries))
+        self._slots = [None] * left + entries + [None] * right
+        self._head = left
+        self._tail = left + len(entries)
+        self._len = len(entries)
+        self._slot_of = {e: left + i for i, e in enumerate(entries)}
+        self._authors = Counter(_author_key(e) for e in entries)
+        self._keys = {}
+        for i, e in enumerate(entries):
+            self._keys.setdefault(e.cache_key, set()).add(left + i)
+
+        self._count = _Fenwick([1 if e is not None else 0 for e in self._slots])
+        self._duration = _Fenwick([(e.duration or 0) if e is not None else 0 for e in self._slots])
+        self._live = _Fenwick([1 if e is not None and e.is_live else 0 for e in self._slots])
+
+    def _compact(self, left=16):
+        self._rebuild(list(self), left)
+
+    def _place(self, slot, entry):
+        self.version += 1
+        self._slots[slot] = entry
+        self._slot_of[entry] = slot
+        self._authors[_author_key(entry)] += 1
+        self._keys.setdefault(entry.cache_key, set()).add(slot)
+        self._len += 1
+        self._count.add(slot, 1)
+        self._duration.add(slot, entry.duration or 0)
+        if entry.is_live:
+            self._live.add(slot, 1)
+
+    def _take(self, slot):
+        self.version += 1
+        entry = self._slots[slot]
+        self._slots[slot] = None
+        del self._slot_of[entry]
+
+        key = _author_key(entry)
+        self._authors[key] -= 1
+        if not self._authors[key]:
+            del self._authors[key]
+
+        slots = self._keys[entry.cache_key]
+        slots.discard(slot)
+        if not slots:
+            del self._keys[entry.cache_key]
+
+        self._len -= 1
+        self._count.add(slot, -1)
+        self._duration.add(slot, -(entry.duration or 0))
+        if entry.is_live:
+            self._live.add(slot, -1)
+
+        tombstones = (self._tail - self._head) - self._len
+        if tombstones > 64 and tombstones > self._len:
+            self._compact()
+        return entry
+
+    def _slot_at(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+
+        return self._count.find(index)
+
+    # deque compatible
+
+    def append(self, entry):
+        if entry in self._slot_of:
+            self.remove(entry)
+
+        if self._tail == len(self._slots):
+            self._compact(left=self._head if self._head < 16 else 16)
+
+        self._place(self._tail, entry)
+        self._tail += 1
+        self._notify('append', entry)
+
+    def appendleft(self, entry):
+        if entry in self._slot_of:
+            self.remove(entry)
+
+        if self._head == 0:
+            self._compact(left=max(16, self._len))
+
+        self._head -= 1
+        self._place(self._head, entry)
+        self._notify('appendleft', entry)
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty queue')
+
+        while self._slots[self._head] is None:
+            self._head += 1
+
+        entry = self._take(self._head)
+        self._notify('popleft')
+        return entry
+
+    def remove(self, entry):
+        slot = self._slot_of.get(entry)
+        if slot is None:
+            raise ValueError('entry not in queue')
+
+        index = self._count.prefix(slot)
+        self._take(slot)
+        # After the change, the listener may snapshot the queue instead of logging it
+        self._notify('remove', index, 1)
+
+    def clear(self):
+        self._rebuild([])
+        self._notify('clear')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        return self._slots[self._slot_at(index)]
+
+    def __iter__(self):
+        slots = self._slots
+        return (slots[i] for i in range(self._head, self._tail) if slots[i] is not None)
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __contains__(self, entry):
+        return entry in self._slot_of
+
+    # indexed operations
+
+    def index(self, entry):
+        """
+            0 based position of `entry`.
+        """
+        slot = self._slot_of.get(entry)
+        if slot is None:
+            raise ValueError('entry not in queue')
+
+        return self._count.prefix(slot)
+
+    def _prefix_slot(self, count):
+        # First slot past the first `count` entries
+        if count <= 0:
+            return 0
+        if count >= self._len:
+            return self._tail
+        return self._count.find(count)
+
+    def duration_until(self, count):
+        """
+            Total duration of the first `count` entries.
+        """
+        return self._duration.prefix(self._prefix_slot(count))
+
+    def live_until(self, count):
+        """
+            Number of live streams among the first `count` entries.
+        """
+        return self._live.prefix(self._prefix_slot(count))
+
+    def count_for(self, author):
+        return self._authors.get(getattr(author, 'id', author), 0)
+
+    def refs(self, key):
+        """
+            Number of queued entries playing `key` (a cache_key).
+        """
+        return len(self._keys.get(key, ()))
+
+    def last_index(self, key):
+        """
+            Position of the last entry playing `key`, None if there is none.
+        """
+        slots = self._keys.get(key)
+        if not slots:
+            return None
+        return self._count.prefix(max(slots))
+
+    def queued_within(self, key, count):
+        """
+            Whether an entry playing `key` is among the last `count` entries.
+        """
+        index = self.last_index(key)
+        return index is not None and self._len - index <= count
+
+    def move(self, entry, index):
+        """
+            Moves `entry` so that it ends up at position `index`.
+        """
+        old = self.index(entry)
+        entries = list(self)
+        del entries[old]
+        index = max(0, min(index, len(entries)))
+
+        entries.insert(index, entry)
+        self._rebuild(entries)
+        self._notify('move', old, index)
+
+    def remove_range(self, start, stop=None):
+        """
+            Removes and returns the entries at positions [start, stop).
+        """
+        stop = self._len if stop is None else min(stop, self._len)
+        start = max(start, 0)
+        if start >= stop:
+            return []
+
+        removed = [self._slots[self._slot_at(i)] for i in range(start, stop)]
+        for entry in removed:
+            self._take(self._slot_of[entry])
+        self._notify('remove', start, stop - start)
+        return removed
+
+    def shuffle(self):
+        entries = list(self)
+        random.shuffle(entries)
+        self._rebuild(entries)
+        self._notify('reset')
+
+    def __repr__(self):
+        return '<EntryQueue of %s entries>' % self._len
+
+
+class FairEntryQueue:
+    """
+        The play queue when FairQueue is on: requesters take turns instead of playing in order of
+        arrival, so somebody queueing a 300 song playlist gets every n-th song, not the next 300.
+
+        Every author has a sub-queue (an EntryQueue) and the k-th entry of a sub-queue plays in round
+        base + k.  A round plays one entry of each author that has one.  Who is next is kept as two
+        rotations, the authors still due in the current round and the ones already served, so popleft
+        is O(1).  Position, queue time and lookup by position are computed from the sub-queues,
+        O(authors * log n), per-author counts and cache_key refcounts are O(1).
+        Entries added with appendleft (play next) play before any round.
+
+        Same interface as EntryQueue except move, which the rotation decides.
+    """
+
+    def __init__(self, entries=()):
+        self.version = 0
+        self.listener = None
+        self._reset()
+        for entry in entries:
+            self._add(entry)
+
+    def _notify(self, op, *args):
+        if self.listener:
+            self.listener(op, *args)
+
+    def _reset(self):
+        self.version += 1
+        self._front = EntryQueue()
+        self._subqueues = {}
+        self._base = {}
+        self._seq = {}
+        self._served = set()
+        self._current = deque()
+        self._following = deque()
+        self._round = 0
+        self._next_seq = 0
+        self._len = 0
+        self._keys = Counter()
+
+    def _order(self, key):
+        # Order within a round: the authors already served this round go first in the rounds after it
+        return self._base[key] == self._round, self._seq[key]
+
+    def _join(self, key, rnd):
+        self._base[key] = rnd
+        self._seq[key] = self._next_seq
+        self._next_seq += 1
+        (self._current if rnd == self._round else self._following).append(key)
+        self._advance()
+
+    def _leave(self, key):
+        del self._subqueues[key]
+        del self._base[key]
+        del self._seq[key]
+
+    def _advance(self):
+        if not self._current and self._following:
+            self._round += 1
+            self._current, self._following = self._following, deque()
+            self._served.clear()
+
+    def _count(self, entry, delta):
+        self.version += 1
+        self._len += delta
+        self._keys[entry.cache_key] += delta
+        if not self._keys[entry.cache_key]:
+            del self._keys[entry.cache_key]
+
+    def _add(self, entry):
+        key = _author_key(entry)
+        sub = self._subqueues.get(key)
+        if sub is None:
+            sub = self._subqueues[key] = EntryQueue()
+            self._join(key, self._round + 1 if key in self._served else self._round)
+
+        sub.append(entry)
+        self._count(entry, 1)
+
+    def _discard(self, entry):
+        if entry in self._front:
+            self._front.remove(entry)
+        else:
+            key = _author_key(entry)
+            sub = self._subqueues[key]
+            sub.remove(entry)
+            if not sub:
+                (self._current if self._base[key] == self._round else self._following).remove(key)
+                self._leave(key)
+                self._advance()
+
+        self._count(entry, -1)
+
+    def _authors_at(self, rnd):
+        """
+            The authors with an entry in round `rnd`, in the order they play in it.
+        """
+        base = self._base
+        authors = [k for k, sub in self._subqueues.items() if base[k] <= rnd < base[k] + len(sub)]
+        authors.sort(key=self._order)
+        return authors
+
+    def _before(self, rnd):
+        # Number of sub-queue entries in the rounds before `rnd`
+        base = self._base
+        return sum(min(max(rnd - base[k], 0), len(sub)) for k, sub in self._subqueues.items())
+
+    def _locate(self, k):
+        """
+            (author, depth in their sub-queue) of the k-th (0 based) entry after the front.
+        """
+        lo = self._round
+        hi = max(self._base[key] + len(sub) for key, sub in self._subqueues.items())
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self._before(mid) <= k:
+                lo = mid
+            else:
+                hi = mid
+
+        key = self._authors_at(lo)[k - self._before(lo)]
+        return key, lo - self._base[key]
+
+    def _position(self, key, depth):
+        rnd = self._base[key] + depth
+        order = self._order(key)
+
+        ahead = len(self._front) + self._before(rnd)
+        for k, sub in self._subqueues.items():
+            if k != key and self._base[k] <= rnd < self._base[k] + len(sub) and self._order(k) < order:
+                ahead += 1
+        return ahead
+
+    def _until(self, count, prefix, value):
+        total = getattr(self._front, prefix)(count)
+        count -= len(self._front)
+        if count <= 0:
+            return total
+
+        if count >= self._len - len(self._front):
+            return total + sum(getattr(sub, prefix)(len(sub)) for sub in self._subqueues.values())
+
+        key, depth = self._locate(count)
+        rnd = self._base[key] + depth
+        for k, sub in self._subqueues.items():
+            total += getattr(sub, prefix)(min(max(rnd - self._base[k], 0), len(sub)))
+        for k in self._authors_at(rnd):
+            if k == key:
+                break
+            total += value(self._subqueues[k][rnd - self._base[k]])
+        return total
+
+    # deque compatible
+
+    def append(self, entry):
+        if entry in self:
+            self.remove(entry)
+
+        self._add(entry)
+        self._notify('append', entry)
+
+    def appendleft(self, entry):
+        if entry in self:
+            self.remove(entry)
+
+        self._front.appendleft(entry)
+        self._count(entry, 1)
+        self._notify('appendleft', entry)
+
+    def popleft(self):
+        if self._front:
+            entry = self._front.popleft()
+        elif self._current:
+            key = self._current.popleft()
+            sub = self._subqueues[key]
+            entry = sub.popleft()
+
+            self._served.add(key)
+            if sub:
+                self._join(key, self._round + 1)
+            else:
+                self._leave(key)
+            self._advance()
+        else:
+            raise IndexError('pop from an empty queue')
+
+        self._count(entry, -1)
+        self._notify('popleft')
+        return entry
+
+    def remove(self, entry):
+        if entry not in self:
+            raise ValueError('entry not in queue')
+
+        index = self.index(entry)
+        self._discard(entry)
+        self._notify('remove', index, 1)
+
+    def clear(self):
+        self._reset()
+        self._notify('clear')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('queue index out of range')
+
+        if index < len(self._front):
+            return self._front[index]
+
+        key, depth = self._locate(index - len(self._front))
+        return self._subqueues[key][depth]
+
+    def __iter__(self):
+        yield from self._front
+        if not self._subqueues:
+            return
+
+        entries = {key: iter(sub) for key, sub in self._subqueues.items()}
+        end = max(self._base[key] + len(sub) for key, sub in self._subqueues.items())
+        for rnd in range(self._round, end):
+            for key in self._authors_at(rnd):
+                yield next(entries[key])
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __contains__(self, entry):
+        if entry in self._front:
+            return True
+        sub = self._subqueues.get(_author_key(entry))
+        return sub is not None and entry in sub
+
+    # indexed operations
+
+    def index(self, entry):
+        """
+            0 based position of `entry`.
+        """
+        if entry in self._front:
+            return self._front.index(entry)
+
+        key = _author_key(entry)
+        sub = self._subqueues.get(key)
+        if sub is None:
+            raise ValueError('entry not in queue')
+        return self._position(key, sub.index(entry))
+
+    def duration_until(self, count):
+        """
+            Total duration of the first `count` entries.
+        """
+        return self._until(count, 'duration_until', lambda e: e.duration or 0)
+
+    def live_until(self, count):
+        """
+            Number of live streams among the first `count` entries.
+        """
+        return self._until(count, 'live_until', lambda e: 1 if e.is_live else 0)
+
+    def count_for(self, author):
+        key = getattr(author, 'id', author)
+        sub = self._subqueues.get(key)
+        return self._front.count_for(key) + (len(sub) if sub is not None else 0)
+
+    def refs(self, key):
+        """
+            Number of queued entries playing `key` (a cache_key).
+        """
+        return self._keys.get(key, 0)
+
+    def queued_within(self, key, count):
+        """
+            Whether an entry playing `key` is among the last `count` entries.
+        """
+        if key not in self._keys:
+            return False
+
+        last = self._front.last_index(key)
+        for author, sub in self._subqueues.items():
+            depth = sub.last_index(key)
+            if depth is not None:
+                last = max(last if last is not None else -1, self._position(author, depth))
+        return self._len - last <= count
+
+    def move(self, entry, index):
+        raise ValueError('the fair queue orders entries by itself')
+
+    def remove_range(self, start, stop=None):
+        """
+            Removes and returns the entries at positions [start, stop).
+        """
+        stop = self._len if stop is None else min(stop, self._len)
+        start = max(start, 0)
+        if start >= stop:
+            return []
+
+        removed = [self[i] for i in range(start, stop)]
+        for entry in removed:
+            self._discard(entry)
+        self._notify('remove', start, stop - start)
+        return removed
+
+    def shuffle(self):
+        """
+            Shuffles every author's songs, the turns stay as they are.
+        """
+        for sub in self._subqueues.values():
+            sub.shuffle()
+        self.version += 1
+        self._notify('reset')
+
+    # QueueJournal
+
+    def state(self, dump):
+        """
+            The queue including whose turn it is, json friendly, `dump` turns an entry into a dict.
+        """
+        return {
+            'round': self._round,
+            'served': list(self._served),
+            'front': [dump(e) for e in self._front],
+            'authors': [[key, self._base[key], [dump(e) for e in self._subqueues[key]]]
+                        for key in list(self._current) + list(self._following)],
+        }
+
+    def restore(self, state, load):
+        """
+            Replaces the contents with a `state()`, `load` turns a dict back into an entry.
+        """
+        self._reset()
+        self._round = state['round']
+        self._served = set(state['served'])
+
+        for data in state['front']:
+            entry = load(data)
+            self._front.append(entry)
+            self._count(entry, 1)
+
+        for key, base, entries in state['authors']:
+            sub = self._subqueues[key] = EntryQueue()
+            self._join(key, base)
+            for data in entries:
+                entry = load(data)
+                sub.append(entry)
+                self._count(entry, 1)
+
+    def __repr__(self):
+        return '<FairEntryQueue of %s entries, %s authors>' % (self._len, len(self._subqueues))
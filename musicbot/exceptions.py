@@ -30,6 +30,16 @@ class WrongEntryTypeError(ExtractionError):
         self.is_playlist = is_playlist
         self.use_url = use_url
 
+# The song is longer than what the requester may queue, raised before it gets near the queue
+class SongTooLongError(ExtractionError):
+    def __init__(self, message, duration):
+        super().__init__(message)
+        self.duration = duration
+
+# The song is already queued too close to where it would go
+class DuplicateSongError(ExtractionError):
+    pass
+
 # The user doesn't have permission to use a command
 class PermissionsError(CommandError):
     @property
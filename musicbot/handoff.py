@@ -0,0 +1,65 @@
+import os
+import json
+import time
+
+
+def save_handoff(bot, path):
+    """
+        Writes what the next MusicBot needs to carry on where this one stops: per guild the voice channel,
+        the current entry and the frame it is at, the volume, the learned read-ahead depth, the recently
+        played entries and, when no QueueJournal keeps it already, the queue.
+    """
+    guilds = []
+
+    for guild_id, player in bot.voice_client_list.items():
+        if player.is_dead or not player.voice_client:
+            continue
+
+        entry, source = player.current_entry, player._snd_source
+        position = source.frames / 50 if entry and source and not entry.is_live else 0
+
+        guilds.append({
+            'guild': guild_id,
+            'channel': player.voice_client.channel.id,
+            'entry': entry.to_dict() if entry else None,
+            'position': position,
+            'volume': player.volume,
+            'readahead_depth': player.readahead_depth,
+            'recent': [e.to_dict() for e in player.recent],
+            'queue': None if bot.queue_journal else [e.to_dict() for e in player.playlist.entries],
+        })
+
+    data = {
+        'version': 1,
+        'saved_at': time.time(),
+        'opus_complexity': bot.opus_tuner.complexity,
+        'guilds': guilds,
+    }
+
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+    return len(guilds)
+
+
+def load_handoff(path, max_age=300):
+    """
+        Reads and removes the handoff file.  Returns None if there is none, or if it is older than
+        `max_age` seconds and so wasn't written by the restart that just happened.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    if time.time() - data.get('saved_at', 0) > max_age:
+        return None
+
+    return data
@@ -0,0 +1,76 @@
+import os
+import time
+
+from discord import opus
+
+
+# opus_defines.h, discord.py has no setter for it
+_CTL_SET_COMPLEXITY = 4010
+
+
+class OpusTuner:
+    """
+        Hands out opus encoders configured for the voice channel they encode for.
+
+        The bitrate follows the channel's bitrate, FEC and the expected packet loss come from the config.
+        Complexity is shared: while the process uses more than `cpu_budget` of the machine, every new
+        stream gets one step less, and it climbs back once load is well under budget again.
+        Streams already playing keep what they started with.
+    """
+
+    def __init__(self, *, min_complexity=3, max_complexity=10, cpu_budget=0.75, fec=True, packet_loss=15,
+                 sample_interval=5):
+        self.min_complexity = min_complexity
+        self.max_complexity = max_complexity
+        self.cpu_budget = cpu_budget
+        self.fec = fec
+        self.packet_loss = packet_loss
+        self.sample_interval = sample_interval
+
+        self.complexity = max_complexity
+        self.load = 0.0
+        self.lowered = 0
+        self._cpus = os.cpu_count() or 1
+        self._sampled_at = time.monotonic()
+        self._cpu_at = time.process_time()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(min_complexity=config.opus_min_complexity, max_complexity=config.opus_max_complexity,
+                   cpu_budget=config.opus_cpu_budget, fec=config.opus_fec, packet_loss=config.opus_packet_loss)
+
+    def _sample(self):
+        now = time.monotonic()
+        if now - self._sampled_at < self.sample_interval:
+            return
+
+        cpu = time.process_time()
+        self.load = (cpu - self._cpu_at) / ((now - self._sampled_at) * self._cpus)
+        self._sampled_at, self._cpu_at = now, cpu
+
+        if self.load > self.cpu_budget and self.complexity > self.min_complexity:
+            self.complexity -= 1
+            self.lowered += 1
+            print("[Opus] CPU使用率 %.0f%% のため複雑度を %s に下げます" % (self.load * 100, self.complexity))
+
+        elif self.load < self.cpu_budget * 0.6 and self.complexity < self.max_complexity:
+            self.complexity += 1
+
+    @staticmethod
+    def bitrate_for(channel):
+        # discord.py takes kbps and clamps it to what opus accepts
+        bitrate = getattr(channel, 'bitrate', None)
+        return bitrate // 1000 if bitrate else 128
+
+    def encoder_for(self, channel=None, bitrate=None):
+        """
+            A new opus.Encoder for a stream starting now in `channel` (or at `bitrate` kbps).
+        """
+        self._sample()
+
+        encoder = opus.Encoder()
+        encoder.set_bitrate(bitrate or self.bitrate_for(channel))
+        encoder.set_fec(self.fec)
+        encoder.set_expected_packet_loss_percent(self.packet_loss / 100 if self.fec else 0)
+        opus._lib.opus_encoder_ctl(encoder._state, _CTL_SET_COMPLEXITY, self.complexity)
+        return encoder
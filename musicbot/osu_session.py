@@ -0,0 +1,120 @@
+import os
+import pickle
+import random
+import threading
+import traceback
+
+import cfscrape
+
+from .exceptions import ExtractionError
+
+
+class OsuWebSession:
+    """
+        The one authenticated osu! web session of the bot, shared by every guild's playlist.
+
+        Cookies are kept on disk so a restart doesn't have to go through Cloudflare and the login again.
+        Logging in only happens when a request actually comes back unauthenticated (401, or redirected to
+        an html page), and only one thread logs in at a time; the others wait and reuse that login.
+        All methods are blocking, call them from the thread pool.
+    """
+
+    FORUM_URL = 'https://osu.ppy.sh/community/forums'
+    LOGIN_URL = 'https://osu.ppy.sh/session'
+
+    def __init__(self, username, password, cookie_file=None):
+        self.username = username
+        self.password = password
+        self.cookie_file = cookie_file
+
+        self._sess = None
+        self._sess_lock = threading.Lock()
+        self._login_lock = threading.Lock()
+        self._generation = 0
+        self.login_count = 0
+
+    @property
+    def sess(self):
+        if self._sess is None:
+            with self._sess_lock:
+                if self._sess is None:
+                    sess = cfscrape.create_scraper(delay=random.randint(7, 15))
+                    self._load_cookies(sess)
+                    self._sess = sess
+        return self._sess
+
+    def _load_cookies(self, sess):
+        if not self.cookie_file or not os.path.isfile(self.cookie_file):
+            return
+
+        try:
+            with open(self.cookie_file, 'rb') as f:
+                sess.cookies.update(pickle.load(f))
+            print("[osu!にログイン] 保存されたセッションを読み込みました")
+        except Exception:
+            traceback.print_exc()
+            print("[osu!にログイン] 保存されたセッションを読み込めませんでした")
+
+    def save_cookies(self):
+        if not self.cookie_file:
+            return
+
+        tmp = self.cookie_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.sess.cookies, f)
+        os.replace(tmp, self.cookie_file)
+
+    def login(self):
+        with self._login_lock:
+            return self._login()
+
+    def _login(self):
+        sess = self.sess
+        params = {
+            'username': '%s' % self.username,
+            'password': '%s' % self.password
+        }
+        sess.get(self.FORUM_URL)
+        params['_token'] = sess.cookies['XSRF-TOKEN']
+        res = sess.post(self.LOGIN_URL, data=params)
+        self.login_count += 1
+        print("[osu!にログイン] サーバーからの応答：%s" % res.status_code)
+        res.raise_for_status()
+
+        self._generation += 1
+        self.save_cookies()
+        return res
+
+    @staticmethod
+    def _unauthenticated(res, expect):
+        if res.status_code == 401:
+            return True
+
+        # Unauthenticated downloads get redirected to a regular page
+        content_type = res.headers.get('Content-Type', '')
+        return bool(res.history) and not (expect and content_type.startswith(expect))
+
+    def get(self, url, *, expect=None, **kwargs):
+        """
+            GETs `url` with the shared session, logging in once if the response says we aren't.
+            `expect` is the Content-Type prefix the caller needs; anything else is an ExtractionError.
+        """
+        generation = self._generation
+        res = self.sess.get(url, **kwargs)
+
+        if self._unauthenticated(res, expect):
+            res.close()
+
+            with self._login_lock:
+                # Someone else may have logged in while we were waiting
+                if self._generation == generation:
+                    self._login()
+
+            res = self.sess.get(url, **kwargs)
+
+        if expect and not res.headers.get('Content-Type', '').startswith(expect):
+            res.close()
+            raise ExtractionError("Unexpected response from %s (%s %s)" % (
+                url, res.status_code, res.headers.get('Content-Type')))
+
+        return res
@@ -0,0 +1,154 @@
+import os
+import shlex
+import shutil
+import struct
+import zipfile
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+
+# Layout of a zip local file header, see zipfile.structFileHeader
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+_LH_FILENAME_LENGTH = 10
+_LH_EXTRA_FIELD_LENGTH = 11
+
+
+class OszAudioMember:
+    """
+        Points at the audio file of a beatmap set inside a (stored or deflated) .osz archive.
+
+        Stored members are handed to ffmpeg by byte range through the subfile protocol, so ffmpeg
+        reads the archive directly.  Deflated members are inflated by a writer thread into a pipe.
+    """
+
+    def __init__(self, archive, name, offset, size, stored):
+        self.archive = archive
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.stored = stored
+
+    @classmethod
+    def from_zipinfo(cls, archive, zip_file, info):
+        stored = info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1
+        offset = None
+
+        if stored:
+            with open(archive, 'rb') as f:
+                f.seek(info.header_offset)
+                header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+
+            offset = info.header_offset + _LOCAL_HEADER.size \
+                + header[_LH_FILENAME_LENGTH] + header[_LH_EXTRA_FIELD_LENGTH]
+
+        return cls(archive, info.filename, offset, info.file_size, stored)
+
+    @property
+    def ffmpeg_url(self):
+        """
+            The subfile url ffmpeg can read a stored member from.  Only valid for stored members.
+        """
+        return 'subfile,,start,{},end,{},,:{}'.format(self.offset, self.offset + self.size, self.archive)
+
+    def open_pipe(self):
+        """
+            Returns a readable file object (with a real fd) that yields the inflated member.
+            The member is copied into the pipe by a daemon thread.
+        """
+        rfd, wfd = os.pipe()
+
+        def _writer():
+            try:
+                with zipfile.ZipFile(self.archive, 'r') as zip_file, \
+                        zip_file.open(self.name) as member, \
+                        os.fdopen(wfd, 'wb') as pipe:
+                    for chunk in iter(lambda: member.read(64 * 1024), b''):
+                        pipe.write(chunk)
+
+            except (BrokenPipeError, OSError):
+                # ffmpeg was killed before it finished reading (skip, stop...)
+                pass
+
+        threading.Thread(target=_writer, name='osz-pipe', daemon=True).start()
+        return os.fdopen(rfd, 'rb')
+
+    def probe_duration(self):
+        if self.stored:
+            return _probe_duration(self.ffmpeg_url)
+
+        # Over a pipe ffprobe can't seek and usually reports no duration, so it gets a seekable copy
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(self.name)[1])
+        try:
+            with os.fdopen(fd, 'wb') as copy, \
+                    zipfile.ZipFile(self.archive, 'r') as zip_file, \
+                    zip_file.open(self.name) as member:
+                shutil.copyfileobj(member, copy, 64 * 1024)
+            return _probe_duration(path)
+        finally:
+            os.unlink(path)
+
+    def __repr__(self):
+        return '<OszAudioMember {}!{} ({})>'.format(
+            os.path.basename(self.archive), self.name, 'stored' if self.stored else 'deflated')
+
+
+def _probe_duration(url):
+    cmd = "ffprobe -v error -show_entries format=duration -of default=noprint_wrappers=1:nokey=1 \"%s\"" % url
+    p = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE)
+    out = p.communicate()[0]
+
+    try:
+        return float(out)
+    except ValueError:
+        return 0.0
+
+
+def _parse_osu(lines):
+    afn = tit = utit = None
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line.startswith("AudioFilename:"):
+            afn = line[15:]
+        elif line.startswith("Title:"):
+            tit = line[6:]
+        elif line.startswith("TitleUnicode:"):
+            utit = line[13:]
+            break
+        elif line.startswith("[Difficulty]"):
+            break
+
+    return utit or tit, afn
+
+
+def detect_archive(osz, bidhash=None):
+    """
+        Archive counterpart of Playlist.detecter.  Picks the difficulty (by md5 when bidhash is given)
+        and returns (title, OszAudioMember, duration, beatmapset id) without extracting anything.
+    """
+    with zipfile.ZipFile(osz, 'r') as zip_file:
+        osu_infos = [i for i in zip_file.infolist() if i.filename.endswith('.osu')]
+
+        if not osu_infos:
+            raise ValueError("No .osu file in %s" % osz)
+
+        osu_info = osu_infos[0]
+        if bidhash:
+            for info in osu_infos:
+                if hashlib.md5(zip_file.read(info)).hexdigest() == bidhash[1]:
+                    osu_info = info
+                    break
+
+        title, audio_name = _parse_osu(zip_file.read(osu_info).decode('utf_8').splitlines())
+
+        members = {i.filename.lower(): i for i in zip_file.infolist()}
+        audio_info = members.get((audio_name or '').lower())
+        if not audio_info:
+            raise ValueError("Audio file %s not found in %s" % (audio_name, osz))
+
+        member = OszAudioMember.from_zipinfo(osz, zip_file, audio_info)
+
+    dosz_id = os.path.basename(osz).split(' ')[0]
+    return title, member, member.probe_duration(), dosz_id
@@ -1,14 +1,19 @@
 import os
+import time
+import ctypes
 import asyncio
+import threading
 import audioop
+import functools
 import traceback
 
 from enum import Enum
 from array import array
 from collections import deque
 from shutil import get_terminal_size
-from discord import AudioSource, FFmpegPCMAudio, PCMVolumeTransformer, AudioSource
+from discord import AudioSource, FFmpegPCMAudio
 
+from .broadcast import BroadcastSource
 from .lib.event_emitter import EventEmitter
 
 
@@ -86,25 +91,245 @@ class MusicPlayerState(Enum):
     def __str__(self):
         return self.name
 
-class SourcePlaybackCounter(AudioSource):
-    def __init__(self, source, progress = 0):
-        self._source = source
-        self.progress = progress
+class PlaybackSource(FFmpegPCMAudio):
+    """
+        The single AudioSource a track is played through: ffmpeg, volume and the playback counter in one layer.
+
+        A reader thread decodes ahead of playback into a bounded queue of preallocated ctypes buffers,
+        which the opus encoder takes as they are, so a stall in ffmpeg's output doesn't reach the voice
+        thread until the queue runs dry.  Every time it does (an underrun) the target depth doubles,
+        and it shrinks back slowly after `relax_frames` frames without one.
+
+        The volume the track started with is applied by ffmpeg.  After a volume change the difference is
+        ramped in over `ramp_frames` frames with audioop, meanwhile MusicPlayer starts a source with the
+        new volume baked in a little ahead and bake() switches over to it once playback gets there.
+        Only a live stream, which can't be restarted at a position, keeps scaling every frame.
+
+        If ffmpeg exits with an error the source keeps the voice thread waiting instead of ending the
+        track, so PlaybackWatchdog can restart it; handoff() passes a waiting read on to the replacement.
+    """
+
+    FRAME_SIZE = 3840       # 20ms of 48kHz 16 bit stereo
+    ramp_frames = 10
+    min_depth = 10          # frames, 200ms
+    max_depth = 150         # 3s
+    relax_frames = 1500     # 30s
+
+    def __init__(self, source, *, volume=1.0, filters=(), options='-vn', progress=0, depth=None, **kwargs):
+        # ffmpeg can't change its volume filter once started, a silent start still bakes 1.0
+        self._baked_volume = volume if volume > 0 else 1.0
+        self._gain = self._target_gain = volume / self._baked_volume
+        self._ramp_step = 0.0
+        self.frames = progress
+
+        self.depth = min(max(depth or self.min_depth, self.min_depth), self.max_depth)
+        self.underruns = 0
+        self.stalled = 0.0
+        self.produced = 0
+        self.exit_code = None
+        self._relaxed_at = progress
+        self._successor = None
+        self._baking = None
+        self._on_baked = None
+
+        self._cond = threading.Condition()
+        self._ready = deque()
+        self._free = []
+        self._handed = None
+        self._eof = False
+        self._closed = False
+
+        filters = list(filters)
+        if self._baked_volume != 1.0:
+            filters.append('volume=%.3f' % self._baked_volume)
+        if filters:
+            options = '%s -af %s' % (options, ','.join(filters))
+
+        super().__init__(source, options=options, **kwargs)
+
+        threading.Thread(target=self._reader, name='readahead', daemon=True).start()
+
+    @property
+    def volume(self):
+        return self._baked_volume * self._target_gain
+
+    @volume.setter
+    def volume(self, value):
+        self._target_gain = max(value, 0.0) / self._baked_volume
+        self._ramp_step = (self._target_gain - self._gain) / self.ramp_frames
+
+    @property
+    def buffered(self):
+        return len(self._ready)
+
+    @property
+    def needs_bake(self):
+        # Silence and the baked volume itself cost nothing per frame
+        return self._target_gain not in (0.0, 1.0)
+
+    @property
+    def crashed(self):
+        return self._eof and not self._closed and self.exit_code not in (0, None)
+
+    @property
+    def finished(self):
+        return self._eof and not self._ready
+
+    def _reader(self):
+        cond = self._cond
+        try:
+            while True:
+                with cond:
+                    while not self._closed and len(self._ready) >= self.depth:
+                        cond.wait()
+                    if self._closed:
+                        return
+                    buf = self._free.pop() if self._free else (ctypes.c_char * self.FRAME_SIZE)()
+
+                # Outside the lock, this is the part that stalls
+                full = self._stdout.readinto(buf) == self.FRAME_SIZE
+
+                if not full:
+                    try:
+                        exit_code = self._process.wait(timeout=5)
+                    except Exception:
+                        exit_code = None
+
+                with cond:
+                    if not full:
+                        self.exit_code = exit_code
+                        self._eof = True
+                        cond.notify_all()
+                        return
+                    self._ready.append(buf)
+                    self.produced += 1
+                    cond.notify_all()
+
+        except (ValueError, OSError):
+            # stdout was closed under us by cleanup()
+            with cond:
+                self._eof = True
+                cond.notify_all()
+
+    def _next_frame(self):
+        cond = self._cond
+        with cond:
+            if self._handed is not None:
+                self._free.append(self._handed)
+                self._handed = None
+
+            # A crashed ffmpeg keeps the voice thread waiting too, whether the reader saw it exit before
+            # or while we wait, until PlaybackWatchdog restarts it or the track is skipped (cleanup)
+            if not self._ready and not self._closed and not (self._eof and not self.crashed):
+                # The very first frame is startup latency, not a stall
+                if self.frames and not self._eof:
+                    self.underruns += 1
+                    self.depth = min(self.depth * 2, self.max_depth)
+                    self._relaxed_at = self.frames
+
+                t0 = time.monotonic()
+                while not self._ready and not self._closed and not (self._eof and not self.crashed):
+                    cond.wait()
+                if self.frames:
+                    self.stalled += time.monotonic() - t0
+
+            if not self._ready:
+                return None
+
+            buf = self._handed = self._ready.popleft()
+
+            if self.frames - self._relaxed_at > self.relax_frames and self.depth > self.min_depth:
+                self.depth = max(self.depth * 3 // 4, self.min_depth)
+                self._relaxed_at = self.frames
+
+            cond.notify_all()
+            return buf
 
     def read(self):
-        res = self._source.read()
-        if res:
-            self.progress += 1
-        return res
+        baking = self._baking
+        if baking is not None and self.frames >= baking.frames:
+            with self._cond:
+                baking, self._baking = self._baking, None
+        else:
+            baking = None
+
+        if baking is not None:
+            if self.frames == baking.frames and baking.buffered and self._gain == self._target_gain:
+                # Playback caught up with it, it continues from this very frame
+                self.handoff(baking)
+                self._on_baked(baking)
+                return baking.read()
+            # It fell behind, this track keeps its gain
+            baking.cleanup()
+
+        buf = self._next_frame()
+        if buf is None:
+            # Replaced while the voice thread was waiting on us
+            successor = self._successor
+            return successor.read() if successor else b''
+
+        self.frames += 1
+
+        if self._gain != self._target_gain:
+            self._gain += self._ramp_step
+            if (self._ramp_step > 0) == (self._gain >= self._target_gain):
+                self._gain = self._target_gain
+
+        elif self._gain == 1.0:
+            return buf
+
+        elif self._gain == 0.0:
+            ctypes.memset(buf, 0, self.FRAME_SIZE)
+            return buf
+
+        return audioop.mul(buf, 2, min(self._gain, 2.0))
 
     def get_progress(self):
-        return self.progress * 0.02
+        return self.frames * 0.02
+
+    def handoff(self, successor):
+        """
+            Retires this source for `successor`, which the voice client has already been switched to.
+        """
+        self._successor = successor
+        self.cleanup()
+
+    def bake(self, successor, on_baked=None):
+        """
+            Switches over to `successor` once playback reaches the frame it starts at, then calls
+            `on_baked(successor)` from the voice thread.  Replaces a pending switch, None just cancels it.
+        """
+        with self._cond:
+            previous, self._baking = self._baking, None
+            if not self._closed:
+                self._baking, self._on_baked = successor, on_baked
+            elif successor:
+                previous = successor
+
+        if previous:
+            previous.cleanup()
 
     def cleanup(self):
-        self._source.cleanup()
+        with self._cond:
+            self._closed = True
+            self._ready.clear()
+            baking, self._baking = self._baking, None
+            self._cond.notify_all()
+
+        if baking:
+            baking.cleanup()
+        super().cleanup()
 
 
 class MusicPlayer(EventEmitter):
+    # Finished entries kept for replay; with SaveVideos off their files are only deleted once they drop out
+    recent_size = 20
+    # Read-ahead a live stream starts with, and how often in a row a dropped stream is reconnected
+    live_depth = 25
+    live_max_drops = 5
+    # Seconds ahead of playback ffmpeg is restarted at after a volume change, to be running by then
+    bake_lead = 1.0
+
     def __init__(self, bot, voice_client, playlist):
         super().__init__()
         self.bot = bot
@@ -112,15 +337,26 @@ class MusicPlayer(EventEmitter):
         self.voice_client = voice_client
         self.playlist = playlist
         self.playlist.on('entry-added', self.on_entry_added)
+        self.playlist.on('entries-reordered', self.on_entries_reordered)
         self._volume = bot.config.default_volume
 
         self._play_lock = asyncio.Lock()
         self._current_voice_client = None
         self._snd_source = None
         self._current_entry = None
+        self._standby = None
+        self._resume_at = None
+        self._start_at = None
+        self._skipped = False
+        self.restarts = 0
+        self.recent = deque()
+        self._detached_client = None
         self.state = MusicPlayerState.STOPPED
 
-        self.loop.create_task(self.websocket_check())
+        # Read-ahead depth carried over between tracks, and underruns of finished tracks
+        self.readahead_depth = None
+        self.underruns = 0
+        self.stalled = 0.0
 
     @property
     def volume(self):
@@ -129,19 +365,37 @@ class MusicPlayer(EventEmitter):
     @volume.setter
     def volume(self, value):
         self._volume = value
-        if self._snd_source:
-            self._snd_source._source.volume = value
+        if self._standby and self._standby[1].volume != value:
+            # It has the old volume baked in, the whole next track would be scaled frame by frame
+            self._discard_standby()
+            self.loop.create_task(self._prepare_standby())
+
+        if isinstance(self._snd_source, BroadcastSource):
+            # A shared broadcast has its volume baked in, continue on a private pipeline
+            self._go_private()
+        elif self._snd_source:
+            self._snd_source.volume = value
+            self._bake_volume()
 
     def on_entry_added(self, playlist, entry):
         if self.is_stopped:
             self.loop.call_later(2, self.play)
 
+        elif playlist.peek() is entry:
+            self.loop.create_task(self._prepare_standby())
+
+    def on_entries_reordered(self, playlist):
+        if not self.is_stopped and not self.is_dead:
+            self.loop.create_task(self._prepare_standby())
+
     def skip(self):
+        self._skipped = True
         self._kill_current_voice_client()
 
     def stop(self):
         self.state = MusicPlayerState.STOPPED
         self._kill_current_voice_client()
+        self._discard_standby()
 
         self.emit('stop', player=self)
 
@@ -163,6 +417,10 @@ class MusicPlayer(EventEmitter):
         if self.is_playing:
             self.state = MusicPlayerState.PAUSED
 
+            if isinstance(self._snd_source, BroadcastSource):
+                # The broadcast won't wait for us
+                self._go_private()
+
             if self._current_voice_client:
                 self._current_voice_client.pause()
 
@@ -179,31 +437,81 @@ class MusicPlayer(EventEmitter):
         self.playlist.clear()
         self._events.clear()
         self._kill_current_voice_client()
+        self._discard_standby()
+
+    def _playback_finished(self, error=None, voice_client=None):
+        if voice_client is not None and voice_client is self._detached_client:
+            # The old connection of a reconnect, reload_voice carries on with the entry
+            return
 
-    def _playback_finished(self, error=None):
         entry = self._current_entry
 
+        if error and not self.voice_client.is_connected():
+            # Called from the voice thread
+            self.bot.voice_supervisor.notify_threadsafe(self.voice_client.guild, 'playback error')
+
         if self._current_voice_client:
             self._current_voice_client.after = None
             self._kill_current_voice_client()
 
+        source, self._snd_source = self._snd_source, None
         self._current_entry = None
-        self._snd_source = None
+
+        skipped, self._skipped = self._skipped, False
+        if entry and entry.is_live and not skipped and not self.is_stopped and not self.is_dead:
+            # A live stream only ends when it drops, queue it again with a fresh url
+            if source and source.frames > 60 * 50:
+                entry.drops = 0
+            entry.drops += 1
+            if entry.drops <= self.live_max_drops:
+                print("[ライブ配信] %s が途切れました、再接続します (%s/%s)" % (entry.title, entry.drops, self.live_max_drops))
+                entry.expire()
+                self.loop.call_soon_threadsafe(self.playlist.add_entry_next, entry)
+            else:
+                print("[ライブ配信] %s に再接続できませんでした" % entry.title)
+
+        if source:
+            self.readahead_depth = source.depth or self.readahead_depth
+            self.underruns += source.underruns
+            self.stalled += source.stalled
 
         if not self.is_stopped and not self.is_dead:
-            self.play(_continue=True)
+            # Called from the voice thread
+            self.loop.call_soon_threadsafe(self.play, True)
+
+        if entry:
+            self.loop.call_soon_threadsafe(self._remember, entry)
+
+        self.emit('finished-playing', player=self, entry=entry)
 
-        if not self.bot.config.save_videos and entry:
-            if any([entry.filename == e.filename for e in self.playlist.entries]):
+    def _remember(self, entry):
+        if entry in self.recent:
+            self.recent.remove(entry)
+        self.recent.appendleft(entry)
+
+        if len(self.recent) <= self.recent_size:
+            return
+
+        dropped = self.recent.pop()
+        if not self.bot.config.save_videos and not dropped.is_live:
+            key = dropped.cache_key
+            in_use = self.playlist.entries.refs(key) \
+                or any(e.cache_key == key for e in self.recent) \
+                or (self._current_entry and self._current_entry.cache_key == key)
+
+            if in_use:
                 print("[Config:SaveVideos] Skipping deletion, found song in queue")
 
             else:
-                # print("[Config:SaveVideos] Deleting file: %s" % os.path.relpath(entry.filename))
-                asyncio.ensure_future(self._delete_file(entry.filename))
-
-        self.emit('finished-playing', player=self, entry=entry)
+                # print("[Config:SaveVideos] Deleting file: %s" % os.path.relpath(dropped.filename))
+                asyncio.ensure_future(self._delete_file(dropped.filename))
 
     def _kill_current_voice_client(self):
+        if self._snd_source:
+            # stop() only flags the voice thread, it may be waiting inside read() for a stalled or crashed
+            # ffmpeg; cleanup wakes it up and read() ends the track
+            self._snd_source.cleanup()
+
         if self._current_voice_client:
             if self.is_paused:
                 self.resume()
@@ -269,19 +577,38 @@ class MusicPlayer(EventEmitter):
                 self._kill_current_voice_client()
                 #print("entry.filename：{}".format(entry.filename))
 
-                self._snd_source = SourcePlaybackCounter(
-                    PCMVolumeTransformer(
-                        FFmpegPCMAudio(
-                            entry.filename,
-                            before_options="-nostdin",
-                            options="-vn -af dynaudnorm=f=100:p=0.953:m=27"
-                            # Threadsafe call soon, b/c after will be called from the voice playback thread.
-                
-                        ),
-                        self.volume
-                    )
-                )
-                self.voice_client.play(self._snd_source, after=self._playback_finished)
+                start_at, self._start_at = self._start_at, None
+                start = start_at[1] if start_at and start_at[0] is entry and not entry.is_live else 0
+
+                if start:
+                    self._discard_standby()
+                    source = None
+                else:
+                    source = self._take_standby(entry)
+                if source:
+                    source.volume = self.volume
+
+                tuner = self.bot.opus_tuner
+                bitrate = tuner.bitrate_for(self.voice_client.channel)
+
+                hub = self.bot.broadcast_hub
+                if hub:
+                    key = hub.key(self._source_path(entry), start, self.volume, bitrate)
+                    shared = hub.attach(key)
+                    if shared:
+                        if source:
+                            source.cleanup()
+                        source = shared
+                    else:
+                        source = hub.start(key, source or self._create_ffmpeg_source(entry, start=start), tuner.encoder_for(bitrate=bitrate))
+
+                elif not source:
+                    source = self._create_ffmpeg_source(entry, start=start)
+
+                self._snd_source = source
+                if not source.is_opus():
+                    self.voice_client.encoder = tuner.encoder_for(bitrate=bitrate)
+                self.voice_client.play(self._snd_source, after=functools.partial(self._playback_finished, voice_client=self.voice_client))
                 #self._current_player.setDaemon(True)
                 
                 
@@ -291,37 +618,275 @@ class MusicPlayer(EventEmitter):
                 # I need to add ytdl hooks
                 self.state = MusicPlayerState.PLAYING
                 self._current_entry = entry
+                self.restarts = 0
 
                 #self._current_player.start()
                 self.emit('play', player=self, entry=entry)
 
+                self.loop.create_task(self._prepare_standby())
+
+    async def _prepare_standby(self):
+        """
+            Starts ffmpeg for the next entry ahead of time, its read-ahead buffers the first frames,
+            so the end of the current track (or a skip) can switch over right away.
+        """
+        entry = self.playlist.peek()
+        if not entry or self.is_dead:
+            # Whatever it was started for was removed or the queue cleared
+            self._discard_standby()
+            return
+
+        if self._standby and self._standby[0] is entry:
+            return
+
+        if entry.is_live:
+            # A pre-started stream would only fall behind the live edge
+            self._discard_standby()
+            return
+
+        try:
+            await entry.get_ready_future()
+        except Exception:
+            # get_next_entry will run into (and report) the same error
+            return
+
+        if self.is_dead or self.is_stopped or self.playlist.peek() is not entry:
+            return
+
+        if self._standby and self._standby[0] is entry:
+            return
+
+        self._discard_standby()
+
+        try:
+            self._standby = (entry, self._create_ffmpeg_source(entry))
+        except Exception:
+            traceback.print_exc()
+
+    def _take_standby(self, entry):
+        standby, self._standby = self._standby, None
+        if not standby:
+            return None
+
+        if standby[0] is not entry:
+            self._cleanup_standby(standby)
+            return None
+
+        return standby[1]
+
+    def _discard_standby(self):
+        standby, self._standby = self._standby, None
+        if standby:
+            self._cleanup_standby(standby)
+
+    @staticmethod
+    def _cleanup_standby(standby):
+        try:
+            standby[1].cleanup()
+        except Exception:
+            traceback.print_exc()
+
+    @staticmethod
+    def _source_path(entry):
+        archive = getattr(entry, 'archive', None)
+        if archive:
+            return '%s!%s' % (archive.archive, archive.name)
+        return entry.filename
+
+    def _create_ffmpeg_source(self, entry, start=0, **kwargs):
+        archive = getattr(entry, 'archive', None)
+        kwargs.setdefault('volume', self.volume)
+        kwargs.setdefault('depth', self.readahead_depth)
+
+        if entry.is_live:
+            # Nothing touches the disk, ffmpeg reads the stream and reconnects when the connection drops
+            kwargs['depth'] = max(kwargs['depth'] or 0, self.live_depth)
+            return PlaybackSource(
+                entry.filename,
+                before_options="-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin",
+                filters=['dynaudnorm=f=100:p=0.953:m=27'],
+                **kwargs
+            )
+
+        # Seeking before -i, ffmpeg skips ahead in the input instead of decoding up to there
+        seek = '-ss %.2f ' % start if start else ''
+        kwargs['progress'] = int(start * 50)
+
+        if archive and not archive.stored:
+            # Deflated .osz member, inflate it into ffmpeg's stdin
+            return PlaybackSource(
+                archive.open_pipe(),
+                pipe=True,
+                before_options=seek.strip() or None,
+                filters=['dynaudnorm=f=100:p=0.953:m=27'],
+                **kwargs
+            )
+
+        return PlaybackSource(
+            archive.ffmpeg_url if archive else entry.filename,
+            before_options=seek + "-nostdin",
+            filters=['dynaudnorm=f=100:p=0.953:m=27'],
+            **kwargs
+        )
+
+    def _go_private(self):
+        """
+            Moves the current track from a shared broadcast onto its own ffmpeg at the same position.
+        """
+        if self._snd_source:
+            self._restart_current(self._snd_source.get_progress())
+
+    def _restart_current(self, start):
+        old, entry = self._snd_source, self._current_entry
+        if not entry or not old or not self._current_voice_client:
+            return False
+
+        source = self._create_ffmpeg_source(entry, start=start)
+        self._snd_source = source
+        if not source.is_opus():
+            # Coming off a shared broadcast the voice client may never have had an encoder
+            self._current_voice_client.encoder = self.bot.opus_tuner.encoder_for(self._current_voice_client.channel)
+        self._current_voice_client.source = source
+        old.handoff(source)
+
+        if self.is_paused:
+            # Setting the source resumes the voice client
+            self._current_voice_client.pause()
+        return True
+
+    def _bake_volume(self):
+        """
+            Starts the current track again `bake_lead` seconds ahead with the new volume applied by ffmpeg,
+            the current source ramps to it meanwhile and switches over when playback gets there.
+        """
+        source, entry = self._snd_source, self._current_entry
+        if not isinstance(source, PlaybackSource) or not entry:
+            return
+
+        if not source.needs_bake or entry.is_live:
+            source.bake(None)
+            return
+
+        baked = self._create_ffmpeg_source(entry, start=source.frames / 50 + self.bake_lead)
+        source.bake(baked, lambda baked: self.loop.call_soon_threadsafe(self._baked, source, baked))
+
+    def _baked(self, old, baked):
+        if self._snd_source is not old or not self._current_voice_client:
+            # Skipped or restarted in the meantime
+            baked.cleanup()
+            return
+
+        self._snd_source = baked
+        self._current_voice_client.source = baked
+        if self.is_paused:
+            # Setting the source resumes the voice client
+            self._current_voice_client.pause()
+
+    def recover(self, reason):
+        """
+            Restarts a stalled or crashed ffmpeg at the last frame played.  After `max_restarts` restarts
+            of the same track it is skipped instead.  Returns False if it skipped.
+        """
+        source = self._snd_source
+        if not source or not self._current_entry:
+            return True
+
+        self.restarts += 1
+        if self.restarts > self.bot.config.ffmpeg_max_restarts:
+            print("[ウォッチドッグ] %s を再開できませんでした、スキップします" % self._current_entry.title)
+            self.skip()
+            return False
+
+        position = source.frames / 50
+        print("[ウォッチドッグ] %s: %s のため %d:%02d から再開します (%s/%s)" % (
+            self._current_entry.title, reason, *divmod(int(position), 60), self.restarts, self.bot.config.ffmpeg_max_restarts))
+        self._restart_current(position)
+        return True
+
+    def seek(self, seconds):
+        """
+            Restarts the current track at `seconds` with an input seek on the cached file.
+            The playback counter continues from there.  Returns the position actually seeked to.
+        """
+        entry = self._current_entry
+        if not entry:
+            raise ValueError('Nothing is playing')
+
+        if entry.is_live:
+            raise ValueError('Cannot seek in a live stream')
+
+        if entry.duration:
+            seconds = min(seconds, max(entry.duration - 1, 0))
+        seconds = max(seconds, 0)
+
+        if not self._restart_current(seconds):
+            raise ValueError('Cannot seek in state %s' % self.state)
+        return seconds
+
+    def replay(self, entry):
+        """
+            Plays `entry` (from self.recent) next, straight from its cached file, skipping the current track.
+        """
+        if entry.is_live:
+            entry.drops = 0
+            entry.expire()
+        elif not entry.filename or not os.path.exists(entry.filename):
+            raise FileNotFoundError(entry.filename)
+
+        self.playlist.add_entry_next(entry)
+
+        if self.is_playing or self.is_paused:
+            self.skip()
+        elif self.is_stopped:
+            self.play()
+
+    def resume_entry(self, entry, seconds):
+        """
+            Plays `entry` next, starting `seconds` in.  Carries the current track over a restart.
+        """
+        self._start_at = (entry, seconds)
+        self.playlist.add_entry_next(entry)
+
+        if self.is_stopped:
+            self.play()
+
     def _monkeypatch_player(self, voice_client):
         original_buff = voice_client.buff
         voice_client.source = PatchedBuff(original_buff)
         return voice_client
 
+    def detach_voice(self):
+        """
+            Call before the voice client is disconnected for a reconnect.  Remembers the current entry
+            and the exact frame it is at, so reload_voice can carry on from there.
+        """
+        self._detached_client = self.voice_client
+
+        if self._current_entry and self._snd_source:
+            self._resume_at = (self._current_entry, self._snd_source.frames)
+
     def reload_voice(self, voice_client):
         self.voice_client = voice_client
-        #if self._current_voice_client:
-            #self._current_voice_client.player = voice_client.play_audio
-            #self._current_player._resumed.clear()
-            #self._current_player._connected.set()
 
-    async def websocket_check(self):
-        if self.bot.config.debug_mode:
-            print("[Debug] Creating websocket check loop")
+        resume, self._resume_at = self._resume_at, None
+        if not resume or self.is_stopped or self.is_dead:
+            return
 
-        while not self.is_dead:
-            try:
-                self.voice_client.ws.ensure_open()
-                assert self.voice_client.ws.open
-            except:
-                if self.bot.config.debug_mode:
-                    print("[Debug] Voice websocket is %s, reconnecting" % self.voice_client.ws.state_name)
-                await self.bot.reconnect_voice_client(self.voice_client.channel.server)
-                await asyncio.sleep(4)
-            finally:
-                await asyncio.sleep(1)
+        entry, frames = resume
+        if entry is not self._current_entry:
+            return
+
+        # Input seek on the cached file, no download and no restart of the track
+        source = self._create_ffmpeg_source(entry, start=frames / 50)
+        self._snd_source = source
+        self._current_voice_client = voice_client
+        voice_client.encoder = self.bot.opus_tuner.encoder_for(voice_client.channel)
+        voice_client.play(source, after=functools.partial(self._playback_finished, voice_client=voice_client))
+
+        if self.is_paused:
+            voice_client.pause()
+
+        print("[再接続] %s を %d:%02d から再開します" % (entry.title, *divmod(frames // 50, 60)))
 
     @property
     def current_entry(self):
@@ -343,6 +908,25 @@ class MusicPlayer(EventEmitter):
     def is_dead(self):
         return self.state == MusicPlayerState.DEAD
 
+    @property
+    def live_latency(self):
+        """
+            Roughly how far behind the stream listeners are: what sits decoded in the read-ahead.
+        """
+        if self._current_entry and self._current_entry.is_live and self._snd_source:
+            return self._snd_source.buffered * 0.02
+
+    @property
+    def readahead_stats(self):
+        """
+            (buffered frames, target depth, underruns, seconds stalled) including the current track.
+        """
+        source = self._snd_source
+        if not source:
+            return 0, self.readahead_depth or PlaybackSource.min_depth, self.underruns, self.stalled
+
+        return source.buffered, source.depth, self.underruns + source.underruns, self.stalled + source.stalled
+
     @property
     def progress(self):
         if self._snd_source:
@@ -10,14 +10,15 @@ import zipfile
 import re
 import time
 import hashlib
-import cfscrape
-from collections import deque
 from itertools import islice
-from random import shuffle
 
 from .utils import get_header, calc_dur_ffprobe
-from .entry import URLPlaylistEntry, OsuLocalPlaylistEntry
-from .exceptions import ExtractionError, WrongEntryTypeError
+from .entry import URLPlaylistEntry, StreamPlaylistEntry, OsuLocalPlaylistEntry
+from .disk_queue import DiskEntryQueue
+from .entry_queue import EntryQueue, FairEntryQueue
+from .osz import detect_archive
+from .constants import OSZ_CACHE_PATH
+from .exceptions import ExtractionError, WrongEntryTypeError, SongTooLongError, DuplicateSongError
 from .lib.event_emitter import EventEmitter
 from .config import Config, ConfigDefaults
 #from concurrent.futures import ThreadPoolExecutor
@@ -29,54 +30,72 @@ class Playlist(EventEmitter):
         A playlist is manages the list of songs that will be played.
     """
 
+    import_page_size = 50
+    import_progress_interval = 5
+
     def __init__(self, bot, config_file=ConfigDefaults.options_file):
         super().__init__()
         self.bot = bot
         self.loop = bot.loop
         #self.thread_pool = ThreadPoolExecutor(max_workers=2)
         self.downloader = bot.downloader
-        self.entries = deque()
+        # Bumped by clear, running stream_playlist imports stop when it changes
+        self._import_epoch = 0
         self.osz_url = "https://osu.ppy.sh/d/"
-        self.config = Config(config_file)
-        self.sess = cfscrape.create_scraper(delay=random.randint(7,15))
+        self.config = bot.config if bot.config.config_file == config_file else Config(config_file)
+        if self.config.disk_queue:
+            self.entries = DiskEntryQueue(self)
+        else:
+            self.entries = FairEntryQueue() if self.config.fair_queue else EntryQueue()
+        self.osu_session = bot.osu_session
         self.osumdir = self.config.osumdir
-        self.osulogon = False
-        self.osudl = Downloader
-        self.osuloginTry = 0
 
     def __iter__(self):
         return iter(self.entries)
 
-    def login(self, redto=None):
-        params = {
-            'username': '%s' % self.config.osuid,
-            'password': '%s' % self.config.osupassword
-            #'redirect': '%s' % redto if redto else 'index.php',
-            #'sid': '',
-            #'login': 'Login'
-        }
-        self.sess.get('https://osu.ppy.sh/community/forums')
-        params['_token']=self.sess.cookies['XSRF-TOKEN']
-        res = self.sess.post('https://osu.ppy.sh/session', data=params, cookies=self.sess.cookies)
-        self.osuloginTry+=1
-        print ("[osu!にログイン] サーバーからの応答：%s ; %s" % (res.status_code,res.headers))
-        if self.osuloginTry>=3:
-            res.raise_for_status()
-        return res
+    def login(self):
+        return self.osu_session.login()
 
     def shuffle(self):
-        shuffle(self.entries)
+        self.entries.shuffle()
+        self.emit('entries-reordered', playlist=self)
 
     def clear(self):
+        self._import_epoch += 1
         self.entries.clear()
+        self.emit('entries-reordered', playlist=self)
 
-    async def add_entry(self, song_url, **meta):
+    def move_entry(self, entry, position):
+        """
+            Moves a queued entry to `position` (0 based).
+        """
+        self.entries.move(entry, position)
+        self._head_changed()
+
+    def remove_entries(self, start, stop=None):
+        """
+            Removes the entries at positions [start, stop) and returns them.
+        """
+        removed = self.entries.remove_range(start, stop)
+        if removed:
+            self._head_changed()
+        return removed
+
+    def _head_changed(self):
+        self.emit('entries-reordered', playlist=self)
+
+        entry = self.peek()
+        if entry:
+            entry.get_ready_future()
+
+    async def add_entry(self, song_url, *, max_duration=None, **meta):
         """
             Validates and adds a song_url to be played. This does not start the download of the song.
 
             Returns the entry & the position it is in the queue.
 
             :param song_url: The song url to add to the playlist.
+            :param max_duration: Raise SongTooLongError instead of queueing songs longer than this.
             :param meta: Any additional metadata to add to the playlist entry.
         """
 
@@ -92,6 +111,9 @@ class Playlist(EventEmitter):
         if info.get('_type', None) == 'playlist':
             raise WrongEntryTypeError("This is a playlist.", True, info.get('webpage_url', None) or info.get('url', None))
 
+        if max_duration and (info.get('duration') or 0) > max_duration:
+            raise SongTooLongError('%s is longer than %ss' % (song_url, max_duration), info['duration'])
+
         if info['extractor'] in ['generic', 'Dropbox']:
             try:
                 # unfortunately this is literally broken
@@ -104,6 +126,13 @@ class Playlist(EventEmitter):
                 print("[Warning] Failed to get content type for url %s (%s)" % (song_url, e))
                 content_type = None
 
+            if content_type and content_type.startswith('audio/') and not info.get('is_live'):
+                # Internet radio: an audio response that never says how long it is
+                try:
+                    info['is_live'] = not await get_header(self.bot.aiosession, info['url'], 'CONTENT-LENGTH')
+                except Exception:
+                    pass
+
             if content_type:
                 if content_type.startswith(('application/', 'image/')):
                     if '/ogg' not in content_type:  # How does a server say `application/ogg` what the actual fuck
@@ -112,24 +141,36 @@ class Playlist(EventEmitter):
                 elif not content_type.startswith(('audio/', 'video/')):
                     print("[Warning] Questionable content type \"%s\" for url %s" % (content_type, song_url))
 
-        entry = URLPlaylistEntry(
-            self,
-            song_url,
-            info.get('title', 'Untitled'),
-            info.get('duration', 0) or 0,
-            self.downloader.ytdl.prepare_filename(info),
-            **meta
-        )
+        if info.get('is_live'):
+            # Streamed straight into ffmpeg, _really_download would try to save it forever
+            entry = StreamPlaylistEntry(
+                self,
+                song_url,
+                info.get('title', 'Untitled'),
+                info.get('url'),
+                **meta
+            )
+        else:
+            entry = URLPlaylistEntry(
+                self,
+                song_url,
+                info.get('title', 'Untitled'),
+                info.get('duration', 0) or 0,
+                self.downloader.ytdl.prepare_filename(info),
+                **meta
+            )
         self._add_entry(entry)
-        return entry, len(self.entries)
+        return entry, self.entries.index(entry) + 1
 
-    async def import_from(self, playlist_url, **meta):
+    async def import_from(self, playlist_url, *, max_duration=None, **meta):
         """
             Imports the songs from `playlist_url` and queues them to be played.
 
-            Returns a list of `entries` that have been enqueued.
+            Returns a list of `entries` that have been enqueued, the position of the first one and how many
+            songs were left out for being longer than `max_duration`.
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param max_duration: Leave out songs longer than this, before they are queued
             :param meta: Any additional metadata to add to the playlist entry
         """
         position = len(self.entries) + 1
@@ -150,8 +191,12 @@ class Playlist(EventEmitter):
             url_field = 'webpage_url'
 
         baditems = 0
+        dropped = 0
         for items in info['entries']:
-            if items:
+            if items and max_duration and (items.get('duration') or 0) > max_duration:
+                dropped += 1
+
+            elif items:
                 try:
                     entry = URLPlaylistEntry(
                         self,
@@ -164,6 +209,8 @@ class Playlist(EventEmitter):
 
                     self._add_entry(entry)
                     entry_list.append(entry)
+                except DuplicateSongError:
+                    baditems += 1
                 except:
                     baditems += 1
                     # Once I know more about what's happening here I can add a proper message
@@ -176,94 +223,123 @@ class Playlist(EventEmitter):
         if baditems:
             print("Skipped %s bad entries" % baditems)
 
-        return entry_list, position
+        if entry_list and entry_list[0] in self.entries:
+            # Taking turns may have put it before the end
+            position = self.entries.index(entry_list[0]) + 1
 
-    async def async_process_youtube_playlist(self, playlist_url, **meta):
-        """
-            Processes youtube playlists links from `playlist_url` in a questionable, async fashion.
+        return entry_list, position, dropped
 
-            :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
-            :param meta: Any additional metadata to add to the playlist entry
+    async def stream_playlist(self, playlist_url, *, limit=None, max_duration=None, progress=None, info=None, **meta):
         """
+            Queues the songs of a youtube playlist, soundcloud set or bandcamp album while it is still being read.
 
-        try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
-        except Exception as e:
-            raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
-
-        if not info:
-            raise ExtractionError('Could not extract information from %s' % playlist_url)
-
-        gooditems = []
-        baditems = 0
-        for entry_data in info['entries']:
-            if entry_data:
-                baseurl = info['webpage_url'].split('playlist?list=')[0]
-                song_url = baseurl + 'watch?v=%s' % entry_data['id']
-
-                try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
-                except ExtractionError:
-                    baditems += 1
-                except Exception as e:
-                    baditems += 1
-                    print("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e))
-            else:
-                baditems += 1
+            The playlist is consumed page by page in the downloader's threads and every song is queued as soon
+            as it resolves, so the first one starts playing while the rest is still being fetched.
+            `progress(added, processed)` is awaited at most every `import_progress_interval` seconds.
+            Clearing the queue cancels the import.
 
-        if baditems:
-            print("Skipped %s bad entries" % baditems)
+            Songs longer than `max_duration` never reach the queue.  The flat playlist pages already carry
+            most durations, only songs without one are checked when they resolve.
 
-        return gooditems
-
-    async def async_process_sc_bc_playlist(self, playlist_url, **meta):
-        """
-            Processes soundcloud set and bancdamp album links from `playlist_url` in a questionable, async fashion.
+            Returns (entries added, items processed, songs too long, cancelled).
 
             :param playlist_url: The playlist url to be cut into individual urls and added to the playlist
+            :param limit: Stop after this many songs were queued
+            :param max_duration: Leave out songs longer than this
+            :param info: The unprocessed extract_info result of `playlist_url`, if the caller already has it
             :param meta: Any additional metadata to add to the playlist entry
         """
-
-        try:
-            info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
-        except Exception as e:
-            raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
+        if not info:
+            try:
+                info = await self.downloader.safe_extract_info(self.loop, playlist_url, download=False, process=False)
+            except Exception as e:
+                raise ExtractionError('Could not extract information from {}\n\n{}'.format(playlist_url, e))
 
         if not info:
             raise ExtractionError('Could not extract information from %s' % playlist_url)
 
-        gooditems = []
+        if info['extractor'].lower().startswith('youtube'):
+            baseurl = info['webpage_url'].split('playlist?list=')[0]
+            item_url = lambda item: baseurl + 'watch?v=%s' % item['id']
+        else:
+            item_url = lambda item: item['url']
+
+        epoch = self._import_epoch
+        items = iter(info['entries'])
+        added = []
+        processed = 0
         baditems = 0
-        for entry_data in info['entries']:
-            if entry_data:
-                song_url = entry_data['url']
+        dropped = 0
+        reported = time.monotonic()
+
+        while True:
+            # Pulling items makes ytdl fetch the next page, keep that off the loop
+            page = await self.loop.run_in_executor(
+                self.downloader.thread_pool, lambda: list(islice(items, self.import_page_size)))
+            if not page:
+                break
+
+            for item in page:
+                if self._import_epoch != epoch:
+                    print("[インポート] キューが空にされたため中止しました (%s個登録済み)" % len(added))
+                    return added, processed, dropped, True
+
+                if limit is not None and len(added) >= limit:
+                    return added, processed, dropped, False
+
+                processed += 1
+                if not item:
+                    baditems += 1
+                    continue
+
+                if max_duration and (item.get('duration') or 0) > max_duration:
+                    dropped += 1
+                    continue
 
                 try:
-                    entry, elen = await self.add_entry(song_url, **meta)
-                    gooditems.append(entry)
+                    entry, _ = await self.add_entry(item_url(item), max_duration=max_duration, **meta)
+                    added.append(entry)
+                except SongTooLongError:
+                    dropped += 1
                 except ExtractionError:
                     baditems += 1
                 except Exception as e:
                     baditems += 1
                     print("There was an error adding the song {}: {}: {}\n".format(
-                        entry_data['id'], e.__class__.__name__, e))
-            else:
-                baditems += 1
+                        item.get('id'), e.__class__.__name__, e))
+
+                if progress and time.monotonic() - reported >= self.import_progress_interval:
+                    reported = time.monotonic()
+                    await progress(len(added), processed)
 
         if baditems:
             print("Skipped %s bad entries" % baditems)
 
-        return gooditems
+        return added, processed, dropped, self._import_epoch != epoch
+
+    def _check_duplicate(self, entry):
+        within = self.config.no_duplicates_within
+        if within and self.entries.queued_within(entry.cache_key, within):
+            raise DuplicateSongError('**%s** はもうリストの最後の%s個の中にあります' % (entry.title, within), expire_in=30)
 
     def _add_entry(self, entry):
+        self._check_duplicate(entry)
         self.entries.append(entry)
         self.emit('entry-added', playlist=self, entry=entry)
 
         if self.peek() is entry:
             entry.get_ready_future()
 
+    def add_entry_next(self, entry):
+        """
+            Puts an already prepared entry at the head of the queue.
+        """
+        self.entries.appendleft(entry)
+        self.emit('entry-added', playlist=self, entry=entry)
+
+        if self.peek() is entry:
+            entry.get_ready_future()
+
     async def get_next_entry(self, predownload_next=True):
         """
             A coroutine which will return the next song or None if no songs left to play.
@@ -294,28 +370,28 @@ class Playlist(EventEmitter):
         """
             (very) Roughly estimates the time till the queue will 'position'
         """
-        estimated_time = sum([e.duration for e in islice(self.entries, position - 1)])
-
-        # When the player plays a song, it eats the first playlist item, so we just have to add the time back
-        if not player.is_stopped and player.current_entry:
-            estimated_time += player.current_entry.duration - player.progress
-
-        return datetime.timedelta(seconds=estimated_time)
+        return self.estimate_time_until_notasync(position, player)
 
     def estimate_time_until_notasync(self, position, player):
         """
             (very) Roughly estimates the time till the queue will 'position'
+            Returns None when a live stream plays before it, those don't end on their own.
         """
-        estimated_time = sum([e.duration for e in islice(self.entries, position - 1)])
+        if self.entries.live_until(position - 1):
+            return None
+
+        estimated_time = self.entries.duration_until(position - 1)
 
         # When the player plays a song, it eats the first playlist item, so we just have to add the time back
         if not player.is_stopped and player.current_entry:
-            estimated_time += player.current_entry.duration - player.progress
+            if player.current_entry.is_live:
+                return None
+            estimated_time += max(player.current_entry.duration - player.progress, 0)
 
         return datetime.timedelta(seconds=estimated_time)
 
     def count_for_user(self, user):
-        return sum(1 for e in self.entries if e.meta.get('author', None) == user)
+        return self.entries.count_for(user)
 
     def osu_apl(self):
         files = os.listdir(self.osumdir)
@@ -323,6 +399,9 @@ class Playlist(EventEmitter):
         return files_dir
 
     def chk_beatmapset_found(self, osz_id):
+        known = self.bot.beatmap_downloads.lookup(osz_id)
+        if known:
+            return known if os.path.isdir(known) else False
         beatmapsetlist=os.listdir(self.osumdir)
         detected_beatmapset=[d for d in beatmapsetlist if d.startswith("{} ".format(osz_id)) and os.path.isdir(os.path.join(self.osumdir, d))]
         if len(detected_beatmapset)==0:
@@ -330,6 +409,18 @@ class Playlist(EventEmitter):
         else:
             return os.path.join(self.osumdir, detected_beatmapset[0])
 
+    def chk_beatmap_archive_found(self, osz_id):
+        known = self.bot.beatmap_downloads.lookup(osz_id)
+        if known:
+            return known if os.path.isfile(known) else False
+        if not os.path.isdir(OSZ_CACHE_PATH):
+            return False
+        detected_archive=[f for f in os.listdir(OSZ_CACHE_PATH) if f.startswith("{} ".format(osz_id)) and f.endswith(".osz")]
+        if len(detected_archive)==0:
+            return False
+        else:
+            return os.path.join(OSZ_CACHE_PATH, detected_archive[0])
+
     #async def sDL(self, osz_id):
         #if not self.osulogon:
             #self.login()
@@ -363,45 +454,12 @@ class Playlist(EventEmitter):
                 #await self.osudl.osuDown(fname, dres)
                 #return
 
-    async def download(self, osz_id, busymsg=None, player=None, bidhash=None, **meta):
-        if not self.osulogon:
-            self.login()
-            time.sleep(2)
-            self.osulogon = True
-        dres = self.sess.get("https://osu.ppy.sh/beatmapsets/" + osz_id + "/download", stream=True, cookies=self.sess.cookies)
-        if dres.headers['Content-Type'] == 'application/download':
-            print(dres.headers)
-            #raw_url = dres.history[0].headers['Location']
-            fname = dres.headers['Content-Disposition'][21:-2].replace("\\", "")
-            print("ファイル名：{}".format(fname))
-            osuapl = []
-            osuapl.append(self.osu_apl())
-            if os.path.splitext(fname)[0] in self.osu_apl():
-                print ("[osu!譜面ダウンローダー]もうあるみたいだよ？")
-                return os.path.join(self.osumdir, os.path.splitext(fname)[0])
-            else:
-                print (meta.items())
-                return await self.osudl.osuDown(self.downloader,self, osz_id, fname=fname, dres=dres, busymsg=busymsg, player=player, bidhash=bidhash, **meta)
-        else:
-            self.osulogon=False
-            return await self.download(osz_id, busymsg=busymsg, bidhash=bidhash, **meta)
-            #dres = self.sess.get("https://osu.ppy.sh/d/" + osz_id, stream=True)
-            #raw_url = dres.history[0].headers['Location']
-            #fname =raw_url[raw_url.find("?fs=")+4:raw_url.find("&fd=")].replace("%20", " ")
-            #print("ファイル名：{}".format(fname))
-            #osuapl = []
-            #osuapl.append(self.osu_apl())
-            #if fname.split(".")[0] in self.osu_apl():
-                #print ("[osu!譜面ダウンローダー]もうあるみたいだよ？")
-                #return os.path.join(self.osumdir, os.path.splitext(fname)[0])
-            #else:
-                #with open(fname, 'wb') as file:
-                    #for chunk in dres.iter_content(chunk_size=56*1024):
-                        #if chunk:
-                            #file.write(chunk)
-                            #file.flush()
-                    #file.close()
-                    #return fname
+    async def download(self, osz_id, busymsg=None, **_):
+        """
+            Downloads a beatmap set through the bot's download manager and returns its song directory
+            (or its archive when extraction is disabled).
+        """
+        return await self.bot.beatmap_downloads.fetch(self, osz_id, busymsg=busymsg)
 
     async def unzip(self, osz, dcdir):
         with zipfile.ZipFile(osz, 'r') as zip_file:
@@ -493,6 +551,7 @@ class Playlist(EventEmitter):
         return os.path.join(*sanitized_path)
 
     async def add_entry_raw(self, osz_id=None, songdir=None, busymsg=None, bidhash=None, player=None, **meta):
+        archive = None
         if not osz_id and not songdir:
             print("[osu!譜面レジスタ]レジストにはIDまたはディレクトリの指定が必要です。処理は中断します。")
         elif not osz_id:
@@ -501,11 +560,19 @@ class Playlist(EventEmitter):
             title, music_filename, duration, osz_idd = self.detecter(dsongdir, bidhash=bidhash)
         else:
             print(meta)
-            if not self.chk_beatmapset_found(osz_id):
-                return await self.download(osz_id, busymsg=busymsg, player=player,bidhash=bidhash, **meta)
-            else:
+            if self.chk_beatmapset_found(osz_id):
                 songdir=self.chk_beatmapset_found(osz_id)
                 title, music_filename, duration, _ = self.detecter(songdir, bidhash=bidhash)
+            elif self.chk_beatmap_archive_found(osz_id):
+                music_filename=self.chk_beatmap_archive_found(osz_id)
+                title, archive, duration, _ = detect_archive(music_filename, bidhash=bidhash)
+            else:
+                downloaded = await self.download(osz_id, busymsg=busymsg)
+                if os.path.isdir(downloaded):
+                    title, music_filename, duration, _ = self.detecter(downloaded, bidhash=bidhash)
+                else:
+                    music_filename = downloaded
+                    title, archive, duration, _ = detect_archive(downloaded, bidhash=bidhash)
                 #if osz.endswith(".osz"):
                     #omdir = self.config.osumdir
                     #namedir = osz.split(".")[0]
@@ -531,6 +598,7 @@ class Playlist(EventEmitter):
                 "[osu!譜面]" + title,
                 round(duration),
                 filename=audio_filename,
+                archive=archive,
                 **meta
             )
             self.entries.append(entry)
@@ -538,7 +606,7 @@ class Playlist(EventEmitter):
 
             if self.peek() is entry:
                 entry.get_ready_future()
-            return entry, len(self.entries)
+            return entry, self.entries.index(entry) + 1
         
         elif osz_id:
             print("指定されたoszのID：{}".format(osz_id))
@@ -550,6 +618,7 @@ class Playlist(EventEmitter):
                     "[osu!譜面]" + title,
                     round(duration),
                     filename=audio_filename,
+                    archive=archive,
                     **meta
                 )
                 self.entries.append(entry)
@@ -558,7 +627,7 @@ class Playlist(EventEmitter):
                 if self.peek() is entry:
                     entry.get_ready_future()
 
-                return entry, len(self.entries)
+                return entry, self.entries.index(entry) + 1
             else:
                 entry = OsuLocalPlaylistEntry(
                     self,
@@ -567,6 +636,7 @@ class Playlist(EventEmitter):
                     "[osu!譜面]" + title,
                     round(duration),
                     filename=audio_filename,
+                    archive=archive,
                     **meta
                 )
                 self.entries.append(entry)
@@ -575,36 +645,21 @@ class Playlist(EventEmitter):
                 if self.peek() is entry:
                     entry.get_ready_future()
 
-                return entry, len(self.entries)
+                return entry, self.entries.index(entry) + 1
 
     def chk_name(self, osz_id=None,  busymsg=None, **meta):
-        dres = self.sess.get("https://osu.ppy.sh/d/" + osz_id, stream=True)
-        if dres.headers['Content-Type'] == 'application/download':
-            print(dres.headers)
-            raw_url = dres.history[0].headers['Location']
-            fname =raw_url[raw_url.find("?fs=")+4:raw_url.find("&fd=")].replace("%20", " ")
-            print("ファイル名：{}".format(fname))
-            osuapl = [].append(self.osu_apl())
-            if os.path.splitext(fname)[0] in self.osu_apl():
-                print ("[osu!譜面ダウンローダー]もうあるみたいだよ？")
-                return os.path.join(self.osumdir, os.path.splitext(fname)[0])
-            else:
-                print ("Error!:not correctry downloaded!")
-                return
+        dres = self.osu_session.get("https://osu.ppy.sh/d/" + osz_id, stream=True, expect='application/download')
+        dres.close()
+        print(dres.headers)
+        raw_url = dres.history[0].headers['Location']
+        fname =raw_url[raw_url.find("?fs=")+4:raw_url.find("&fd=")].replace("%20", " ")
+        print("ファイル名：{}".format(fname))
+        if os.path.splitext(fname)[0] in self.osu_apl():
+            print ("[osu!譜面ダウンローダー]もうあるみたいだよ？")
+            return os.path.join(self.osumdir, os.path.splitext(fname)[0])
         else:
-            self.login()
-            dres = self.sess.get("https://osu.ppy.sh/d/" + osz_id, stream=True, cookies=self.sess.cookies)
-            raw_url = dres.history[0].headers['Location']
-            fname =raw_url[raw_url.find("?fs=")+4:raw_url.find("&fd=")].replace("%20", " ")
-            print("ファイル名：{}".format(fname))
-            osuapl = []
-            osuapl.append(self.osu_apl())
-            if fname.split(".")[0] in self.osu_apl():
-                print ("[osu!譜面ダウンローダー]もうあるみたいだよ？")
-                return os.path.join(self.osumdir, os.path.splitext(fname)[0])
-            else:
-                print ("Error!:not correctry downloaded!")
-                return
+            print ("Error!:not correctry downloaded!")
+            return
 
     #def add_entry_osu(self, osz_id=None,  busymsg=None, **meta):
         #osz = self.chk_name(osz_id, busymsg=busymsg, **meta)
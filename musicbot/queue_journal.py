@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import functools
+import traceback
+
+from .disk_queue import DiskEntryQueue
+from .entry import entry_from_dict
+from .entry_queue import EntryQueue, FairEntryQueue
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+class QueueJournal:
+    """
+        Keeps every guild's queue on disk so a crash or a restart doesn't lose it.
+
+        A guild has a snapshot of its queue and an append-only journal of what changed since (append,
+        appendleft, popleft, remove, move, clear), one compact json line per change, flushed right away.
+        When the journal reaches `snapshot_every` lines, or on a shuffle, a fresh snapshot replaces both.
+        Snapshots are numbered and name the journal that continues them, so a crash in the middle of
+        compacting never replays a journal onto the wrong snapshot.
+
+        Channels and authors are stored by id, restored entries look them up when used (EntryMeta).
+        A FairEntryQueue is snapshotted with its rotation (state()), so the positions in its journal
+        replay onto the same order.  A DiskEntryQueue isn't journaled, its database file here is what's
+        saved.  Switching DiskQueue on or off carries the saved queue over.
+    """
+
+    snapshot_every = 500
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._journals = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _snapshot_path(self, guild_id):
+        return os.path.join(self.directory, '%s.snapshot' % guild_id)
+
+    def _journal_path(self, guild_id, generation):
+        return os.path.join(self.directory, '%s.%s.journal' % (guild_id, generation))
+
+    def _database_path(self, guild_id):
+        return os.path.join(self.directory, '%s.sqlite' % guild_id)
+
+    def _remove(self, guild_id, test):
+        for name in os.listdir(self.directory):
+            if name.startswith('%s.' % guild_id) and test(name):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def attach(self, guild, playlist):
+        """
+            Refills the (new) `playlist` with the queue saved for `guild` and journals it from now on.
+        """
+        started = time.perf_counter()
+        queue = playlist.entries
+        on_disk = isinstance(queue, DiskEntryQueue)
+
+        try:
+            if on_disk:
+                queue.open(self._database_path(guild.id))
+            generation = self._load(guild.id, playlist)
+        except Exception:
+            traceback.print_exc()
+            print("[キュー保存] %s: 保存されていたキューを読み込めませんでした" % guild.name)
+            generation = 0
+            queue.clear()
+
+        if queue:
+            print("[キュー保存] %s: %s個の栗目を復元しました (%.1fms)" % (
+                guild.name, len(queue), (time.perf_counter() - started) * 1000))
+
+        if on_disk:
+            # Whatever a snapshot held is in the database now
+            self._remove(guild.id, lambda name: name.endswith(('.snapshot', '.journal')))
+            return
+
+        if self._snapshot(guild.id, queue, generation + 1):
+            self._remove(guild.id, lambda name: '.sqlite' in name)
+        queue.listener = functools.partial(self._record, guild.id, queue)
+
+    def detach(self, guild, playlist=None):
+        """
+            Stops journaling `guild`, what was saved stays for the next attach.
+        """
+        journal = self._journals.pop(guild.id, None)
+        if journal:
+            journal[1].close()
+
+        if playlist is not None:
+            playlist.entries.listener = None
+            if isinstance(playlist.entries, DiskEntryQueue):
+                playlist.entries.close()
+
+    def forget(self, guild):
+        """
+            Deletes everything saved for `guild`.
+        """
+        self.detach(guild)
+        self._remove(guild.id, lambda name: True)
+
+    def _load(self, guild_id, playlist):
+        """
+            Replays snapshot and journal into `playlist` and returns the snapshot's generation.
+        """
+        queue = playlist.entries
+        database = self._database_path(guild_id)
+        if not isinstance(queue, DiskEntryQueue) and os.path.exists(database):
+            # Saved while DiskQueue was on
+            saved = DiskEntryQueue(playlist, database)
+            for entry in saved:
+                queue.append(entry)
+            saved.close()
+            return 0
+
+        try:
+            with open(self._snapshot_path(guild_id), encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return 0
+
+        load = functools.partial(entry_from_dict, playlist)
+
+        # Replay into the kind of queue that wrote the journal, FairQueue may have been switched since
+        kind = FairEntryQueue if 'fair' in snapshot else EntryQueue
+        replay = queue if isinstance(queue, kind) else kind()
+        if 'fair' in snapshot:
+            replay.restore(snapshot['fair'], load)
+        else:
+            for data in snapshot['entries']:
+                replay.append(load(data))
+
+        generation = snapshot['generation']
+        try:
+            with open(self._journal_path(guild_id, generation), encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            lines = []
+
+        for line in lines:
+            try:
+                op, *args = json.loads(line)
+            except ValueError:
+                # A line torn by the crash itself, it can only be the last one
+                break
+
+            if op == 'append':
+                replay.append(load(args[0]))
+            elif op == 'appendleft':
+                replay.appendleft(load(args[0]))
+            elif op == 'popleft':
+                replay.popleft()
+            elif op == 'remove':
+                replay.remove_range(args[0], args[0] + args[1])
+            elif op == 'move':
+                replay.move(replay[args[0]], args[1])
+            elif op == 'clear':
+                replay.clear()
+
+        if replay is not queue:
+            for entry in replay:
+                queue.append(entry)
+
+        return generation
+
+    def _record(self, guild_id, queue, op, *args):
+        journal = self._journals.get(guild_id)
+        if not journal:
+            return
+
+        generation, f, lines = journal
+        if op in ('reset', 'clear') or lines >= self.snapshot_every:
+            # The queue already includes this change
+            if self._snapshot(guild_id, queue, generation + 1):
+                return
+
+        if op in ('append', 'appendleft'):
+            args = (args[0].to_dict(),)
+
+        try:
+            f.write(_dumps((op,) + args) + '\n')
+            f.flush()
+        except (OSError, TypeError, ValueError):
+            traceback.print_exc()
+            self._snapshot(guild_id, queue, generation + 1)
+            return
+
+        self._journals[guild_id] = (generation, f, lines + 1)
+
+    def _snapshot(self, guild_id, queue, generation):
+        try:
+            path = self._snapshot_path(guild_id)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                if isinstance(queue, FairEntryQueue):
+                    data = {'generation': generation, 'fair': queue.state(lambda e: e.to_dict())}
+                else:
+                    data = {'generation': generation, 'entries': [e.to_dict() for e in queue]}
+                f.write(_dumps(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+
+        except (OSError, TypeError, ValueError):
+            # Keep the previous snapshot and journal, they still describe an older queue
+            traceback.print_exc()
+            return False
+
+        old = self._journals.pop(guild_id, None)
+        if old:
+            old[1].close()
+
+        self._remove(guild_id, lambda name: name.endswith('.journal'))
+
+        self._journals[guild_id] = (generation, open(self._journal_path(guild_id, generation), 'a', encoding='utf-8'), 0)
+        return True
@@ -0,0 +1,54 @@
+import weakref
+
+
+class QueuePages:
+    """
+        The play queue as pages of `page_size` lines, for cmd_リスト.
+
+        Rendered pages are cached per playlist against the queue's version and thrown away as soon as
+        the queue changes.  Rendering runs on the event loop and only touches the entries of the
+        requested page, so identical requests arriving together are served by the first one's render.
+    """
+
+    page_size = 10
+    title_limit = 90
+
+    def __init__(self):
+        self._cache = weakref.WeakKeyDictionary()
+        self.renders = 0
+        self.hits = 0
+
+    def page_count(self, playlist):
+        return max(1, -(-len(playlist.entries) // self.page_size))
+
+    def page(self, playlist, number):
+        """
+            The lines of page `number` (1 based) of `playlist`.
+        """
+        entries = playlist.entries
+
+        cached = self._cache.get(playlist)
+        if not cached or cached[0] != entries.version:
+            cached = self._cache[playlist] = (entries.version, {})
+
+        pages = cached[1]
+        if number in pages:
+            self.hits += 1
+            return pages[number]
+
+        start = (number - 1) * self.page_size
+        stop = min(start + self.page_size, len(entries))
+        lines = pages[number] = [self._line(i, entries[i - 1]) for i in range(start + 1, stop + 1)]
+        self.renders += 1
+        return lines
+
+    def _line(self, position, entry):
+        icon = [":film_frames:", "<:osu:245831611050885121>"][entry.type.value == 'osu']
+
+        title = entry.title
+        if len(title) > self.title_limit:
+            title = title[:self.title_limit - 1] + '…'
+
+        if entry.meta.get('channel', False) and entry.meta.get('author', False):
+            return ':hash:`{}` {}**{}**  :u7533:**{}**'.format(position, icon, title, entry.meta['author'].name)
+        return ':hash:`{}` {}**{}**'.format(position, icon, title)
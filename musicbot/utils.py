@@ -59,6 +59,16 @@ def slugify(value):
     return re.sub('[-\s]+', '-', value)
 
 
+def parse_timestamp(value):
+    """
+    "1:23:45", "2:05" or "125" to seconds.
+    """
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
 def sane_round_int(x):
     return int(decimal.Decimal(x).quantize(1, rounding=decimal.ROUND_HALF_UP))
 
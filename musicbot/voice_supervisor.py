@@ -0,0 +1,135 @@
+import random
+import asyncio
+import traceback
+
+from collections import Counter
+
+
+class VoiceSupervisor:
+    """
+        Watches every guild's voice connection from one place and reconnects the ones that went away.
+
+        Reconnects are triggered by events: the audio player stopping with an error while disconnected,
+        or a region change.  discord.py retries dropped voice websockets by itself, so one slow sweep only
+        catches what it gave up on, and only after a guild was seen disconnected twice in a row.  Being
+        disconnected from the channel on purpose is not reconnected, MusicBot._voice_left ends the player.  Failed reconnects back off exponentially with jitter.
+    """
+
+    def __init__(self, bot, *, base_delay=1, max_delay=120, sweep_interval=30):
+        self.bot = bot
+        self.loop = bot.loop
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sweep_interval = sweep_interval
+
+        self._pending = {}
+        self._attempts = Counter()
+        self._suspects = set()
+        self._sweeper = None
+
+        self.reconnects = Counter()
+        self.failures = Counter()
+        self.reasons = Counter()
+
+    def start(self):
+        if not self._sweeper or self._sweeper.done():
+            self._sweeper = self.loop.create_task(self._sweep())
+
+    def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        for task in self._pending.values():
+            task.cancel()
+        self._pending.clear()
+
+    def notify(self, guild, reason):
+        """
+            Schedules a reconnect of `guild` unless one is already pending.  Must be called on the loop.
+        """
+        if guild.id in self._pending:
+            return
+
+        self.reasons[reason] += 1
+        task = self._pending[guild.id] = self.loop.create_task(self._reconnect(guild, reason))
+        task.add_done_callback(lambda t: self._reconnect_done(guild, t))
+
+    def _reconnect_done(self, guild, task):
+        if self._pending.get(guild.id) is task:
+            del self._pending[guild.id]
+
+        if not task.cancelled() and task.result():
+            self.notify(guild, 'retry')
+
+    def is_reconnecting(self, guild):
+        return guild.id in self._pending
+
+    def notify_threadsafe(self, guild, reason):
+        self.loop.call_soon_threadsafe(self.notify, guild, reason)
+
+    def forget(self, guild):
+        """
+            Drops the state of a guild the bot left on purpose.
+        """
+        task = self._pending.pop(guild.id, None)
+        if task:
+            task.cancel()
+
+        self._attempts.pop(guild.id, None)
+        self._suspects.discard(guild.id)
+
+    def delay(self, attempt):
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(ceiling / 2, ceiling)
+
+    async def _reconnect(self, guild, reason):
+        """
+            Returns True when it failed and should be retried.
+        """
+        try:
+            delay = self.delay(self._attempts[guild.id])
+            print("[ボイス監視] %s: %s のため %.1f秒後に再接続します" % (guild.name, reason, delay))
+            await asyncio.sleep(delay)
+
+            if guild.id not in self.bot.voice_client_list:
+                return False
+
+            await self.bot.reconnect_voice_client(guild)
+
+            self._attempts.pop(guild.id, None)
+            self.reconnects[guild.id] += 1
+            return False
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception:
+            traceback.print_exc()
+            self._attempts[guild.id] += 1
+            self.failures[guild.id] += 1
+            print("[ボイス監視] %s: 再接続に失敗しました (%s回目)" % (guild.name, self._attempts[guild.id]))
+            return True
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+
+            for guild_id, player in list(self.bot.voice_client_list.items()):
+                if player.is_dead or guild_id in self._pending:
+                    continue
+
+                voice_client = player.voice_client
+                if voice_client.is_connected():
+                    self._suspects.discard(guild_id)
+                elif guild_id in self._suspects:
+                    self._suspects.discard(guild_id)
+                    self.notify(voice_client.guild, 'sweep')
+                else:
+                    self._suspects.add(guild_id)
+
+    def stats(self, guild=None):
+        """
+            (reconnects, failures) of `guild`, or of every guild.
+        """
+        if guild:
+            return self.reconnects[guild.id], self.failures[guild.id]
+        return sum(self.reconnects.values()), sum(self.failures.values())
@@ -0,0 +1,90 @@
+import time
+import asyncio
+import traceback
+
+from collections import Counter
+
+from .broadcast import BroadcastSource
+
+
+class PlaybackWatchdog:
+    """
+        Checks every playing guild's ffmpeg from one task.
+
+        A source whose ffmpeg produced no frame for `stall_timeout` seconds while playback is starved,
+        or whose ffmpeg exited with an error, is restarted at the last frame played (MusicPlayer.recover).
+        Every stall, crash and skip is counted per guild and in total.
+    """
+
+    def __init__(self, bot, *, stall_timeout=10, interval=1):
+        self.bot = bot
+        self.loop = bot.loop
+        self.stall_timeout = stall_timeout
+        self.interval = interval
+
+        self._seen = {}
+        self._task = None
+        self.events = Counter()
+        self.guild_events = Counter()
+
+    def start(self):
+        if not self._task or self._task.done():
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def record(self, guild_id, event):
+        self.events[event] += 1
+        self.guild_events[guild_id, event] += 1
+
+    def stats(self, guild=None):
+        """
+            {event: count} of `guild`, or of every guild.
+        """
+        if guild:
+            return {event: n for (gid, event), n in self.guild_events.items() if gid == guild.id}
+        return dict(self.events)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                self._check()
+            except Exception:
+                traceback.print_exc()
+
+    def _check(self):
+        now = time.monotonic()
+
+        for guild_id, player in list(self.bot.voice_client_list.items()):
+            source = player._snd_source
+            if not player.is_playing or source is None:
+                self._seen.pop(guild_id, None)
+                continue
+
+            decoder = source.broadcast.decoder if isinstance(source, BroadcastSource) else source
+
+            if decoder.crashed:
+                self._seen.pop(guild_id, None)
+                self._recover(guild_id, player, 'crash')
+                continue
+
+            # A full read-ahead or a finished track doesn't count, only waiting for ffmpeg does
+            starved = not decoder.buffered and not decoder.finished
+
+            seen = self._seen.get(guild_id)
+            if not starved or not seen or seen[0] is not decoder or seen[1] != decoder.produced:
+                self._seen[guild_id] = (decoder, decoder.produced, now)
+                continue
+
+            if now - seen[2] >= self.stall_timeout:
+                self._seen.pop(guild_id, None)
+                self._recover(guild_id, player, 'stall')
+
+    def _recover(self, guild_id, player, reason):
+        self.record(guild_id, reason)
+        if not player.recover(reason):
+            self.record(guild_id, 'skip')